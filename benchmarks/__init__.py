@@ -0,0 +1,5 @@
+"""Benchmarks for the LLM service.
+
+Run a benchmark as a module from the repository root, e.g.
+``python -m benchmarks.decode_memory``.
+"""
@@ -0,0 +1,152 @@
+"""Benchmark peak memory of decoding review requests.
+
+Compares the legacy decode path (``json.loads`` followed by building the request
+from the resulting ``dict``) against validating the request straight from the
+raw message body. Both the peak RSS while decoding and the RSS still retained
+while the review runs are reported; the legacy path keeps the raw body and the
+parsed ``dict`` alive next to the request. Every measurement runs in a fresh
+subprocess so that peak RSS is not polluted by earlier runs.
+
+Usage: ``python -m benchmarks.decode_memory --sizes 10 25 50``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+FILE_PATCH_BYTES = 64 * 1024
+PATCH_LINE = "+    value = compute_something(value, other_value)  # changed\n"
+
+
+def write_payload(path: Path, size_mb: int) -> int:
+    """Write a synthetic review request of roughly `size_mb` MB to `path`.
+
+    :param path: Where to write the payload.
+    :param size_mb: Approximate payload size in MB.
+    :return: Actual payload size in bytes.
+    """
+    patch = PATCH_LINE * (FILE_PATCH_BYTES // len(PATCH_LINE))
+    file_count = max(1, size_mb * 1024 * 1024 // len(patch))
+
+    with path.open("w") as file_:
+        file_.write('{"review_id": 1, "review_status_id": 1, "file_diffs": [')
+        for index in range(file_count):
+            if index:
+                file_.write(",")
+            file_diff = {
+                "filename": f"src/module_{index}.py",
+                "patch": patch,
+                "additions": 1,
+                "deletions": 0,
+                "changes": 1,
+            }
+            file_.write(json.dumps(file_diff))
+        file_.write("]}")
+
+    return path.stat().st_size
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is reported in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _current_rss_bytes() -> int:
+    # Hand freed heap pages back to the OS first so that only live objects count.
+    libc_path = ctypes.util.find_library("c")
+    if libc_path is not None and hasattr(ctypes.CDLL(libc_path), "malloc_trim"):
+        ctypes.CDLL(libc_path).malloc_trim(0)
+
+    resident_pages = int(Path("/proc/self/statm").read_text().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def run_worker(mode: str, path: Path) -> None:
+    """Decode the payload at `path` and print the RSS it added, as JSON.
+
+    :param mode: Either `legacy` or `fast`.
+    :param path: Path to the payload.
+    """
+    from src.reviews.dto.requests import CreateReviewFromFileDiffRequest
+
+    baseline = _current_rss_bytes()
+    body = path.read_bytes()
+
+    if mode == "legacy":
+        message = json.loads(body)
+        request = CreateReviewFromFileDiffRequest(**message)
+    else:
+        request = CreateReviewFromFileDiffRequest.model_validate_json(body)
+        del body
+
+    print(  # noqa: T201
+        json.dumps(
+            {
+                "files": len(request.file_diffs or []),
+                "peak_rss_delta": _peak_rss_bytes() - baseline,
+                "retained_rss_delta": _current_rss_bytes() - baseline,
+            },
+        ),
+    )
+
+
+def measure(mode: str, path: Path) -> dict:
+    """Run a single measurement in a subprocess.
+
+    :param mode: Either `legacy` or `fast`.
+    :param path: Path to the payload.
+    :return: The measurement reported by the worker.
+    """
+    command = [sys.executable, "-m", "benchmarks.decode_memory", "--worker", mode]
+    output = subprocess.run(
+        [*command, str(path)],  # noqa: S603
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark and print peak RSS per MB of payload."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50])
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "PATH"))
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, path = args.worker
+        run_worker(mode, Path(path))
+        return
+
+    print(  # noqa: T201
+        f"{'payload MB':>10} {'mode':>8} {'peak MB':>8} {'peak/MB':>8} "
+        f"{'retained MB':>12} {'retained/MB':>12}",
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for size_mb in args.sizes:
+            path = Path(directory) / f"payload-{size_mb}.json"
+            payload_mb = write_payload(path, size_mb) / 1024 / 1024
+
+            for mode in ("legacy", "fast"):
+                result = measure(mode, path)
+                peak_mb = result["peak_rss_delta"] / 1024 / 1024
+                retained_mb = result["retained_rss_delta"] / 1024 / 1024
+                print(  # noqa: T201
+                    f"{payload_mb:>10.1f} {mode:>8} {peak_mb:>8.1f} "
+                    f"{peak_mb / payload_mb:>8.2f} {retained_mb:>12.1f} "
+                    f"{retained_mb / payload_mb:>12.2f}",
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Profile how long the worker takes to import, per AMQP mode.
+
+Runs ``python -X importtime`` on the entry point in a fresh interpreter for every
+mode and reports the total import time along with the slowest top-level packages.
+
+Usage: ``python -m benchmarks.import_time --modules src.main --top 10``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+AMQP_MODES = ("rabbitmq", "pubsub")
+
+
+def profile_imports(module: str, amqp_mode: str) -> list[tuple[int, str, int]]:
+    """Import `module` in a fresh interpreter and collect cumulative import times.
+
+    :param module: Module to import.
+    :param amqp_mode: Value of the `AMQP_MODE` environment variable.
+    :return: Nesting depth, name and cumulative import time in microseconds of
+        every imported module, in the order reported by ``-X importtime``.
+    """
+    statement = f"import {module}"
+    if module == "src.main":
+        # Include the transport selected at startup.
+        statement += (
+            "; from src.utils import amqp"
+            if amqp_mode == "rabbitmq"
+            else "; from src.utils import pubsub"
+        )
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],  # noqa: S603
+        check=True,
+        capture_output=True,
+        text=True,
+        env=os.environ | {"AMQP_MODE": amqp_mode},
+    )
+
+    imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if cumulative.strip().isdigit():
+            # Names are indented by two spaces per nesting level.
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append((depth, name.strip(), int(cumulative)))
+    return imports
+
+
+def summarize(imports: list[tuple[int, str, int]], top: int) -> list[tuple[str, int]]:
+    """Aggregate import times per top-level package, slowest first.
+
+    A module's time is attributed to its package unless it was imported by a module
+    of the same package, in which case it is already part of that module's time.
+
+    :param imports: Imports as returned by `profile_imports`.
+    :param top: Number of packages to return.
+    :return: The `top` slowest top-level packages and their import times.
+    """
+    per_package: dict[str, int] = defaultdict(int)
+    parents: list[tuple[int, str]] = []
+    # Reversed, every module is listed before the modules it imports.
+    for depth, name, cumulative in reversed(imports):
+        package = name.partition(".")[0]
+        while parents and parents[-1][0] >= depth:
+            parents.pop()
+        if not parents or parents[-1][1] != package:
+            per_package[package] += cumulative
+        parents.append((depth, package))
+    return sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    """Run the import time profile and print a report."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modules", nargs="+", default=["src.main"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        for amqp_mode in AMQP_MODES:
+            imports = profile_imports(module, amqp_mode)
+            total_ms = sum(cumulative for depth, _, cumulative in imports if not depth)
+            print(f"\n{module} [{amqp_mode}]: {total_ms / 1000:.1f} ms")  # noqa: T201
+            for package, cumulative in summarize(imports, args.top):
+                print(f"  {package:<40} {cumulative / 1000:>8.1f} ms")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,30 @@ class Tools(StrEnum):
     """Tools accomplish steps in a chain."""
 
     REVIEW_PULL_REQUEST = "review_pull_request"
+    SECURITY_REVIEW = "security_review"
+    SUMMARIZE_FILE = "summarize_file"
+    SUMMARIZE_PULL_REQUEST = "summarize_pull_request"
 
 
 class LLMProvider(StrEnum):
     """LLM providers."""
 
     OPENAI = "openai"
+
+
+# Suffixes of files without executable code.
+NON_CODE_SUFFIXES = frozenset(
+    {
+        ".csv",
+        ".gif",
+        ".ico",
+        ".jpeg",
+        ".jpg",
+        ".lock",
+        ".md",
+        ".png",
+        ".rst",
+        ".svg",
+        ".txt",
+    },
+)
@@ -1,22 +1,22 @@
 """Pydantic models for chat messages."""
 
+from __future__ import annotations
+
 from enum import StrEnum, auto
-from typing import Self
-
-from langchain.schema.messages import (
-    AIMessage,
-    BaseMessage,
-    HumanMessage,
-    SystemMessage,
-)
+from typing import TYPE_CHECKING, Self
+
 from pydantic import BaseModel
 
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
 
 class PromptType(StrEnum):
     """Type of prompt."""
 
     system = auto()
     user = auto()
+    output_format = auto()
 
 
 class Role(StrEnum):
@@ -43,6 +43,8 @@ class Message(BaseModel):
         :raises RoleError: if the role is not in the Role enum.
         :return: LangChain message type for this role.
         """
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
         match self.role:
             case Role.assistant:
                 return AIMessage(content=self.content)
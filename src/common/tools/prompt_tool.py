@@ -0,0 +1,92 @@
+"""Base classes of tools asking the LLM once, with the prompts of their config."""
+
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+from src.common.models.message import PromptType
+from src.common.tools.tool import get_hydrated_prompt, get_kwarg, get_tool_config_path
+from src.utils.llm import ask_llm
+
+if TYPE_CHECKING:
+    from src.common.constants import Tools
+    from src.reviews.models.pull_requests import PullRequestFileChanges
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTool(ABC):
+    """Base class of tools asking the LLM once, with the prompts of their config.
+
+    Tools only provide the context their user prompt is hydrated with.
+    """
+
+    tool: Tools
+
+    @classmethod
+    async def arun(
+        cls: type[PromptTool],
+        *args: Any,  # noqa: ARG003
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """Use the tool asynchronously.
+
+        :return: Tool output.
+        """
+        logger.info("Run %s tool.", cls.tool)
+
+        system_prompt, user_prompt = cls.get_prompts(**kwargs)
+        return ask_llm(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+        )
+
+    @classmethod
+    def get_prompts(
+        cls: type[PromptTool],
+        **kwargs: Any,
+    ) -> tuple[str, str]:
+        """Hydrate the prompts of the tool, e.g. to submit them in a batch.
+
+        Takes the keyword arguments of `arun`.
+
+        :return: The system prompt and the user prompt.
+        """
+        template_path = get_tool_config_path(cls.tool)
+        system_prompt = get_hydrated_prompt(
+            template_path=template_path,
+            prompt_type=PromptType.system,
+        )
+        user_prompt = get_hydrated_prompt(
+            template_path=template_path,
+            prompt_type=PromptType.user,
+            **cls.get_prompt_context(**kwargs),
+        )
+        return system_prompt, user_prompt
+
+    @classmethod
+    @abstractmethod
+    def get_prompt_context(
+        cls: type[PromptTool],
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """Get the context of the user prompt from the keyword arguments of `arun`."""
+
+
+class FilePromptTool(PromptTool):
+    """Base class of tools prompting with the patch of a file, numbered by line.
+
+    The patch is numbered by the caller, once for all the tools run on the file.
+    """
+
+    @classmethod
+    def get_prompt_context(
+        cls: type[FilePromptTool],
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """Get the name of the file in `request` and its `numbered_patch`."""
+        request: PullRequestFileChanges = get_kwarg(kwargs, "request")
+        numbered_patch: str = get_kwarg(kwargs, "numbered_patch")
+        return {"filename": request.filename, "patch": numbered_patch}
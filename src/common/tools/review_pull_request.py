@@ -2,51 +2,46 @@
 
 from __future__ import annotations
 
-import logging
-from typing import TYPE_CHECKING, Any, AsyncIterator
+import json
+from typing import Any
 
 from src.common.constants import Tools
 from src.common.models.message import PromptType
-from src.common.tools.tool import get_hydrated_prompt, get_kwarg, get_tool_config_path
-from src.utils.llm import ask_llm
+from src.common.tools.prompt_tool import FilePromptTool
+from src.common.tools.tool import get_hydrated_prompt, get_tool_config_path
 
-if TYPE_CHECKING:
-    from api.reviewer.models.pull_request import PullRequestFileChanges
 
-logger = logging.getLogger(__name__)
+class ReviewPullRequest(FilePromptTool):
+    """A tool for reviewing pull requests.
 
-
-class ReviewPullRequest:
-    """A tool for reviewing pull requests."""
+    With `output_schema`, the review is requested as JSON Lines objects following
+    the given JSON schema rather than as free-form text.
+    """
 
     tool: Tools = Tools.REVIEW_PULL_REQUEST
 
     @classmethod
-    async def arun(
+    def get_prompts(
         cls: type[ReviewPullRequest],
-        *args: Any,  # noqa: ARG003
         **kwargs: Any,
-    ) -> AsyncIterator[str]:
-        """Use the tool asynchronously.
-
-        :return: Tool output.
-        """
-        logger.info("Run %s tool.", cls.tool)
-
-        request: PullRequestFileChanges = get_kwarg(kwargs, "request")
-
-        template_path = get_tool_config_path(cls.tool)
-        system_prompt = get_hydrated_prompt(
-            template_path=template_path,
-            prompt_type=PromptType.system,
-        )
-        user_prompt = get_hydrated_prompt(
-            template_path=template_path,
-            prompt_type=PromptType.user,
-            filename=request.filename,
-            patch=request.patch,
-        )
-        return ask_llm(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-        )
+    ) -> tuple[str, str]:
+        """Hydrate the prompts, asking for the output schema if any."""
+        system_prompt, user_prompt = super().get_prompts(**kwargs)
+        output_schema: dict | None = kwargs.get("output_schema")
+        if output_schema is not None:
+            output_format_prompt = get_hydrated_prompt(
+                template_path=get_tool_config_path(cls.tool),
+                prompt_type=PromptType.output_format,
+                schema=json.dumps(output_schema),
+            )
+            system_prompt = f"{system_prompt}\n\n{output_format_prompt}"
+        return system_prompt, user_prompt
+
+    @classmethod
+    def applies_to(
+        cls: type[ReviewPullRequest],
+        *args: Any,  # noqa: ARG003
+        **kwargs: Any,  # noqa: ARG003
+    ) -> bool:
+        """Every file is reviewed."""
+        return True
@@ -0,0 +1,30 @@
+"""Tool to review the security of pull request changes."""
+
+from __future__ import annotations
+
+from pathlib import PurePosixPath
+from typing import TYPE_CHECKING, Any
+
+from src.common.constants import NON_CODE_SUFFIXES, Tools
+from src.common.tools.prompt_tool import FilePromptTool
+from src.common.tools.tool import get_kwarg
+
+if TYPE_CHECKING:
+    from src.reviews.models.pull_requests import PullRequestFileChanges
+
+
+class SecurityReview(FilePromptTool):
+    """A tool for reviewing the security of pull request changes."""
+
+    tool: Tools = Tools.SECURITY_REVIEW
+
+    @classmethod
+    def applies_to(
+        cls: type[SecurityReview],
+        *args: Any,  # noqa: ARG003
+        **kwargs: Any,
+    ) -> bool:
+        """Only code files with added lines are reviewed."""
+        request: PullRequestFileChanges = get_kwarg(kwargs, "request")
+        suffix = PurePosixPath(request.filename).suffix.lower()
+        return request.additions > 0 and suffix not in NON_CODE_SUFFIXES
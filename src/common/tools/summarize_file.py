@@ -0,0 +1,31 @@
+"""Tool to summarize the changes to a file in a pull request."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from src.common.constants import Tools
+from src.common.tools.prompt_tool import FilePromptTool
+from src.common.tools.tool import get_kwarg
+
+if TYPE_CHECKING:
+    from src.reviews.models.pull_requests import PullRequestFileChanges
+
+# Smaller changes are quicker to read than their summary.
+MIN_CHANGES = 50
+
+
+class SummarizeFile(FilePromptTool):
+    """A tool for summarizing the changes to a file."""
+
+    tool: Tools = Tools.SUMMARIZE_FILE
+
+    @classmethod
+    def applies_to(
+        cls: type[SummarizeFile],
+        *args: Any,  # noqa: ARG003
+        **kwargs: Any,
+    ) -> bool:
+        """Only files with at least `MIN_CHANGES` changed lines are summarized."""
+        request: PullRequestFileChanges = get_kwarg(kwargs, "request")
+        return request.changes >= MIN_CHANGES
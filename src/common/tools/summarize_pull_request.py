@@ -0,0 +1,42 @@
+"""Tool to summarize a pull request from the reviews of its files."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from src.common.constants import Tools
+from src.common.tools.prompt_tool import PromptTool
+from src.common.tools.tool import get_kwarg
+
+
+class SummarizePullRequest(PromptTool):
+    """A tool for summarizing pull requests.
+
+    `documents` are file reviews or summaries of groups of them. With `partial`,
+    they cover only part of the pull request, and the summary is summarized again
+    later.
+    """
+
+    tool: Tools = Tools.SUMMARIZE_PULL_REQUEST
+
+    @classmethod
+    def get_prompt_context(
+        cls: type[SummarizePullRequest],
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """Get the documents to summarize."""
+        documents: list[str] = get_kwarg(kwargs, "documents")
+        return {
+            "documents": "\n\n---\n\n".join(documents),
+            "partial": kwargs.get("partial", False),
+        }
+
+    @classmethod
+    def applies_to(
+        cls: type[SummarizePullRequest],
+        *args: Any,  # noqa: ARG003
+        **kwargs: Any,
+    ) -> bool:
+        """Only pull requests with reviewed files are summarized."""
+        documents: list[str] = get_kwarg(kwargs, "documents")
+        return bool(documents)
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import functools
 import logging
 from typing import TYPE_CHECKING, Any, runtime_checkable
 
@@ -24,7 +25,7 @@ if TYPE_CHECKING:
 class Tool(Protocol):
     """Protocol for tools."""
 
-    name: Tools
+    tool: Tools
 
     @classmethod
     async def arun(
@@ -37,6 +38,19 @@ class Tool(Protocol):
         :return: Tool output.
         """
 
+    @classmethod
+    def applies_to(
+        cls: type[Tool],
+        *args: Any,
+        **kwargs: Any,
+    ) -> bool:
+        """Whether the tool applies to the given input.
+
+        This must be cheap: it is used to skip tools before calling them.
+
+        :return: True if the tool should be used.
+        """
+
 
 def get_tool_config_path(tool: Tools) -> Path:
     """Return the path to the tool's config file based on the tool's name.
@@ -60,9 +74,7 @@ def get_hydrated_prompt(
     :param prompt_type: type of prompt to hydrate.
     :return: A Box configuration with the tool's prompts.
     """
-    # Read the YAML file
-    prompt_templates = yaml.safe_load(template_path.read_text())
-    prompt_template = prompt_templates[prompt_type]
+    prompt_template = _load_prompt_templates(template_path)[prompt_type]
 
     # Initialize the Jinja2 environment
     # (raise error when undefined and escape special characters).
@@ -73,6 +85,12 @@ def get_hydrated_prompt(
     return jinja_template.render(**kwargs)
 
 
+@functools.cache
+def _load_prompt_templates(template_path: Path) -> dict[str, str]:
+    """Read the prompts of a tool, once per process."""
+    return yaml.safe_load(template_path.read_text())
+
+
 MISSING_VALUE_SENTINEL = object()
 
 
@@ -1,14 +1,25 @@
-"""Main entry point of the application."""
+"""Main entry point of the application.
+
+Only the transport selected by `amqp_mode` is imported, when it is started.
+"""
 
 import asyncio
 import logging
-import signal
+from typing import Callable
 
 import src.reviews.controllers as reviews_controllers
 from src.config import config
 from src.reviews.constants import AMQPQueues
-from src.utils.amqp import AsyncRabbitMQClient
-from src.utils.pubsub import AsyncPubSubSubscriber
+from src.reviews.structured_reviews import shutdown_executor
+from src.utils.admission import AdmissionController, get_admission_controller
+from src.utils.http import close_http_client
+from src.utils.llm import close_chat_models
+from src.utils.message_queue import (
+    MessageCallback,
+    MessageQueueSubscriber,
+    SpoolSubscriber,
+)
+from src.utils.shutdown import ShutdownCoordinator
 
 logger = logging.getLogger(__name__)
 
@@ -18,58 +29,114 @@ def launch_app() -> None:
     asyncio.run(listen_for_messages())
 
 
+def launch_batch() -> None:
+    """Launch the batch reviews of the jobs in `batch_reviews.job_paths`."""
+    asyncio.run(review_in_batches())
+
+
 async def listen_for_messages() -> None:
-    """Listen for messages from the RabbitMQ queue."""
-    if config.amqp_mode == "rabbitmq":
-        logger.info("Starting RabbitMQ consumer...")
-        rabbitmq_client = AsyncRabbitMQClient()
-        await rabbitmq_client.connect()
-
-        await rabbitmq_client.consume_messages(
-            queue_name=AMQPQueues.REVIEW_FILE_DIFF_QUEUE,
-            callback=reviews_controllers.create_review_from_file_diffs,
-        )
-        logger.info("Listening for messages...")
-
-    elif config.amqp_mode == "pubsub":
-        project_id = config.gcp_project_id
-        subscription_id = config.gcp_subscription_id
-        logging.info("Starting Pub/Sub subscriber %s...", subscription_id)
-        callback = reviews_controllers.create_review_from_file_diffs
-        subscriber = AsyncPubSubSubscriber(
-            project_id,
-            subscription_id,
-            callback=callback,
-            loop=asyncio.get_running_loop(),
-        )
-
-        try:
-            logger.info("Listening for messages on subscription %s...", subscription_id)
-            await subscriber.start()
-        except KeyboardInterrupt:
-            logger.info("Received keyboard interrupt, shutting down...")
-        finally:
-            await subscriber.stop()
-    else:
+    """Listen for messages on the transport selected by `amqp_mode`."""
+    coordinator = ShutdownCoordinator(timeout=config.modules.common.shutdown_timeout)
+    admission_controller = get_admission_controller(
+        estimate_cost=reviews_controllers.estimate_review_cost,
+    )
+
+    subscriber = create_subscriber(
+        callback=reviews_controllers.create_review_from_file_diffs,
+        admission_controller=admission_controller,
+        on_finished=coordinator.request_shutdown,
+    )
+    if subscriber is None:
         logger.error("Invalid AMQP mode, received %s. Exiting...", config.amqp_mode)
         return
 
-    await handle_events()
+    coordinator.add_consumer(subscriber)
+    await subscriber.start()
+    logger.info("Listening for messages...")
+
+    await handle_events(coordinator)
+
+
+def create_subscriber(
+    callback: MessageCallback,
+    admission_controller: AdmissionController,
+    on_finished: Callable[[], None],
+) -> MessageQueueSubscriber | None:
+    """Create the subscriber of the transport selected by `amqp_mode`.
+
+    :param callback: Processes the body of a message.
+    :param admission_controller: Decides which messages are taken.
+    :param on_finished: Called once a finite transport, e.g. a spool, is replayed.
+    :return: The subscriber, or None if the mode is unknown.
+    """
+    match config.amqp_mode:
+        case "rabbitmq":
+            from src.utils.amqp import AsyncRabbitMQClient
+
+            logger.info("Starting RabbitMQ consumer...")
+            return AsyncRabbitMQClient(
+                queue_name=AMQPQueues.REVIEW_FILE_DIFF_QUEUE,
+                callback=callback,
+                admission_controller=admission_controller,
+            )
+        case "pubsub":
+            from src.utils.pubsub import AsyncPubSubSubscriber
+
+            logger.info("Starting Pub/Sub subscriber %s...", config.gcp_subscription_id)
+            return AsyncPubSubSubscriber(
+                config.gcp_project_id,
+                config.gcp_subscription_id,
+                callback=callback,
+                admission_controller=admission_controller,
+            )
+        case "spool":
+            paths = _split_paths(config.spool_paths)
+            logger.info("Replaying spool(s) %s...", ", ".join(paths))
+            return SpoolSubscriber(
+                paths,
+                callback=callback,
+                admission_controller=admission_controller,
+                on_finished=on_finished,
+            )
+        case _:
+            return None
+
+
+async def review_in_batches() -> None:
+    """Review the jobs of the batch spools, apart from the live consumer."""
+    from src.reviews.batch_reviews import run_batch_reviews
+    from src.utils.llm_batches import get_batch_provider
+
+    paths = _split_paths(config.batch_reviews.job_paths)
+    if not paths:
+        logger.error("No batch job spools configured. Exiting...")
+        return
+
+    logger.info("Reviewing the jobs of %s in batches...", ", ".join(paths))
+    provider = get_batch_provider()
+    try:
+        await run_batch_reviews(paths, provider)
+    finally:
+        await provider.close()
+        await close_http_client()
+        await shutdown_executor()
+
 
+def _split_paths(paths: str | None) -> list[str]:
+    """Split a comma-separated list of paths."""
+    return [path.strip() for path in (paths or "").split(",") if path.strip()]
 
-async def handle_events() -> None:
-    """Handle events."""
-    loop = asyncio.get_event_loop()
-    stop_event = asyncio.Event()
 
-    def shutdown() -> None:
-        logger.info("Received shutdown signal")
-        stop_event.set()
+async def handle_events(coordinator: ShutdownCoordinator) -> None:
+    """Handle events until shutdown, then drain consumers and close clients.
 
-    loop.add_signal_handler(signal.SIGINT, shutdown)
-    loop.add_signal_handler(signal.SIGTERM, shutdown)
+    :param coordinator: The shutdown coordinator of the consumers.
+    """
+    coordinator.add_cleanup(close_http_client)
+    coordinator.add_cleanup(close_chat_models)
+    coordinator.add_cleanup(shutdown_executor)
 
-    await stop_event.wait()
+    await coordinator.wait_for_shutdown()
 
 
 if __name__ == "__main__":
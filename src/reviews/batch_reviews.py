@@ -0,0 +1,402 @@
+"""Batch reviews.
+
+Reviews nobody waits on, e.g. nightly re-reviews and backfills, are submitted to
+the provider's batch API rather than reviewed in real time, at a fraction of the
+price. Batch reviews run in their own process, apart from the live consumer: they
+share neither its concurrency limits, its admission control, nor its LLM clients.
+
+Jobs are read from spool files, one review request per line, in the format of the
+messages of the live consumer. They are packed whole into batches of at most
+`max_requests_per_batch` file reviews, and at most `max_concurrent_batches`
+batches are in flight at once. Jobs are submitted until their estimated input
+tokens exceed `max_tokens`. Jobs left out, or whose reviews failed, are written
+to `<spool>.failed` for a later run. Submitted batches are recorded in
+`<spool>.batches/`, so that a run interrupted while batches are in flight is
+resumed by polling them again rather than paying for them twice. A job fails on
+its own: errors completing one review leave the other jobs of its batch
+unaffected, and progress reports are best effort.
+
+Only the review of each file is batched. Additional passes, pull request summaries
+and the reuse of previous reviews are left to the live consumer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Self, Sequence
+
+import httpx
+
+from src.common.tools.review_pull_request import ReviewPullRequest
+from src.config import config
+from src.reviews import structured_reviews
+from src.reviews.constants import ReviewStatus
+from src.reviews.dto.requests import CreateReviewFromFileDiffRequest
+from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+from src.reviews.patches import number_lines
+from src.utils import api, claim_check, metrics
+from src.utils.llm import estimate_tokens
+from src.utils.llm_batches import BatchProvider, BatchRequest
+from src.utils.message_queue import append_failed_to_spool, iter_spool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchJob:
+    """A review to submit in a batch.
+
+    Attributes
+    ----------
+        - index: The index of the job, which identifies its requests in batches.
+        - line: The line of the spool the job was read from.
+        - request: The review request.
+        - file_diffs: The file diffs to review.
+        - requests: The batch requests reviewing the file diffs, in order.
+        - tokens: The estimated input tokens of the requests.
+    """
+
+    index: int
+    line: bytes
+    request: CreateReviewFromFileDiffRequest
+    file_diffs: list[PullRequestFileChanges]
+    requests: list[BatchRequest]
+    tokens: int
+
+
+async def run_batch_reviews(
+    paths: Sequence[str | Path],
+    provider: BatchProvider,
+) -> None:
+    """Review the jobs of spool files in batches, and complete their reviews.
+
+    Batches submitted by an earlier, interrupted run are polled again first, and
+    their jobs are not submitted again.
+
+    :param paths: Paths to the spool files of the jobs, read in order.
+    :param provider: The provider batch API the reviews are submitted to.
+    """
+    async with asyncio.TaskGroup() as task_group:
+        batch_run = _BatchRun(task_group, [Path(path) for path in paths], provider)
+        await batch_run.resume()
+        await batch_run.submit_jobs()
+
+    await batch_run.write_failed(batch_run.failed_lines)
+    metrics.log_metrics()
+
+
+class _BatchRun:
+    """Submission of the jobs of spool files in batches, and their completion.
+
+    Each submitted batch is recorded in `<spool>.batches/`, next to the last spool,
+    along with the spool lines of its jobs, until its jobs are completed or
+    written to the failed spool.
+    """
+
+    def __init__(
+        self: Self,
+        task_group: asyncio.TaskGroup,
+        paths: list[Path],
+        provider: BatchProvider,
+    ) -> None:
+        """Initialize the run.
+
+        :param task_group: The task group the batches are reviewed in.
+        :param paths: Paths to the spool files of the jobs, read in order.
+        :param provider: The provider batch API the reviews are submitted to.
+        """
+        self.task_group = task_group
+        self.paths = paths
+        self.provider = provider
+        self.batches_path = paths[-1].with_name(f"{paths[-1].name}.batches")
+        self.semaphore = asyncio.Semaphore(config.batch_reviews.max_concurrent_batches)
+        self.remaining_tokens: int = config.batch_reviews.max_tokens
+        self.failed_lines: list[bytes] = []
+        self.resumed_lines: set[bytes] = set()
+
+    async def resume(self: Self) -> None:
+        """Poll the batches submitted by an earlier run again."""
+        for batch_id, lines in await asyncio.to_thread(
+            _load_batches,
+            self.batches_path,
+        ):
+            logger.info("Resuming batch %s of %s job(s)", batch_id, len(lines))
+            metrics.increment("batch_reviews.resumed_batches")
+            self.resumed_lines.update(line for _, line in lines)
+            jobs = []
+            for index, line in lines:
+                job = await self._load(index, line)
+                if job is not None:
+                    jobs.append(job)
+            await self.semaphore.acquire()
+            self.task_group.create_task(self.review_batch(jobs, batch_id))
+
+    async def submit_jobs(self: Self) -> None:
+        """Pack the jobs of the spools into batches, and submit them."""
+        max_requests = config.batch_reviews.max_requests_per_batch
+        jobs: list[BatchJob] = []
+        async for index, line in _enumerate_lines(self.paths):
+            if line in self.resumed_lines:
+                continue
+            job = await self._load(index, line)
+            if job is None or not self._spend_tokens(job):
+                continue
+
+            requests = sum(len(pending_job.requests) for pending_job in jobs)
+            if requests + len(job.requests) > max_requests:
+                # A job larger than a batch still gets a batch of its own.
+                if jobs:
+                    await self.semaphore.acquire()
+                    self.task_group.create_task(self.review_batch(jobs))
+                jobs = []
+            jobs.append(job)
+
+        if jobs:
+            await self.semaphore.acquire()
+            self.task_group.create_task(self.review_batch(jobs))
+
+    async def _load(self: Self, index: int, line: bytes) -> BatchJob | None:
+        """Load a job, or fail its line if it is invalid."""
+        try:
+            return await _load_job(index, line)
+        except (ValueError, OSError, httpx.HTTPError):
+            logger.exception("Invalid job on line %s", index + 1)
+            self.failed_lines.append(line)
+            return None
+
+    def _spend_tokens(self: Self, job: BatchJob) -> bool:
+        """Spend the tokens of a job, if they fit in the remaining budget."""
+        if job.tokens > self.remaining_tokens:
+            # Left for a later run, smaller jobs may still fit.
+            metrics.increment("batch_reviews.skipped_jobs")
+            self.failed_lines.append(job.line)
+            return False
+        self.remaining_tokens -= job.tokens
+        metrics.increment("batch_reviews.estimated_tokens", job.tokens)
+        return True
+
+    async def review_batch(
+        self: Self,
+        jobs: list[BatchJob],
+        batch_id: str | None = None,
+    ) -> None:
+        """Submit a batch, unless resumed, wait for it and complete its jobs.
+
+        Must be started with a batch slot acquired, which it releases.
+
+        :param jobs: The jobs of the batch.
+        :param batch_id: The ID of the batch, if submitted by an earlier run.
+        """
+        try:
+            if batch_id is None:
+                batch_id = await self._submit(jobs)
+            while not await self.provider.is_done(batch_id):
+                await asyncio.sleep(config.batch_reviews.poll_interval)
+            answers = await self.provider.results(batch_id)
+            logger.info("Batch %s is done", batch_id)
+        except Exception:
+            logger.exception("Error reviewing batch of %s job(s)", len(jobs))
+            answers = {}
+        finally:
+            self.semaphore.release()
+
+        failed_jobs = [job for job in jobs if not await self._complete(job, answers)]
+        await self.write_failed([job.line for job in failed_jobs])
+        if batch_id is not None:
+            await asyncio.to_thread(_remove_batch, self.batches_path, batch_id)
+
+    async def _submit(self: Self, jobs: list[BatchJob]) -> str:
+        """Submit the requests of jobs as a batch, and record it."""
+        batch_id = await self.provider.submit(
+            [request for job in jobs for request in job.requests],
+        )
+        await asyncio.to_thread(_save_batch, self.batches_path, batch_id, jobs)
+        logger.info("Submitted batch %s of %s job(s)", batch_id, len(jobs))
+        metrics.increment("batch_reviews.batches")
+        for job in jobs:
+            await _report_queued(job)
+        return batch_id
+
+    async def _complete(self: Self, job: BatchJob, answers: dict[str, str]) -> bool:
+        """Complete the review of a job, and tell whether it succeeded."""
+        try:
+            completed = await _complete_review(job, answers)
+        except Exception:
+            logger.exception("Error completing review %s", job.request.review_id)
+            completed = False
+        outcome = "completed" if completed else "failed"
+        metrics.increment(f"batch_reviews.{outcome}_jobs")
+        return completed
+
+    async def write_failed(self: Self, lines: list[bytes]) -> None:
+        """Append the lines of failed jobs to the failed spool."""
+        if lines:
+            failed_path = await asyncio.to_thread(
+                append_failed_to_spool,
+                self.paths,
+                lines,
+            )
+            logger.info("Wrote %s failed job(s) to %s", len(lines), failed_path)
+
+
+def _save_batch(batches_path: Path, batch_id: str, jobs: list[BatchJob]) -> None:
+    """Record a submitted batch with the index and spool line of its jobs."""
+    batches_path.mkdir(exist_ok=True)
+    batch_path = batches_path / f"{batch_id}.json"
+    temporary_path = batch_path.with_suffix(".tmp")
+    temporary_path.write_text(
+        json.dumps(
+            [{"index": job.index, "line": job.line.decode()} for job in jobs],
+        ),
+    )
+    # Renamed into place, so that an interrupted write leaves no partial record.
+    temporary_path.replace(batch_path)
+
+
+def _load_batches(batches_path: Path) -> list[tuple[str, list[tuple[int, bytes]]]]:
+    """Load the batches recorded by earlier runs, with their jobs' spool lines."""
+    if not batches_path.is_dir():
+        return []
+    return [
+        (
+            batch_path.stem,
+            [
+                (job["index"], job["line"].encode())
+                for job in json.loads(batch_path.read_text())
+            ],
+        )
+        for batch_path in sorted(batches_path.glob("*.json"))
+    ]
+
+
+def _remove_batch(batches_path: Path, batch_id: str) -> None:
+    """Remove the record of a batch whose jobs are settled."""
+    (batches_path / f"{batch_id}.json").unlink(missing_ok=True)
+
+
+async def _enumerate_lines(
+    paths: Sequence[Path],
+) -> AsyncIterator[tuple[int, bytes]]:
+    """Read the lines of spool files lazily, without blocking the event loop."""
+    lines = enumerate(iter_spool(paths))
+    while batch := await asyncio.to_thread(list, itertools.islice(lines, 100)):
+        for line in batch:
+            yield line
+
+
+async def _load_job(index: int, line: bytes) -> BatchJob:
+    """Load a job, and hydrate the prompts of its file reviews.
+
+    :param index: Index of the job, which identifies its requests in batches.
+    :param line: The review request.
+    :return: The job.
+    """
+    request = CreateReviewFromFileDiffRequest.model_validate_json(line)
+    if request.file_diffs_ref is None:
+        file_diffs = request.file_diffs or []
+    else:
+        file_diffs = [
+            PullRequestFileChanges.model_validate(file_diff)
+            async for file_diff in claim_check.iter_json_array(request.file_diffs_ref)
+        ]
+
+    output_schema = (
+        structured_reviews.get_comment_schema()
+        if config.modules.reviews.structured_output.enabled
+        else None
+    )
+    requests = []
+    for file_index, file_diff in enumerate(file_diffs):
+        system_prompt, user_prompt = ReviewPullRequest.get_prompts(
+            request=file_diff,
+            numbered_patch=number_lines(file_diff.patch, file_diff.patch_index),
+            output_schema=output_schema,
+        )
+        requests.append(
+            BatchRequest(
+                custom_id=f"{index}-{file_index}",
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+            ),
+        )
+    tokens = sum(
+        estimate_tokens(batch_request.system_prompt)
+        + estimate_tokens(batch_request.user_prompt)
+        for batch_request in requests
+    )
+    return BatchJob(
+        index=index,
+        line=line,
+        request=request,
+        file_diffs=file_diffs,
+        requests=requests,
+        tokens=tokens,
+    )
+
+
+async def _report_queued(job: BatchJob) -> None:
+    """Report a submitted job as queued, which is informational only."""
+    try:
+        await api.update_progress(
+            job.request.review_status_id,
+            0,
+            ReviewStatus.queued,
+        )
+    except Exception:
+        logger.exception("Error reporting review %s as queued", job.request.review_id)
+
+
+async def _complete_review(job: BatchJob, answers: dict[str, str]) -> bool:
+    """Complete the review of a job from the answers of its batch.
+
+    :param job: The job.
+    :param answers: The answers of the batch, by ID of their request.
+    :return: Whether every file of the job was reviewed.
+    """
+    file_reviews = []
+    for file_diff, request in zip(job.file_diffs, job.requests, strict=True):
+        answer = answers.get(request.custom_id)
+        if answer is None:
+            logger.warning(
+                "No answer to %s in review %s",
+                file_diff.filename,
+                job.request.review_id,
+            )
+            return False
+        file_reviews.append(await _to_file_review(file_diff, answer))
+
+    await api.complete_review(
+        review_id=job.request.review_id,
+        review_status_id=job.request.review_status_id,
+        file_reviews=file_reviews,
+    )
+    return True
+
+
+async def _to_file_review(file_diff: PullRequestFileChanges, answer: str) -> FileReview:
+    """Build the review of a file from the answer to its request."""
+    if not config.modules.reviews.structured_output.enabled:
+        return FileReview(
+            filename=file_diff.filename,
+            content=answer,
+            patch=file_diff.patch,
+        )
+
+    async def chunks() -> AsyncIterator[str]:
+        yield answer
+
+    comments = await structured_reviews.parse_structured_review(
+        chunks(),
+        file_diff.patch_index,
+    )
+    return FileReview(
+        filename=file_diff.filename,
+        content=structured_reviews.render_comments(comments),
+        patch=file_diff.patch,
+        comments=comments,
+    )
@@ -0,0 +1,178 @@
+"""Checkpoints of completed file reviews.
+
+Completed file reviews are saved per review as they finish. When a message is
+redelivered, e.g. after the pod processing it died, the files reviewed before are
+restored from the checkpoint instead of being sent to the LLM again. Checkpoints
+are kept for a retention period after the review completes, so that follow-up
+reviews of the same pull request can build on them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import closing
+from pathlib import Path
+from typing import Self
+
+from src.config import config
+from src.reviews.models.pull_requests import FileReview
+from src.utils.exceptions import ConfigError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = (
+    Path(__file__).resolve().parents[2] / "checkpoints" / "reviews.sqlite3"
+)
+
+
+class CheckpointStore(ABC):
+    """CheckpointStore is an abstract class for file review checkpoint stores."""
+
+    @abstractmethod
+    async def load(self: Self, review_id: int) -> list[FileReview]:
+        """Load the file reviews checkpointed for a review."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save(self: Self, review_id: int, file_review: FileReview) -> None:
+        """Checkpoint a completed file review."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def prune(self: Self, max_age: float) -> None:
+        """Remove checkpoints not updated for `max_age` seconds."""
+        raise NotImplementedError
+
+
+class NullCheckpointStore(CheckpointStore):
+    """Checkpoint store that does not store anything."""
+
+    async def load(self: Self, review_id: int) -> list[FileReview]:  # noqa: ARG002
+        """Load nothing."""
+        return []
+
+    async def save(self: Self, review_id: int, file_review: FileReview) -> None:
+        """Discard the file review."""
+
+    async def prune(self: Self, max_age: float) -> None:
+        """Do nothing."""
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Checkpoint store backed by a local SQLite database.
+
+    Every operation opens its own connection in a worker thread, so the store can
+    be shared by event loops and worker processes alike. The database is only
+    shared with the pods that mount the same path, a review redelivered to another
+    pod starts over.
+    """
+
+    def __init__(self: Self, path: str | Path) -> None:
+        """Initialize the store, creating the database if needed.
+
+        :param path: Path to the SQLite database.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS file_review_checkpoints ("
+                " review_id INTEGER NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " file_review TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (review_id, filename))",
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS file_review_checkpoints_updated_at"
+                " ON file_review_checkpoints (updated_at)",
+            )
+
+    def _connect(self: Self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30.0)
+
+    async def load(self: Self, review_id: int) -> list[FileReview]:
+        """Load the file reviews checkpointed for a review."""
+
+        def load() -> list[FileReview]:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(
+                    "SELECT file_review FROM file_review_checkpoints"
+                    " WHERE review_id = ?",
+                    (review_id,),
+                ).fetchall()
+            return [FileReview.model_validate_json(row[0]) for row in rows]
+
+        return await asyncio.to_thread(load)
+
+    async def save(self: Self, review_id: int, file_review: FileReview) -> None:
+        """Checkpoint a completed file review."""
+
+        def save() -> None:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO file_review_checkpoints"
+                    " (review_id, filename, file_review, updated_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (
+                        review_id,
+                        file_review.filename,
+                        _dump_file_review(file_review),
+                        time.time(),
+                    ),
+                )
+
+        await asyncio.to_thread(save)
+
+    async def prune(self: Self, max_age: float) -> None:
+        """Remove checkpoints not updated for `max_age` seconds."""
+
+        def prune() -> None:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "DELETE FROM file_review_checkpoints WHERE updated_at < ?",
+                    (time.time() - max_age,),
+                )
+
+        await asyncio.to_thread(prune)
+
+
+def _dump_file_review(file_review: FileReview) -> str:
+    """Serialize a file review, with the fields left out of its API payload."""
+    return json.dumps(
+        file_review.model_dump(mode="json")
+        | {"passes": file_review.passes, "carried_over": file_review.carried_over},
+    )
+
+
+_checkpoint_store: CheckpointStore | None = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Get the checkpoint store selected in the configuration.
+
+    :raises ConfigError: If the configured store is unknown.
+    :return: The checkpoint store.
+    """
+    global _checkpoint_store  # noqa: PLW0603
+
+    if _checkpoint_store is None:
+        checkpoint_config = config.modules.reviews.checkpoints
+        match checkpoint_config.store:
+            case "sqlite":
+                _checkpoint_store = SQLiteCheckpointStore(
+                    checkpoint_config.path or DEFAULT_CHECKPOINT_PATH,
+                )
+            case "none" | None:
+                _checkpoint_store = NullCheckpointStore()
+            case _:
+                message = f"Unknown checkpoint store: {checkpoint_config.store}"
+                raise ConfigError(message)
+
+    return _checkpoint_store
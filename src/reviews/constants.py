@@ -15,3 +15,12 @@ class ReviewStatus(StrEnum):
     queued = auto()
     processing = auto()
     available = auto()
+
+
+class ReviewCommentSeverity(StrEnum):
+    """Constants for the severity of a review comment."""
+
+    info = auto()
+    minor = auto()
+    major = auto()
+    critical = auto()
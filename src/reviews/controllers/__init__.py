@@ -1 +1,4 @@
-from .pull_requests_controller import create_review_from_file_diffs
+from .pull_requests_controller import (
+    create_review_from_file_diffs,
+    estimate_review_cost,
+)
@@ -1,12 +1,72 @@
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+
 from src.reviews.dto.requests import CreateReviewFromFileDiffRequest
+from src.reviews.models.pull_requests import PullRequestFileChanges
 from src.reviews.services import pull_requests_service
+from src.utils import claim_check
+from src.utils.llm import CHARS_PER_TOKEN
+
+# Messages up to this size may reference their file diffs rather than hold them.
+REFERENCE_MESSAGE_SIZE = 4096
+# Estimated tokens per file diff passed by reference, whose size is unknown.
+TOKENS_PER_REFERENCED_FILE = 2000
+
+
+async def create_review_from_file_diffs(message: bytes) -> None:
+    """Create a review from a file diff.
+
+    The request is validated straight from the raw message body, without an
+    intermediate ``dict``, and the body is released as soon as it is parsed.
+    File diffs passed by reference are streamed into the review file by file.
+
+    :param message: Raw JSON body of the incoming message.
+    """
+    request = CreateReviewFromFileDiffRequest.model_validate_json(message)
+    del message
+
+    if request.file_diffs_ref is None:
+        file_diffs = request.file_diffs or []
+        await pull_requests_service.create_review_from_file_diffs(
+            file_diffs=file_diffs,
+            review_id=request.review_id,
+            review_status_id=request.review_status_id,
+            total_files=len(file_diffs),
+            previous_review_id=request.previous_review_id,
+        )
+    else:
+        await pull_requests_service.create_review_from_file_diffs(
+            file_diffs=_iter_referenced_file_diffs(request.file_diffs_ref),
+            review_id=request.review_id,
+            review_status_id=request.review_status_id,
+            total_files=request.file_count,
+            previous_review_id=request.previous_review_id,
+        )
+
+
+async def _iter_referenced_file_diffs(
+    reference: str,
+) -> AsyncIterator[PullRequestFileChanges]:
+    """Lazily load the file diffs stored at `reference`."""
+    async for file_diff in claim_check.iter_json_array(reference):
+        yield PullRequestFileChanges.model_validate(file_diff)
+
+
+def estimate_review_cost(message: bytes) -> int:
+    """Estimate the number of tokens of a review from its raw message.
 
+    The file diffs make up most of a message, so its size is used, unless the
+    file diffs are passed by reference.
 
-async def create_review_from_file_diffs(message: dict) -> None:
-    """Create a review from a file diff."""
-    request = CreateReviewFromFileDiffRequest(**message)
-    await pull_requests_service.create_review_from_file_diffs(
-        file_diffs=request.file_diffs,
-        review_id=request.review_id,
-        review_status_id=request.review_status_id,
-    )
+    :param message: Raw JSON body of the incoming message.
+    :return: The estimated number of tokens.
+    """
+    if len(message) <= REFERENCE_MESSAGE_SIZE:
+        try:
+            request = CreateReviewFromFileDiffRequest.model_validate_json(message)
+        except ValidationError:
+            request = None
+        if request is not None and request.file_diffs_ref is not None:
+            return (request.file_count or 1) * TOKENS_PER_REFERENCED_FILE
+    return len(message) // CHARS_PER_TOKEN + 1
@@ -1,16 +1,37 @@
 """Request DTOs for the reviews module."""
 
-from pydantic import BaseModel
+from typing import Self
+
+from pydantic import BaseModel, model_validator
 
 from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
 
 
 class CreateReviewFromFileDiffRequest(BaseModel):
-    """Request to create a review from a file diff."""
+    """Request to create a review from a file diff.
+
+    The file diffs are either sent inline in `file_diffs`, or, for oversized pull
+    requests, stored elsewhere and referenced by `file_diffs_ref` (claim-check).
+    `file_count` should accompany a reference so that progress can be reported.
+    `previous_review_id` refers to the review of a previous push to the same pull
+    request, whose unchanged parts are reused. The previous review is read from the
+    checkpoints, which are local to the workers sharing the checkpoint store.
+    """
 
     review_id: int
     review_status_id: int
-    file_diffs: list[PullRequestFileChanges]
+    file_diffs: list[PullRequestFileChanges] | None = None
+    file_diffs_ref: str | None = None
+    file_count: int | None = None
+    previous_review_id: int | None = None
+
+    @model_validator(mode="after")
+    def check_file_diffs_source(self: Self) -> Self:
+        """Ensure exactly one of `file_diffs` and `file_diffs_ref` is given."""
+        if (self.file_diffs is None) == (self.file_diffs_ref is None):
+            message = "Exactly one of `file_diffs` and `file_diffs_ref` must be set."
+            raise ValueError(message)
+        return self
 
 
 class UpdateProgressRequest(BaseModel):
@@ -21,8 +42,9 @@ class UpdateProgressRequest(BaseModel):
 
 
 class CompleteReviewRequest(BaseModel):
-    """Request to complete a review."""
+    """Request to complete a review, with a summary of the pull request if any."""
 
     review_id: int
     review_status_id: int
     file_reviews: list[FileReview]
+    summary: str | None = None
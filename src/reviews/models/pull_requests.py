@@ -1,10 +1,19 @@
 """Models for pull requests."""
 
-from pydantic import BaseModel
+from typing import Any, Self
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from src.reviews.constants import ReviewCommentSeverity
+from src.reviews.patches import PatchIndex
 
 
 class PullRequestFileChanges(BaseModel):
-    """Changes made to a file in a pull request."""
+    """Changes made to a file in a pull request.
+
+    The index of the patch is built once, when the changes are parsed. Create new
+    instances rather than copies with another patch, to keep the index in sync.
+    """
 
     filename: str
     patch: str
@@ -12,6 +21,39 @@ class PullRequestFileChanges(BaseModel):
     deletions: int
     changes: int
 
+    _patch_index: PatchIndex = PrivateAttr()
+
+    def model_post_init(self: Self, __context: Any) -> None:
+        """Index the patch."""
+        self._patch_index = PatchIndex(self.patch)
+
+    @property
+    def patch_index(self: Self) -> PatchIndex:
+        """The index of the lines of the patch."""
+        return self._patch_index
+
+
+class ReviewComment(BaseModel):
+    """Review comment anchored to lines of a file.
+
+    Attributes
+    ----------
+        - start_line: First line commented on, in the new version of the file.
+        - end_line: Last line commented on, in the new version of the file.
+        - severity: The severity of the comment.
+        - body: The comment.
+        - suggestion: Code to replace the lines with, if any.
+        - position: Position of `end_line` in the patch, i.e. the number of lines
+          after the first hunk header, as used by GitHub review comments.
+    """
+
+    start_line: int
+    end_line: int
+    severity: ReviewCommentSeverity
+    body: str
+    suggestion: str | None = None
+    position: int | None = None
+
 
 class FileReview(BaseModel):
     """Review of a file in a pull request.
@@ -20,8 +62,19 @@ class FileReview(BaseModel):
     ----------
         - filename: The name of the file.
         - content: The content of the review.
+        - comments: Structured comments, when reviewed in structured output mode.
+        - passes: Outputs of the additional review passes by tool, also included
+          in `content`.
+        - carried_over: Free-form reviews of earlier pushes still holding for the
+          patch, also included in `content` after the review of the file itself.
+
+    `passes` and `carried_over` are already part of `content`, so they are left out
+    when serialized, except in checkpoints.
     """
 
     filename: str
     content: str
     patch: str
+    comments: list[ReviewComment] = []
+    passes: dict[str, str] = Field(default={}, exclude=True)
+    carried_over: str = Field(default="", exclude=True)
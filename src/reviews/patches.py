@@ -0,0 +1,221 @@
+"""Utilities for unified diff patches of pull request files.
+
+GitHub patches are unified diffs without file headers: a sequence of hunks, each
+starting with a ``@@ -<old_start>,<old_count> +<new_start>,<new_count> @@`` line.
+"""
+
+from __future__ import annotations
+
+import bisect
+import re
+from array import array
+from dataclasses import dataclass
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+@dataclass(frozen=True)
+class Hunk:
+    """A hunk of a unified diff.
+
+    Attributes
+    ----------
+        - header: The ``@@`` line of the hunk.
+        - body: The lines of the hunk after the header.
+        - old_start: First line of the hunk in the old file.
+        - new_start: First line of the hunk in the new file.
+        - new_count: Number of lines of the new file in the hunk.
+    """
+
+    header: str
+    body: str
+    old_start: int
+    new_start: int
+    new_count: int
+
+    def contains_new_line(self: Hunk, line: int) -> bool:
+        """Whether line `line` of the new file is shown in the hunk."""
+        return self.new_start <= line < self.new_start + self.new_count
+
+    def __str__(self: Hunk) -> str:
+        """Return the hunk as it appears in the patch."""
+        return f"{self.header}\n{self.body}" if self.body else self.header
+
+
+def split_hunks(patch: str) -> list[Hunk]:
+    """Split a patch into its hunks.
+
+    Lines before the first hunk header, if any, are ignored.
+
+    :param patch: The patch.
+    :return: The hunks of the patch, in order.
+    """
+    hunks: list[Hunk] = []
+    header: str | None = None
+    body: list[str] = []
+    old_start = new_start = new_count = 0
+
+    for line in patch.splitlines():
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match is None:
+            if header is not None:
+                body.append(line)
+            continue
+
+        if header is not None:
+            hunks.append(Hunk(header, "\n".join(body), old_start, new_start, new_count))
+        header, body = line, []
+        old_start, new_start = int(match.group(1)), int(match.group(3))
+        new_count = int(match.group(4) or 1)
+
+    if header is not None:
+        hunks.append(Hunk(header, "\n".join(body), old_start, new_start, new_count))
+    return hunks
+
+
+def find_changed_hunks(previous_patch: str, patch: str) -> tuple[list[Hunk], int]:
+    """Find the hunks of `patch` that are not in `previous_patch`.
+
+    Hunks are compared by their content only, so hunks merely shifted by changes
+    elsewhere in the file count as unchanged.
+
+    :param previous_patch: The patch reviewed before.
+    :param patch: The new patch.
+    :return: The new or modified hunks, and the number of unchanged hunks.
+    """
+    previous_bodies = {hunk.body for hunk in split_hunks(previous_patch)}
+    hunks = split_hunks(patch)
+    changed_hunks = [hunk for hunk in hunks if hunk.body not in previous_bodies]
+    return changed_hunks, len(hunks) - len(changed_hunks)
+
+
+def keeps_hunks(previous_patch: str, patch: str) -> bool:
+    """Whether every hunk of `previous_patch` is in `patch`, at the same lines.
+
+    If so, line numbers referring to `previous_patch` still hold in `patch`.
+    """
+    hunks = {(hunk.body, hunk.new_start) for hunk in split_hunks(patch)}
+    return all(
+        (hunk.body, hunk.new_start) in hunks for hunk in split_hunks(previous_patch)
+    )
+
+
+def join_hunks(hunks: list[Hunk]) -> str:
+    """Join hunks back into a patch."""
+    return "\n".join(str(hunk) for hunk in hunks)
+
+
+class PatchIndex:
+    """Index of the lines of a patch, mapping patch positions to file lines.
+
+    Positions count the lines of the patch from its first hunk header, which has
+    position 0, as GitHub review comments do. The index is built in a single pass
+    and kept in sorted integer arrays, so lookups are binary searches and huge
+    patches cost a few bytes per line.
+    """
+
+    def __init__(self: PatchIndex, patch: str) -> None:
+        """Build the index of a patch.
+
+        :param patch: The patch.
+        """
+        # Parallel arrays: the i-th line of the new file shown in the patch is
+        # line `new_lines[i]`, at position `new_positions[i]`, and likewise for the
+        # old file. The i-th hunk shows the lines from `hunk_new_starts[i]` to
+        # `hunk_new_ends[i]` of the new file.
+        self.new_positions = array("i")
+        self.new_lines = array("i")
+        self.old_positions = array("i")
+        self.old_lines = array("i")
+        self.hunk_new_starts = array("i")
+        self.hunk_new_ends = array("i")
+
+        position = -1
+        old_line = new_line = 0
+        for line in patch.splitlines():
+            if match := HUNK_HEADER_PATTERN.match(line):
+                position += 1
+                old_line, new_line = int(match.group(1)), int(match.group(3))
+                self.hunk_new_starts.append(new_line)
+                self.hunk_new_ends.append(new_line + int(match.group(4) or 1))
+                continue
+            if position < 0:
+                continue
+
+            position += 1
+            # Context lines are in both files, "\ No newline" markers in neither.
+            if line.startswith(("-", " ")) or not line:
+                self.old_positions.append(position)
+                self.old_lines.append(old_line)
+                old_line += 1
+            if line.startswith(("+", " ")) or not line:
+                self.new_positions.append(position)
+                self.new_lines.append(new_line)
+                new_line += 1
+
+    def new_line_at(self: PatchIndex, position: int) -> int | None:
+        """Get the line of the new file at `position`, if any."""
+        return _lookup(self.new_positions, self.new_lines, position)
+
+    def old_line_at(self: PatchIndex, position: int) -> int | None:
+        """Get the line of the old file at `position`, if any."""
+        return _lookup(self.old_positions, self.old_lines, position)
+
+    def position_of_new_line(self: PatchIndex, line: int) -> int | None:
+        """Get the position of line `line` of the new file, if shown in the patch."""
+        return _lookup(self.new_lines, self.new_positions, line)
+
+    def closest_new_line(self: PatchIndex, line: int) -> int | None:
+        """Get the line of the new file shown in the patch closest to `line`.
+
+        :param line: A line of the new file.
+        :return: The closest line, or None if the patch shows no new lines.
+        """
+        index = bisect.bisect_left(self.new_lines, line)
+        candidates = self.new_lines[max(index - 1, 0) : index + 1]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: abs(candidate - line))
+
+    def hunk_of_new_line(self: PatchIndex, line: int) -> int | None:
+        """Get the index of the hunk showing line `line` of the new file, if any."""
+        index = bisect.bisect_right(self.hunk_new_starts, line) - 1
+        if index >= 0 and line < self.hunk_new_ends[index]:
+            return index
+        return None
+
+
+def _lookup(keys: array, values: array, key: int) -> int | None:
+    """Get the value at `key` in the parallel arrays, with `keys` sorted."""
+    index = bisect.bisect_left(keys, key)
+    if index < len(keys) and keys[index] == key:
+        return values[index]
+    return None
+
+
+def number_lines(patch: str, patch_index: PatchIndex) -> str:
+    """Prefix the lines of a patch with their line number in the new file.
+
+    Hunk headers and removed lines are left unnumbered.
+
+    :param patch: The patch.
+    :param patch_index: The index of `patch`.
+    :return: The numbered patch.
+    """
+    new_positions, new_lines = patch_index.new_positions, patch_index.new_lines
+    width = len(str(new_lines[-1])) if new_lines else 1
+    numbered_lines = []
+    position = -1
+    # Positions are visited in order, so walk the new lines alongside.
+    index = 0
+    for line in patch.splitlines():
+        if position < 0 and not HUNK_HEADER_PATTERN.match(line):
+            numbered_lines.append(line)
+            continue
+        position += 1
+        if index < len(new_positions) and new_positions[index] == position:
+            numbered_lines.append(f"{new_lines[index]:>{width}} {line}")
+            index += 1
+        else:
+            numbered_lines.append(f"{'':>{width}} {line}")
+    return "\n".join(numbered_lines)
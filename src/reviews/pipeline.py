@@ -0,0 +1,113 @@
+"""Additional review passes run alongside the review of a file.
+
+Besides the review of a file, specialized tools, e.g. a security review or a
+summary, can be run on it as additional passes. Each tool declares which files it
+applies to, so passes are skipped before any LLM call. The passes share the
+hydrated context of the file, and their outputs are merged into its review.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from src.common.constants import Tools
+from src.common.tools.security_review import SecurityReview
+from src.common.tools.summarize_file import SummarizeFile
+from src.config import config
+from src.utils import metrics
+from src.utils.exceptions import ConfigError
+
+if TYPE_CHECKING:
+    from src.common.tools.tool import Tool
+    from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+
+ADDITIONAL_PASSES: dict[Tools, type[Tool]] = {
+    Tools.SECURITY_REVIEW: SecurityReview,
+    Tools.SUMMARIZE_FILE: SummarizeFile,
+}
+
+PASS_TITLES: dict[Tools, str] = {
+    Tools.SECURITY_REVIEW: "Security review",
+    Tools.SUMMARIZE_FILE: "Summary of the changes",
+}
+
+
+def get_additional_passes() -> list[Tools]:
+    """Get the additional passes enabled in the configuration.
+
+    :raises ConfigError: If an enabled pass is unknown.
+    :return: The tools of the enabled passes.
+    """
+    passes = []
+    for name in config.modules.reviews.additional_passes or []:
+        if name not in ADDITIONAL_PASSES:
+            message = f"Unknown review pass: {name}"
+            raise ConfigError(message)
+        passes.append(Tools(name))
+    return passes
+
+
+def select_passes(file_diff: PullRequestFileChanges) -> list[Tools]:
+    """Select the enabled additional passes that apply to a file.
+
+    :param file_diff: The pull request file changes.
+    :return: The tools of the passes to run on the file.
+    """
+    passes = []
+    for tool in get_additional_passes():
+        if ADDITIONAL_PASSES[tool].applies_to(request=file_diff):
+            passes.append(tool)
+        else:
+            metrics.increment("reviews.skipped_passes")
+    return passes
+
+
+async def run_pass(
+    tool: Tools,
+    file_diff: PullRequestFileChanges,
+    numbered_patch: str,
+) -> str:
+    """Run an additional pass on a file.
+
+    :param tool: The tool of the pass.
+    :param file_diff: The pull request file changes.
+    :param numbered_patch: The patch of the file numbered by line, shared by all
+        passes on the file.
+    :return: The output of the pass.
+    """
+    metrics.increment("reviews.passes")
+    output = ""
+    async for content in await ADDITIONAL_PASSES[tool].arun(
+        request=file_diff,
+        numbered_patch=numbered_patch,
+    ):
+        output += content
+    return output
+
+
+def render_passes(outputs: dict[str, str]) -> str:
+    """Render the outputs of additional passes as markdown sections."""
+    return "".join(
+        f"\n\n---\n\n### {PASS_TITLES[Tools(tool)]}\n\n{output}"
+        for tool, output in outputs.items()
+    )
+
+
+def merge_passes(file_review: FileReview, outputs: dict[str, str]) -> FileReview:
+    """Merge the outputs of additional passes into the review of a file.
+
+    :param file_review: The review of the file.
+    :param outputs: The outputs of the passes, by tool.
+    :return: The review of the file including the outputs.
+    """
+    return file_review.model_copy(
+        update={
+            "content": file_review.content + render_passes(outputs),
+            "passes": outputs,
+        },
+    )
+
+
+def strip_passes(file_review: FileReview) -> str:
+    """Get the content of a review without the outputs of additional passes."""
+    return file_review.content.removesuffix(render_passes(file_review.passes))
@@ -0,0 +1,495 @@
+"""Semantic cache of file reviews, for near-duplicate file diffs.
+
+The same refactor applied across many modules produces file diffs that differ
+only in names. Rather than reviewing each of them, one representative is reviewed
+and its review is adapted to the others.
+
+Patches are normalized to their changed lines, with identifiers renamed in order
+of appearance, and embedded into fixed-size signatures: MinHash signatures of
+token shingles, computed locally, or random hyperplane (SimHash) signatures of
+OpenAI embeddings. Either way, the similarity of two patches is estimated by
+the fraction of equal signature components, and candidates are found through a
+locality-sensitive hashing (LSH) index over bands of the signatures. The index
+keeps a bounded number of entries and evicts the least recently used.
+
+Each review gets a cache of its own, so that reviews never leak across pull
+requests or repositories. Reviews are adapted by mapping the identifiers of the
+representative patch to those of the near-duplicate, and are not adapted when
+the identifiers of the patches cannot be mapped one to one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import difflib
+import hashlib
+import logging
+import random
+import re
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Self
+
+from src.config import config
+from src.reviews import pipeline, structured_reviews
+from src.reviews.patches import PatchIndex, split_hunks
+from src.utils import metrics
+from src.utils.exceptions import ConfigError
+from src.utils.llm import estimate_tokens
+
+if TYPE_CHECKING:
+    from box import Box
+    from langchain_core.embeddings import Embeddings
+
+    from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+    from src.reviews.patches import Hunk
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_]\w*|\d+|[^\w\s]")
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_]\w*")
+SHINGLE_SIZE = 3
+# Hyperplanes are drawn from seeded randomness, to be comparable across workers.
+SEED = 0
+
+
+def tokenize_patch(patch: str) -> list[str]:
+    """Split the changed lines of a patch into tokens, each preceded by its sign."""
+    tokens = []
+    for line in patch.splitlines():
+        if line.startswith(("+", "-")):
+            tokens.append(line[0])
+            tokens.extend(TOKEN_PATTERN.findall(line[1:]))
+    return tokens
+
+
+def normalize_patch(patch: str) -> list[str]:
+    """Normalize a patch into the tokens of its changed lines.
+
+    Identifiers are renamed in order of first appearance, so that patches only
+    differing in names are normalized alike.
+
+    :param patch: The patch.
+    :return: The normalized tokens.
+    """
+    names: dict[str, str] = {}
+    return [
+        names.setdefault(token, f"v{len(names)}")
+        if IDENTIFIER_PATTERN.fullmatch(token)
+        else token
+        for token in tokenize_patch(patch)
+    ]
+
+
+def map_identifiers(patch: str, other_patch: str) -> dict[str, str] | None:
+    """Map the identifiers of a patch to those of a near-duplicate patch.
+
+    The tokens of the patches are aligned with identifiers left out, and
+    identifiers are mapped to the identifiers they are aligned with.
+
+    :param patch: The patch.
+    :param other_patch: The near-duplicate patch.
+    :return: The identifiers that differ, mapped to their counterparts, or None if
+        an identifier is aligned with different ones.
+    """
+    tokens = tokenize_patch(patch)
+    other_tokens = tokenize_patch(other_patch)
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_shape(token) for token in tokens],
+        [_shape(token) for token in other_tokens],
+        autojunk=False,
+    )
+    mapping: dict[str, str] = {}
+    inverse_mapping: dict[str, str] = {}
+    for start, other_start, size in matcher.get_matching_blocks():
+        for token, other_token in zip(
+            tokens[start : start + size],
+            other_tokens[other_start : other_start + size],
+            strict=True,
+        ):
+            if not IDENTIFIER_PATTERN.fullmatch(token):
+                continue
+            if (
+                mapping.setdefault(token, other_token) != other_token
+                or inverse_mapping.setdefault(other_token, token) != token
+            ):
+                return None
+    return {
+        name: other_name for name, other_name in mapping.items() if name != other_name
+    }
+
+
+class Embedder(ABC):
+    """Embedder is an abstract class for patch embedders."""
+
+    def __init__(self: Self, signature_size: int) -> None:
+        """Initialize the embedder.
+
+        :param signature_size: Number of components of the signatures.
+        """
+        self.signature_size = signature_size
+
+    @abstractmethod
+    async def embed(self: Self, tokens: list[str]) -> array:
+        """Embed normalized patch tokens into a signature."""
+        raise NotImplementedError
+
+
+class MinHashEmbedder(Embedder):
+    """Embedder computing MinHash signatures of token shingles locally.
+
+    The fraction of equal components of two signatures estimates the Jaccard
+    similarity of the shingles of the patches. Shingles are hashed once and
+    binned by hash (one permutation hashing), each component being the minimum of
+    a bin, so embedding takes linear time in the size of the patch. Empty bins
+    take the minimum of the next non-empty one.
+    """
+
+    async def embed(self: Self, tokens: list[str]) -> array:
+        """Embed normalized patch tokens into a MinHash signature."""
+        return await asyncio.to_thread(self._minhash, tokens)
+
+    def _minhash(self: Self, tokens: list[str]) -> array:
+        size = self.signature_size
+        bins: list[int | None] = [None] * size
+        for index in range(max(len(tokens) - SHINGLE_SIZE + 1, 1)):
+            shingle = " ".join(tokens[index : index + SHINGLE_SIZE])
+            value = int.from_bytes(
+                hashlib.blake2b(shingle.encode(), digest_size=8).digest(),
+            )
+            bin_index, value = value % size, value // size
+            minimum = bins[bin_index]
+            if minimum is None or value < minimum:
+                bins[bin_index] = value
+
+        signature = array("Q", bytes(8 * size))
+        filled = [(i, value) for i, value in enumerate(bins) if value is not None]
+        for index in range(size):
+            next_filled = bisect.bisect_left(filled, index, key=lambda item: item[0])
+            signature[index] = filled[next_filled % len(filled)][1]
+        return signature
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder computing SimHash signatures of OpenAI embeddings.
+
+    Each component is the side of a random hyperplane the embedding lies on, so
+    the fraction of equal components of two signatures estimates the angular
+    similarity of the embeddings.
+    """
+
+    def __init__(self: Self, signature_size: int, model: str) -> None:
+        """Initialize the embedder.
+
+        :param signature_size: Number of components of the signatures.
+        :param model: The embedding model.
+        """
+        super().__init__(signature_size)
+        self.model = model
+        self._embeddings: Embeddings | None = None
+        self._hyperplanes: list[list[float]] = []
+
+    async def embed(self: Self, tokens: list[str]) -> array:
+        """Embed normalized patch tokens into a SimHash signature."""
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+
+            self._embeddings = OpenAIEmbeddings(model=self.model)
+        vector = await self._embeddings.aembed_query(" ".join(tokens))
+        return await asyncio.to_thread(self._simhash, vector)
+
+    def _simhash(self: Self, vector: list[float]) -> array:
+        if not self._hyperplanes:
+            generator = random.Random(SEED)
+            self._hyperplanes = [
+                [generator.gauss(0.0, 1.0) for _ in vector]
+                for _ in range(self.signature_size)
+            ]
+        return array(
+            "Q",
+            (
+                int(sum(x * y for x, y in zip(hyperplane, vector, strict=True)) >= 0)
+                for hyperplane in self._hyperplanes
+            ),
+        )
+
+
+@dataclass(eq=False)
+class CacheEntry:
+    """Review of a representative file diff, possibly still in progress.
+
+    Attributes
+    ----------
+        - key: The key of the entry in the cache.
+        - filename: The name of the representative file.
+        - signature: The signature of the patch of the file.
+        - review: The review of the file, once done.
+    """
+
+    key: int
+    filename: str
+    signature: array
+    review: asyncio.Future[FileReview] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future(),
+    )
+
+
+class SemanticCache:
+    """Bounded LSH index of file reviews by patch signature."""
+
+    def __init__(self: Self, embedder: Embedder, cache_config: Box) -> None:
+        """Initialize the cache.
+
+        :param embedder: The embedder of the patches.
+        :param cache_config: The semantic cache configuration, with the number of
+            `bands` of the signatures in the LSH index, the minimum similarity
+            (`threshold`) of near-duplicate patches, the maximum number of cached
+            reviews (`max_entries`) and the minimum number of tokens of cached
+            patches (`min_tokens`), smaller ones being cheap to review and prone
+            to spurious matches.
+        """
+        if embedder.signature_size % cache_config.bands:
+            message = "The signature size must be a multiple of the number of bands."
+            raise ConfigError(message)
+        self.embedder = embedder
+        self.bands: int = cache_config.bands
+        self.rows = embedder.signature_size // self.bands
+        self.threshold: float = cache_config.threshold
+        self.max_entries: int = cache_config.max_entries
+        self.min_tokens: int = cache_config.min_tokens
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._buckets: defaultdict[tuple[int, bytes], set[int]] = defaultdict(set)
+        self._next_key = 0
+
+    async def signature(self: Self, file_diff: PullRequestFileChanges) -> array | None:
+        """Get the signature of a file diff, or None if it is too small to cache."""
+        tokens = normalize_patch(file_diff.patch)
+        if len(tokens) < self.min_tokens:
+            return None
+        return await self.embedder.embed(tokens)
+
+    def find(self: Self, signature: array) -> tuple[CacheEntry, float] | None:
+        """Find the most similar cached review above the similarity threshold.
+
+        :param signature: The signature of the patch.
+        :return: The cached review and its similarity, if any.
+        """
+        best: tuple[CacheEntry, float] | None = None
+        for key in self._candidates(signature):
+            entry = self._entries[key]
+            similarity = _similarity(signature, entry.signature)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = entry, similarity
+
+        if best is None:
+            metrics.increment("semantic_cache.misses")
+            return None
+        self._entries.move_to_end(best[0].key)
+        metrics.increment("semantic_cache.hits")
+        return best
+
+    def add(self: Self, filename: str, signature: array) -> CacheEntry:
+        """Add the review of a representative file, to be completed by the caller.
+
+        :param filename: The name of the file.
+        :param signature: The signature of the patch of the file.
+        :return: The entry, whose review must be set or cancelled.
+        """
+        key, self._next_key = self._next_key, self._next_key + 1
+        entry = CacheEntry(key=key, filename=filename, signature=signature)
+        self._entries[key] = entry
+        for band in self._bands(signature):
+            self._buckets[band].add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            metrics.increment("semantic_cache.evictions")
+        return entry
+
+    def discard(self: Self, entry: CacheEntry) -> None:
+        """Remove an entry, e.g. when the review of its file failed."""
+        if self._entries.get(entry.key) is entry:
+            self._remove(entry.key)
+
+    def _remove(self: Self, key: int) -> None:
+        entry = self._entries.pop(key)
+        for band in self._bands(entry.signature):
+            bucket = self._buckets[band]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band]
+
+    def _bands(self: Self, signature: array) -> list[tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _candidates(self: Self, signature: array) -> set[int]:
+        candidates: set[int] = set()
+        for band in self._bands(signature):
+            candidates |= self._buckets.get(band, set())
+        return candidates
+
+
+def _similarity(signature: array, other_signature: array) -> float:
+    """Estimate the similarity of two patches from their signatures."""
+    equal = sum(x == y for x, y in zip(signature, other_signature, strict=True))
+    return equal / len(signature)
+
+
+def _shape(token: str) -> str:
+    """Replace an identifier by a placeholder, leaving other tokens as they are."""
+    return "v" if IDENTIFIER_PATTERN.fullmatch(token) else token
+
+
+def adapt_review(
+    file_review: FileReview,
+    file_diff: PullRequestFileChanges,
+    similarity: float,
+) -> FileReview | None:
+    """Adapt the review of a near-duplicate file diff to `file_diff`.
+
+    Mentions of the representative file and of its identifiers are renamed.
+    Structured comments are moved along with their hunk, matching the hunks of
+    both patches in order. Free-form reviews refer to lines of the representative
+    file, so they are only reused when the hunks of both patches are at the same
+    lines.
+
+    This runs in the structured reviews executor, possibly in another process:
+    the caller records the outcome.
+
+    :param file_review: The review of the representative file diff.
+    :param file_diff: The file diff to adapt the review to.
+    :param similarity: The estimated similarity of the patches.
+    :return: The review of `file_diff`, or None if the hunks of the patches do not
+        line up or their identifiers cannot be mapped.
+    """
+    representative_hunks = split_hunks(file_review.patch)
+    hunks = split_hunks(file_diff.patch)
+    if len(hunks) != len(representative_hunks) or not (
+        file_review.comments or _line_up(hunks, representative_hunks)
+    ):
+        return None
+    mapping = map_identifiers(file_review.patch, file_diff.patch)
+    if mapping is None:
+        return None
+    mapping[file_review.filename] = file_diff.filename
+    rename = _renamer(mapping)
+
+    note = (
+        f"_This review was adapted from the review of `{file_review.filename}`,"
+        f" whose changes are near-identical (similarity {similarity:.2f})._\n\n"
+    )
+    passes = {tool: rename(output) for tool, output in file_review.passes.items()}
+
+    if not file_review.comments:
+        return file_review.model_copy(
+            update={
+                "filename": file_diff.filename,
+                "content": note + rename(file_review.content),
+                "patch": file_diff.patch,
+                "passes": passes,
+            },
+        )
+
+    raw_comments = []
+    representative_index = PatchIndex(file_review.patch)
+    for comment in file_review.comments:
+        hunk_index = representative_index.hunk_of_new_line(comment.end_line)
+        if hunk_index is None:
+            continue
+        shift = hunks[hunk_index].new_start - representative_hunks[hunk_index].new_start
+        raw_comments.append(
+            comment.model_dump(exclude={"position"})
+            | {
+                "start_line": comment.start_line + shift,
+                "end_line": comment.end_line + shift,
+                "body": rename(comment.body),
+            },
+        )
+    comments, _ = structured_reviews.validate_comments(
+        raw_comments,
+        file_diff.patch_index,
+    )
+    content = structured_reviews.render_comments(comments) + pipeline.render_passes(
+        passes,
+    )
+    return file_review.model_copy(
+        update={
+            "filename": file_diff.filename,
+            "content": note + content,
+            "patch": file_diff.patch,
+            "comments": comments,
+            "passes": passes,
+        },
+    )
+
+
+def _line_up(hunks: list[Hunk], other_hunks: list[Hunk]) -> bool:
+    """Whether the hunks of two patches show the same lines of their new files."""
+    return all(
+        (hunk.new_start, hunk.new_count) == (other_hunk.new_start, other_hunk.new_count)
+        for hunk, other_hunk in zip(hunks, other_hunks, strict=True)
+    )
+
+
+def _renamer(mapping: dict[str, str]) -> Callable[[str], str]:
+    """Get a function renaming the keys of `mapping` in a text, all at once."""
+    # Longest first, so that a name is not renamed in part.
+    names = sorted(mapping, key=len, reverse=True)
+    pattern = re.compile(
+        "|".join(
+            rf"(?<!\w){re.escape(name)}(?!\w)"
+            if IDENTIFIER_PATTERN.fullmatch(name)
+            else re.escape(name)
+            for name in names
+        ),
+    )
+    return lambda text: pattern.sub(lambda match: mapping[match.group()], text)
+
+
+def record_savings(file_diff: PullRequestFileChanges, llm_calls: int) -> None:
+    """Record the cost saved by reusing a review for `file_diff`."""
+    metrics.increment("semantic_cache.saved_llm_calls", llm_calls)
+    metrics.increment(
+        "semantic_cache.saved_input_tokens",
+        llm_calls * estimate_tokens(file_diff.patch),
+    )
+
+
+_embedder: Embedder | None = None
+
+
+def create_semantic_cache() -> SemanticCache | None:
+    """Create a semantic cache for one review, if enabled in the configuration.
+
+    Embedders are shared by the caches of the process, cached reviews are not.
+
+    :raises ConfigError: If the configured embedder is unknown.
+    :return: The semantic cache, or None if disabled.
+    """
+    global _embedder  # noqa: PLW0603
+
+    cache_config: Box = config.modules.reviews.semantic_cache
+    if not cache_config.enabled:
+        return None
+
+    if _embedder is None:
+        match cache_config.embedder:
+            case "minhash":
+                _embedder = MinHashEmbedder(cache_config.signature_size)
+            case "openai":
+                _embedder = OpenAIEmbedder(
+                    cache_config.signature_size,
+                    cache_config.embedding_model,
+                )
+            case _:
+                message = f"Unknown embedder: {cache_config.embedder}"
+                raise ConfigError(message)
+
+    return SemanticCache(_embedder, cache_config)
@@ -2,75 +2,644 @@
 
 import asyncio
 import logging
+from array import array
+from collections import deque
+from contextlib import aclosing
+from pathlib import PurePosixPath
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    Self,
+    TypeVar,
+)
 
+from src.common.constants import NON_CODE_SUFFIXES, Tools
 from src.common.tools.review_pull_request import ReviewPullRequest
 from src.config import config
+from src.reviews import pipeline, structured_reviews, summaries
+from src.reviews.checkpoints import get_checkpoint_store
 from src.reviews.constants import ReviewStatus
-from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
-from src.utils import api
+from src.reviews.models.pull_requests import (
+    FileReview,
+    PullRequestFileChanges,
+    ReviewComment,
+)
+from src.reviews.patches import (
+    Hunk,
+    PatchIndex,
+    find_changed_hunks,
+    join_hunks,
+    keeps_hunks,
+    number_lines,
+)
+from src.reviews.semantic_cache import (
+    CacheEntry,
+    SemanticCache,
+    adapt_review,
+    create_semantic_cache,
+    record_savings,
+)
+from src.utils import admission, api, concurrency, metrics
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+CARRIED_OVER_HEADER = (
+    "\n\n---\n\nReview of the unchanged parts of this file from previous pushes:\n\n"
+)
+
+SKIPPED_FILE_REVIEW = (
+    "_This file was not reviewed: under high load, only files with code are"
+    " reviewed._"
+)
+
 
 async def create_review_from_file_diffs(
-    file_diffs: list[PullRequestFileChanges],
+    file_diffs: Iterable[PullRequestFileChanges]
+    | AsyncIterable[PullRequestFileChanges],
     review_id: int,
     review_status_id: int,
+    total_files: int | None = None,
+    previous_review_id: int | None = None,
 ) -> None:
-    """Create a pull request review from file diffs."""
-    semaphore = asyncio.Semaphore(config.modules.reviews.max_concurrent_file_reviews)
-
-    total_files = len(file_diffs)
-    reviewed_files = 0
-
-    review_tasks = [
-        _review_file_diff(file_diff=file_diff, semaphore=semaphore)
-        for file_diff in file_diffs
-    ]
-    review_per_file: dict[str, str] = {}
-    for task in asyncio.as_completed(review_tasks):
-        review_per_file |= await task
-
-        reviewed_files += 1
-        progress_value = int((reviewed_files / total_files) * 100)
-        await api.update_progress(
-            review_status_id,
-            progress_value,
-            ReviewStatus.processing,
-        )
+    """Create a pull request review from file diffs.
+
+    File diffs are pulled from `file_diffs` only once a review slot is free, so a
+    lazily produced stream keeps memory bounded by the concurrency rather than by
+    the size of the pull request.
+
+    Completed file reviews are checkpointed, and files already reviewed by an
+    earlier, interrupted attempt at the same review are restored rather than
+    reviewed again.
+
+    Given the review of a previous push to the pull request, only hunks that are
+    new or modified since then are sent to the LLM, and the previous review of the
+    file is carried over for the rest. Structured comments are carried over only
+    on unchanged hunks, moved along with them. Free-form reviews cannot be split
+    by hunk, so they are carried over only while all the hunks they refer to are
+    unchanged and in place, and the file is reviewed anew otherwise. The previous
+    review is read from the checkpoint store, so it is only found by workers
+    sharing the store with the one that made it. Otherwise the pull request is
+    reviewed in full, and `reviews.previous_review_missing` is counted.
+
+    Additional passes that apply to a file run concurrently with its review, and
+    count towards the same concurrency limit. Once all files are reviewed, the
+    pull request is summarized from their reviews.
+
+    Under high load, jobs degraded by admission control skip the files without
+    code and the additional passes.
+
+    With the semantic cache enabled, files whose changes are near-identical to
+    those of a file reviewed before in the same review get its review, adapted to
+    them. The signatures of upcoming files are computed while earlier ones are
+    fed. Degraded jobs are not cached.
+
+    With concurrency autotuning enabled, the concurrency limit is shared by the
+    reviews of the worker and adapted to the observed capacity of the provider.
 
-    patches_per_file = {file_diff.filename: file_diff.patch for file_diff in file_diffs}
+    :param file_diffs: The file diffs to review.
+    :param review_id: The review ID.
+    :param review_status_id: The review status ID.
+    :param total_files: Number of file diffs, used to report progress. Progress is
+        not reported if it is unknown.
+    :param previous_review_id: ID of the review of a previous push, if any.
+    """
+    async with asyncio.TaskGroup() as task_group:
+        review_run = _ReviewRun(task_group, review_id, review_status_id, total_files)
+        await review_run.load_checkpoints(previous_review_id)
 
-    file_reviews = [
-        FileReview(
-            filename=filename,
-            content=content,
-            patch=patches_per_file.get(filename, ""),
+        prefetched = _prefetch_signatures(
+            _iterate(file_diffs),
+            review_run.semantic_cache,
+            review_run.is_cacheable,
         )
-        for filename, content in review_per_file.items()
-    ]
+        async with aclosing(prefetched):
+            async for file_diff, signature_task in prefetched:
+                await review_run.feed(file_diff, signature_task)
+
+    summary = await summaries.summarize_pull_request(review_run.file_reviews)
     await api.complete_review(
         review_id=review_id,
         review_status_id=review_status_id,
-        file_reviews=file_reviews,
+        file_reviews=review_run.file_reviews,
+        summary=summary,
+    )
+    await review_run.checkpoint_store.prune(
+        config.modules.reviews.checkpoints.retention_days * SECONDS_PER_DAY,
     )
+    metrics.log_metrics()
+
+
+class _ReviewRun:
+    """Review of the file diffs of a pull request, fed file by file.
+
+    Every file is restored from a checkpoint, carried over from the review of a
+    previous push, adapted from the review of a near-duplicate file, or reviewed
+    along with its additional passes in tasks of the review's task group.
+    """
+
+    def __init__(
+        self: Self,
+        task_group: asyncio.TaskGroup,
+        review_id: int,
+        review_status_id: int,
+        total_files: int | None,
+    ) -> None:
+        """Initialize the review.
+
+        :param task_group: The task group the reviews of the files run in.
+        :param review_id: The review ID.
+        :param review_status_id: The review status ID.
+        :param total_files: Number of file diffs, if known.
+        """
+        self.task_group = task_group
+        self.review_id = review_id
+        self.review_status_id = review_status_id
+        self.total_files = total_files
+        self.semaphore = concurrency.get_file_review_limiter()
+        self.progress_lock = asyncio.Lock()
+        self.file_reviews: list[FileReview] = []
+        self.checkpoint_store = get_checkpoint_store()
+        self.checkpointed_reviews: dict[str, FileReview] = {}
+        self.previous_reviews: dict[str, FileReview] = {}
+        self.semantic_cache = (
+            None if admission.is_degraded() else create_semantic_cache()
+        )
+
+    async def load_checkpoints(self: Self, previous_review_id: int | None) -> None:
+        """Load the checkpoints of this review and of the previous one, if any."""
+        self.checkpointed_reviews = {
+            file_review.filename: file_review
+            for file_review in await self.checkpoint_store.load(self.review_id)
+        }
+        if self.checkpointed_reviews:
+            logger.info(
+                "Resuming review %s from %s checkpointed file(s)",
+                self.review_id,
+                len(self.checkpointed_reviews),
+            )
+
+        if previous_review_id is None or previous_review_id == self.review_id:
+            return
+        self.previous_reviews = {
+            file_review.filename: file_review
+            for file_review in await self.checkpoint_store.load(previous_review_id)
+        }
+        if not self.previous_reviews:
+            logger.info(
+                "Review %s of a previous push not found, reviewing in full",
+                previous_review_id,
+            )
+            metrics.increment("reviews.previous_review_missing")
+
+    def is_cacheable(self: Self, file_diff: PullRequestFileChanges) -> bool:
+        """Whether the review of a file diff may come from the semantic cache."""
+        checkpointed_review = self.checkpointed_reviews.get(file_diff.filename)
+        return (
+            checkpointed_review is None or checkpointed_review.patch != file_diff.patch
+        ) and file_diff.filename not in self.previous_reviews
+
+    async def feed(
+        self: Self,
+        file_diff: PullRequestFileChanges,
+        signature_task: asyncio.Task[array | None] | None,
+    ) -> None:
+        """Review a file diff, waiting for review slots if it is sent to the LLM.
+
+        :param file_diff: The pull request file changes.
+        :param signature_task: The task computing the signature of the file diff
+            for the semantic cache, if started ahead.
+        """
+        checkpointed_review = self.checkpointed_reviews.pop(file_diff.filename, None)
+        if (
+            checkpointed_review is not None
+            and checkpointed_review.patch == file_diff.patch
+        ):
+            self.file_reviews.append(checkpointed_review)
+            await self.report_progress()
+            return
+
+        previous_review = self._take_previous_review(file_diff)
+        changed_hunks: list[Hunk] = []
+        if previous_review is not None:
+            changed_hunks, unchanged_hunks = find_changed_hunks(
+                previous_review.patch,
+                file_diff.patch,
+            )
+            metrics.increment("reviews.reused_hunks", unchanged_hunks)
+            if not changed_hunks:
+                metrics.increment("reviews.reused_files")
+                await self.complete(await _reuse_review(file_diff, previous_review))
+                return
+
+        if admission.is_degraded() and not _is_code_file(file_diff.filename):
+            metrics.increment("reviews.skipped_files")
+            self.file_reviews.append(
+                FileReview(
+                    filename=file_diff.filename,
+                    content=SKIPPED_FILE_REVIEW,
+                    patch=file_diff.patch,
+                ),
+            )
+            return
+
+        cache_entry = None
+        if self.semantic_cache is not None and previous_review is None:
+            signature = await (
+                signature_task or self.semantic_cache.signature(file_diff)
+            )
+            if signature is not None:
+                cached = self.semantic_cache.find(signature)
+                if cached is not None:
+                    self.task_group.create_task(
+                        self.adapt_and_report(file_diff, *cached),
+                    )
+                    return
+                cache_entry = self.semantic_cache.add(file_diff.filename, signature)
+
+        await self._start_review(
+            file_diff,
+            previous_review,
+            changed_hunks,
+            cache_entry,
+        )
+
+    def _take_previous_review(
+        self: Self,
+        file_diff: PullRequestFileChanges,
+    ) -> FileReview | None:
+        """Take the review of the file in the previous push, if it still holds."""
+        previous_review = self.previous_reviews.pop(file_diff.filename, None)
+        if previous_review is not None and not (
+            _has_structured_comments(previous_review)
+            or keeps_hunks(previous_review.patch, file_diff.patch)
+        ):
+            # The line numbers of the free-form review no longer hold.
+            metrics.increment("reviews.stale_reviews")
+            return None
+        return previous_review
+
+    async def _start_review(
+        self: Self,
+        file_diff: PullRequestFileChanges,
+        previous_review: FileReview | None,
+        changed_hunks: list[Hunk],
+        cache_entry: CacheEntry | None,
+    ) -> None:
+        """Start the review of a file and its additional passes, in the task group.
+
+        Only this method acquires slots, one per LLM call of the file, and each
+        call releases its own, so the passes of a file cannot starve.
+        """
+        passes = [] if admission.is_degraded() else pipeline.select_passes(file_diff)
+        numbered_patch = number_lines(file_diff.patch, file_diff.patch_index)
+        await self.semaphore.acquire()
+        review_task = self._start_call(
+            self.review(file_diff, previous_review, changed_hunks, numbered_patch),
+        )
+        pass_tasks = {}
+        for tool in passes:
+            await self.semaphore.acquire()
+            pass_tasks[tool] = self._start_call(
+                pipeline.run_pass(tool, file_diff, numbered_patch),
+            )
+        self.task_group.create_task(
+            self.merge_and_report(review_task, pass_tasks, cache_entry),
+        )
+
+    def _start_call(self: Self, call: Coroutine[Any, Any, T]) -> asyncio.Task[T]:
+        """Start an LLM call holding a slot, released once the call is done.
+
+        The slot is released by the task, so that it is returned even if the task
+        group cancels the call before it starts.
+        """
+        task = self.task_group.create_task(call)
+        task.add_done_callback(lambda _: self.semaphore.release())
+        return task
+
+    async def review(
+        self: Self,
+        file_diff: PullRequestFileChanges,
+        previous_review: FileReview | None,
+        changed_hunks: list[Hunk],
+        numbered_patch: str,
+    ) -> FileReview:
+        """Review a file, or its changed hunks."""
+        if previous_review is None:
+            return await _review_file_diff(
+                file_diff=file_diff,
+                numbered_patch=numbered_patch,
+            )
+        return await _review_changed_hunks(
+            file_diff=file_diff,
+            previous_review=previous_review,
+            changed_hunks=changed_hunks,
+        )
+
+    async def merge_and_report(
+        self: Self,
+        review_task: asyncio.Task[FileReview],
+        pass_tasks: dict[Tools, asyncio.Task[str]],
+        cache_entry: CacheEntry | None,
+    ) -> None:
+        """Merge the review of a file with its passes, and complete it."""
+        try:
+            file_review = await review_task
+            if pass_tasks:
+                outputs = {str(tool): await task for tool, task in pass_tasks.items()}
+                file_review = pipeline.merge_passes(file_review, outputs)
+        except BaseException:
+            if cache_entry is not None and self.semantic_cache is not None:
+                # Near-duplicates waiting for this review are reviewed themselves.
+                cache_entry.review.cancel()
+                self.semantic_cache.discard(cache_entry)
+            raise
+        if cache_entry is not None:
+            cache_entry.review.set_result(file_review)
+        await self.complete(file_review)
+
+    async def adapt_and_report(
+        self: Self,
+        file_diff: PullRequestFileChanges,
+        cache_entry: CacheEntry,
+        similarity: float,
+    ) -> None:
+        """Adapt the review of a near-duplicate file, or review the file itself."""
+        file_review = None
+        try:
+            # Shielded, so that cancelling this task does not cancel the review.
+            representative_review = await asyncio.shield(cache_entry.review)
+        except asyncio.CancelledError:
+            if not cache_entry.review.cancelled():
+                raise
+        else:
+            file_review = await asyncio.get_running_loop().run_in_executor(
+                structured_reviews.get_executor(),
+                adapt_review,
+                representative_review,
+                file_diff,
+                similarity,
+            )
+            if file_review is None:
+                metrics.increment("semantic_cache.unadapted_reviews")
+            else:
+                record_savings(file_diff, 1 + len(representative_review.passes))
+        if file_review is None:
+            # The representative failed, or its review does not map to this file.
+            await self._start_review(file_diff, None, [], None)
+            return
+        await self.complete(file_review)
+
+    async def complete(self: Self, file_review: FileReview) -> None:
+        """Checkpoint the review of a file, and report progress."""
+        await self.checkpoint_store.save(self.review_id, file_review)
+        self.file_reviews.append(file_review)
+        await self.report_progress()
+
+    async def report_progress(self: Self) -> None:
+        """Report the share of files reviewed, if the number of files is known."""
+        if self.total_files:
+            # Keep progress updates ordered.
+            async with self.progress_lock:
+                progress_value = int(
+                    (len(self.file_reviews) / self.total_files) * 100,
+                )
+                await api.update_progress(
+                    self.review_status_id,
+                    min(progress_value, 100),
+                    ReviewStatus.processing,
+                )
+
+
+def _has_structured_comments(file_review: FileReview) -> bool:
+    """Whether a review is made of structured comments, which can be carried over."""
+    return config.modules.reviews.structured_output.enabled and (
+        bool(file_review.comments) or not file_review.content
+    )
+
+
+def _own_content(file_review: FileReview) -> str:
+    """Get the review of a file itself, without passes and carried over reviews."""
+    content = pipeline.strip_passes(file_review)
+    if file_review.carried_over:
+        content = content.removesuffix(CARRIED_OVER_HEADER + file_review.carried_over)
+    return content
+
+
+async def _carry_over_comments(
+    file_diff: PullRequestFileChanges,
+    previous_review: FileReview,
+) -> list[ReviewComment]:
+    """Carry the comments on unchanged hunks over to the patch of `file_diff`."""
+    return await asyncio.get_running_loop().run_in_executor(
+        structured_reviews.get_executor(),
+        structured_reviews.carry_over_comments,
+        previous_review.comments,
+        previous_review.patch,
+        file_diff.patch,
+        file_diff.patch_index,
+    )
+
+
+async def _reuse_review(
+    file_diff: PullRequestFileChanges,
+    previous_review: FileReview,
+) -> FileReview:
+    """Reuse the review of a previous push whose hunks are all unchanged.
+
+    Structured comments are moved along with hunks that moved.
+
+    :param file_diff: The pull request file changes.
+    :param previous_review: The review of the file in a previous push.
+    :return: The review of the file.
+    """
+    if keeps_hunks(previous_review.patch, file_diff.patch):
+        return previous_review.model_copy(update={"patch": file_diff.patch})
+
+    comments = await _carry_over_comments(file_diff, previous_review)
+    return previous_review.model_copy(
+        update={
+            "content": structured_reviews.render_comments(comments)
+            + pipeline.render_passes(previous_review.passes),
+            "patch": file_diff.patch,
+            "comments": comments,
+        },
+    )
+
+
+def _is_code_file(filename: str) -> bool:
+    """Whether a file holds code, judging by its name."""
+    return PurePosixPath(filename).suffix.lower() not in NON_CODE_SUFFIXES
+
+
+async def _iterate(
+    file_diffs: (
+        Iterable[PullRequestFileChanges] | AsyncIterable[PullRequestFileChanges]
+    ),
+) -> AsyncIterator[PullRequestFileChanges]:
+    """Iterate over sync and async iterables alike."""
+    if isinstance(file_diffs, AsyncIterable):
+        async for file_diff in file_diffs:
+            yield file_diff
+    else:
+        for file_diff in file_diffs:
+            yield file_diff
+
+
+async def _prefetch_signatures(
+    file_diffs: AsyncIterator[PullRequestFileChanges],
+    semantic_cache: SemanticCache | None,
+    is_cacheable: Callable[[PullRequestFileChanges], bool],
+) -> AsyncGenerator[
+    tuple[PullRequestFileChanges, asyncio.Task[array | None] | None],
+    None,
+]:
+    """Compute the signatures of upcoming file diffs ahead of feeding them.
+
+    Up to `lookahead` file diffs are read ahead, and the signatures of those that
+    may be cached are computed concurrently.
+
+    :param file_diffs: The file diffs.
+    :param semantic_cache: The semantic cache, if enabled.
+    :param is_cacheable: Whether the review of a file diff may be cached.
+    :return: The file diffs, in order, with the task computing their signature.
+    """
+    if semantic_cache is None:
+        async for file_diff in file_diffs:
+            yield file_diff, None
+        return
+
+    lookahead = config.modules.reviews.semantic_cache.lookahead
+    pending: deque[
+        tuple[PullRequestFileChanges, asyncio.Task[array | None] | None]
+    ] = deque()
+    try:
+        async for file_diff in file_diffs:
+            signature_task = (
+                asyncio.create_task(semantic_cache.signature(file_diff))
+                if is_cacheable(file_diff)
+                else None
+            )
+            pending.append((file_diff, signature_task))
+            if len(pending) > lookahead:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for _, signature_task in pending:
+            if signature_task is not None:
+                signature_task.cancel()
 
 
 async def _review_file_diff(
     file_diff: PullRequestFileChanges,
-    semaphore: asyncio.Semaphore,
-) -> dict[str, str]:
-    """Create a review task for a single file.
+    anchor_patch_index: PatchIndex | None = None,
+    numbered_patch: str | None = None,
+) -> FileReview:
+    """Review a single file.
 
-    :param file_changes: The pull request file changes.
-    :param semaphore: The semaphore.
-    :return: A mapping from the file name to the review content.
+    :param file_diff: The pull request file changes.
+    :param anchor_patch_index: The index of the patch structured comments are
+        anchored to, defaults to the index of the patch of `file_diff`.
+    :param numbered_patch: The patch of `file_diff` numbered by line, if already
+        numbered for other passes.
+    :return: The review of the file.
     """
+    numbered_patch = numbered_patch or number_lines(
+        file_diff.patch,
+        file_diff.patch_index,
+    )
+    if config.modules.reviews.structured_output.enabled:
+        review_content_iterator = await ReviewPullRequest.arun(
+            request=file_diff,
+            output_schema=structured_reviews.get_comment_schema(),
+            numbered_patch=numbered_patch,
+        )
+        comments = await structured_reviews.parse_structured_review(
+            review_content_iterator,
+            anchor_patch_index or file_diff.patch_index,
+        )
+        return FileReview(
+            filename=file_diff.filename,
+            content=structured_reviews.render_comments(comments),
+            patch=file_diff.patch,
+            comments=comments,
+        )
+
     answer = ""
-    async with semaphore:
-        review_content_iterator = await ReviewPullRequest.arun(request=file_diff)
+    review_content_iterator = await ReviewPullRequest.arun(
+        request=file_diff,
+        numbered_patch=numbered_patch,
+    )
+
+    async for review_content in review_content_iterator:
+        answer += review_content
+
+    return FileReview(
+        filename=file_diff.filename,
+        content=answer,
+        patch=file_diff.patch,
+    )
 
-        async for review_content in review_content_iterator:
-            answer += review_content
 
-    return {file_diff.filename: answer}
+async def _review_changed_hunks(
+    file_diff: PullRequestFileChanges,
+    previous_review: FileReview,
+    changed_hunks: list[Hunk],
+) -> FileReview:
+    """Review only the changed hunks of a file reviewed before.
+
+    Structured comments on unchanged hunks are carried over to the new patch.
+    Otherwise the previous review, whose hunks are all still in place, is kept
+    apart in `carried_over`, so that it is not nested again on later pushes.
+
+    :param file_diff: The pull request file changes.
+    :param previous_review: The review of the file in a previous push.
+    :param changed_hunks: The hunks new or modified since the previous push.
+    :return: The review of the file.
+    """
+    metrics.increment("reviews.reviewed_hunks", len(changed_hunks))
+    changed_hunks_file_diff = PullRequestFileChanges(
+        filename=file_diff.filename,
+        patch=join_hunks(changed_hunks),
+        additions=file_diff.additions,
+        deletions=file_diff.deletions,
+        changes=file_diff.changes,
+    )
+    changed_hunks_review = await _review_file_diff(
+        file_diff=changed_hunks_file_diff,
+        anchor_patch_index=file_diff.patch_index,
+    )
+
+    if _has_structured_comments(previous_review):
+        carried_over_comments = await _carry_over_comments(file_diff, previous_review)
+        comments = sorted(
+            changed_hunks_review.comments + carried_over_comments,
+            key=lambda comment: comment.start_line,
+        )
+        return FileReview(
+            filename=file_diff.filename,
+            content=structured_reviews.render_comments(comments),
+            patch=file_diff.patch,
+            comments=comments,
+        )
+
+    carried_over = "\n\n".join(
+        content
+        for content in (_own_content(previous_review), previous_review.carried_over)
+        if content
+    )
+    return FileReview(
+        filename=file_diff.filename,
+        content=changed_hunks_review.content + CARRIED_OVER_HEADER + carried_over,
+        patch=file_diff.patch,
+        carried_over=carried_over,
+    )
@@ -0,0 +1,271 @@
+"""Structured review output.
+
+In structured output mode the LLM reviews a file as JSON Lines, one comment per
+line. The stream is parsed incrementally on the event loop, which only splits
+lines and decodes JSON. Validating the comments and anchoring them to the lines
+of the patch is heavier for large reviews and runs in an executor, so it does not
+stall the reviews of other files.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import textwrap
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Self
+
+from pydantic import ValidationError
+
+from src.config import config
+from src.reviews.models.pull_requests import ReviewComment
+from src.reviews.patches import PatchIndex, split_hunks
+from src.utils import metrics
+from src.utils.exceptions import ConfigError
+
+logger = logging.getLogger(__name__)
+
+# Comments are validated in batches, submitted while the review still streams.
+VALIDATION_BATCH_SIZE = 20
+
+
+def get_comment_schema() -> dict[str, Any]:
+    """Get the JSON schema of the comments the LLM is asked for."""
+    schema = ReviewComment.model_json_schema()
+    # The position is derived from the patch, not written by the LLM.
+    schema["properties"].pop("position")
+    return schema
+
+
+class JsonLinesParser:
+    """Incremental parser of a stream of JSON Lines."""
+
+    def __init__(self: Self) -> None:
+        """Initialize the parser."""
+        self._buffer = ""
+        self.invalid_lines = 0
+
+    def feed(self: Self, chunk: str) -> list[dict[str, Any]]:
+        """Feed a chunk of the stream.
+
+        :param chunk: The next chunk of the stream.
+        :return: The objects on the lines completed by the chunk.
+        """
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse(lines)
+
+    def flush(self: Self) -> list[dict[str, Any]]:
+        """Parse what is left once the stream has ended."""
+        lines, self._buffer = [self._buffer], ""
+        return self._parse(lines)
+
+    def _parse(self: Self, lines: list[str]) -> list[dict[str, Any]]:
+        objects = []
+        for line in lines:
+            line = line.strip()  # noqa: PLW2901
+            # Skip blank lines and anything around the objects, e.g. code fences.
+            if not line.startswith("{"):
+                continue
+            try:
+                parsed = json.loads(line)
+            except json.JSONDecodeError:
+                self.invalid_lines += 1
+                continue
+            if isinstance(parsed, dict):
+                objects.append(parsed)
+        return objects
+
+
+def validate_comments(
+    raw_comments: list[dict[str, Any]],
+    patch_index: PatchIndex,
+) -> tuple[list[ReviewComment], int]:
+    """Validate comments and anchor them to the patch.
+
+    Comments on lines outside of the patch are moved to the closest line in it.
+    This runs in an executor, so it must stay a picklable, top-level function.
+
+    :param raw_comments: The comments as decoded from the LLM output.
+    :param patch_index: The index of the patch the comments refer to.
+    :return: The valid comments, and the number of invalid ones.
+    """
+    comments: list[ReviewComment] = []
+    invalid_comments = 0
+    for raw_comment in raw_comments:
+        try:
+            comment = ReviewComment.model_validate(raw_comment)
+        except ValidationError:
+            invalid_comments += 1
+            continue
+
+        start_line, end_line = sorted((comment.start_line, comment.end_line))
+        closest_start_line = patch_index.closest_new_line(start_line)
+        closest_end_line = patch_index.closest_new_line(end_line)
+        # Both are None if the patch shows no new lines, then nothing is moved.
+        if closest_start_line is not None and closest_end_line is not None:
+            end_line = closest_end_line
+            start_line = min(closest_start_line, end_line)
+        comments.append(
+            comment.model_copy(
+                update={
+                    "start_line": start_line,
+                    "end_line": end_line,
+                    "position": patch_index.position_of_new_line(end_line),
+                },
+            ),
+        )
+    return comments, invalid_comments
+
+
+def carry_over_comments(
+    comments: list[ReviewComment],
+    previous_patch: str,
+    patch: str,
+    patch_index: PatchIndex,
+) -> list[ReviewComment]:
+    """Carry comments on hunks unchanged since `previous_patch` over to `patch`.
+
+    Comments on hunks that changed are dropped, the hunks are reviewed anew. This
+    runs in an executor, so it must stay a picklable, top-level function.
+
+    :param comments: The comments on `previous_patch`.
+    :param previous_patch: The patch reviewed before.
+    :param patch: The new patch.
+    :param patch_index: The index of `patch`.
+    :return: The carried over comments, anchored to `patch`.
+    """
+    hunks_by_body = {hunk.body: hunk for hunk in split_hunks(patch)}
+    previous_hunks = split_hunks(previous_patch)
+    previous_patch_index = PatchIndex(previous_patch)
+
+    raw_comments = []
+    for comment in comments:
+        hunk_index = previous_patch_index.hunk_of_new_line(comment.end_line)
+        if hunk_index is None:
+            continue
+        previous_hunk = previous_hunks[hunk_index]
+        hunk = hunks_by_body.get(previous_hunk.body)
+        if hunk is None:
+            continue
+
+        # Unchanged hunks may still have moved within the file.
+        shift = hunk.new_start - previous_hunk.new_start
+        raw_comments.append(
+            comment.model_dump(exclude={"position"})
+            | {
+                "start_line": comment.start_line + shift,
+                "end_line": comment.end_line + shift,
+            },
+        )
+    return validate_comments(raw_comments, patch_index)[0]
+
+
+def render_comments(comments: list[ReviewComment]) -> str:
+    """Render comments as markdown, for clients showing the review as text.
+
+    :param comments: The comments.
+    :return: The comments as an enumerated markdown list.
+    """
+    rendered = []
+    for index, comment in enumerate(comments, start=1):
+        lines = (
+            f"Line {comment.start_line}"
+            if comment.start_line == comment.end_line
+            else f"Lines {comment.start_line}-{comment.end_line}"
+        )
+        text = f"{index}. **{lines}** ({comment.severity}): {comment.body}"
+        if comment.suggestion:
+            # Indent the block to keep it inside the list item.
+            suggestion = textwrap.indent(
+                f"```suggestion\n{comment.suggestion}\n```",
+                "   ",
+            )
+            text += f"\n\n{suggestion}"
+        rendered.append(text)
+    return "\n".join(rendered)
+
+
+_executor: Executor | None = None
+
+
+def get_executor() -> Executor:
+    """Get the executor validating structured reviews.
+
+    :raises ConfigError: If the configured executor is unknown.
+    :return: The executor.
+    """
+    global _executor  # noqa: PLW0603
+
+    if _executor is None:
+        structured_output_config = config.modules.reviews.structured_output
+        match structured_output_config.executor:
+            case "thread":
+                executor_type: type[ThreadPoolExecutor | ProcessPoolExecutor] = (
+                    ThreadPoolExecutor
+                )
+            case "process":
+                executor_type = ProcessPoolExecutor
+            case _:
+                message = f"Unknown executor: {structured_output_config.executor}"
+                raise ConfigError(message)
+        _executor = executor_type(max_workers=structured_output_config.max_workers)
+
+    return _executor
+
+
+async def shutdown_executor() -> None:
+    """Shut down the executor validating structured reviews, if any."""
+    global _executor  # noqa: PLW0603
+
+    if _executor is not None:
+        await asyncio.to_thread(_executor.shutdown)
+    _executor = None
+
+
+async def parse_structured_review(
+    chunks: AsyncIterator[str],
+    patch_index: PatchIndex,
+) -> list[ReviewComment]:
+    """Parse a structured review while it streams.
+
+    :param chunks: The streamed review.
+    :param patch_index: The index of the patch under review.
+    :return: The validated comments, anchored to the patch.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    parser = JsonLinesParser()
+    batches: list[asyncio.Future] = []
+    pending: list[dict[str, Any]] = []
+
+    def submit(raw_comments: list[dict[str, Any]]) -> None:
+        batches.append(
+            loop.run_in_executor(
+                executor,
+                validate_comments,
+                raw_comments,
+                patch_index,
+            ),
+        )
+
+    async for chunk in chunks:
+        pending += parser.feed(chunk)
+        if len(pending) >= VALIDATION_BATCH_SIZE:
+            submit(pending)
+            pending = []
+    pending += parser.flush()
+    if pending or not batches:
+        submit(pending)
+
+    comments: list[ReviewComment] = []
+    invalid_comments = parser.invalid_lines
+    for batch_comments, batch_invalid_comments in await asyncio.gather(*batches):
+        comments += batch_comments
+        invalid_comments += batch_invalid_comments
+
+    if invalid_comments:
+        logger.info("Dropped %s invalid review comment(s)", invalid_comments)
+        metrics.increment("reviews.invalid_comments", invalid_comments)
+    return sorted(comments, key=lambda comment: comment.start_line)
@@ -0,0 +1,151 @@
+"""Summary of a whole pull request.
+
+The reviews of all files of a large pull request do not fit in the context of a
+single LLM call. They are map-reduced instead: the reviews are packed into groups
+of bounded size, the groups are summarized in parallel, and the summaries are
+grouped and summarized again until a single call can summarize what is left.
+
+The number of LLM calls and the time spent summarizing are capped, and reported
+apart from the per-file reviews under the `pull_request_summary.` metrics.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from src.common.tools.summarize_pull_request import SummarizePullRequest
+from src.config import config
+from src.utils import metrics
+from src.utils.llm import estimate_tokens, truncate_to_tokens
+
+if TYPE_CHECKING:
+    from box import Box
+
+    from src.reviews.models.pull_requests import FileReview
+
+logger = logging.getLogger(__name__)
+
+# Documents truncated to fit the final call keep at least this many tokens, so
+# that the summary is not built from empty input.
+MIN_DOCUMENT_TOKENS = 100
+
+
+async def summarize_pull_request(file_reviews: list[FileReview]) -> str | None:
+    """Summarize a pull request from the reviews of its files.
+
+    Failing to summarize does not fail the review, the summary is left out.
+
+    :param file_reviews: The reviews of the files of the pull request.
+    :return: The summary, or None if disabled, over time or failed.
+    """
+    summary_config = config.modules.reviews.pull_request_summary
+    if not summary_config.enabled:
+        return None
+
+    documents = [
+        f"### {file_review.filename}\n\n{file_review.content}"
+        for file_review in sorted(file_reviews, key=lambda review: review.filename)
+        if file_review.content
+    ]
+    if not SummarizePullRequest.applies_to(documents=documents):
+        return None
+
+    started_at = time.monotonic()
+    try:
+        async with asyncio.timeout(summary_config.timeout):
+            return await _map_reduce(documents, summary_config)
+    except TimeoutError:
+        logger.warning(
+            "Summarizing the pull request took over %ss, leaving it out",
+            summary_config.timeout,
+        )
+        metrics.increment("pull_request_summary.timeouts")
+    except Exception:
+        logger.exception("Failed to summarize the pull request, leaving it out")
+        metrics.increment("pull_request_summary.failures")
+    finally:
+        metrics.observe(
+            "pull_request_summary.latency_seconds",
+            time.monotonic() - started_at,
+        )
+    return None
+
+
+def group_documents(documents: list[str], max_tokens: int) -> list[list[str]]:
+    """Pack documents, in order, into groups of at most `max_tokens` tokens.
+
+    Documents longer than `max_tokens` are truncated.
+
+    :param documents: The documents.
+    :param max_tokens: The maximum estimated number of tokens of a group.
+    :return: The groups.
+    """
+    groups: list[list[str]] = []
+    group_tokens = 0
+    for document in documents:
+        document = truncate_to_tokens(document, max_tokens)  # noqa: PLW2901
+        tokens = estimate_tokens(document)
+        if not groups or group_tokens + tokens > max_tokens:
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(document)
+        group_tokens += tokens
+    return groups
+
+
+async def _map_reduce(documents: list[str], summary_config: Box) -> str:
+    """Summarize documents hierarchically, within the configured budget."""
+    semaphore = asyncio.Semaphore(summary_config.max_concurrency)
+    remaining_calls = summary_config.max_calls
+
+    groups = group_documents(documents, summary_config.max_group_tokens)
+    # Keep a call for the final summary.
+    while 1 < len(groups) < remaining_calls:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [
+                task_group.create_task(_summarize(group, semaphore, partial=True))
+                for group in groups
+            ]
+        remaining_calls -= len(groups)
+        documents = [task.result() for task in tasks]
+        groups = group_documents(documents, summary_config.max_group_tokens)
+
+    if len(groups) > 1:
+        # Out of calls: fit what is left in the final one, leaving documents out
+        # rather than truncating them below `MIN_DOCUMENT_TOKENS`.
+        metrics.increment("pull_request_summary.truncations")
+        max_documents = max(summary_config.max_group_tokens // MIN_DOCUMENT_TOKENS, 1)
+        if len(documents) > max_documents:
+            omitted = len(documents) - max_documents
+            metrics.increment("pull_request_summary.omitted_documents", omitted)
+            documents = documents[:max_documents]
+        max_tokens = summary_config.max_group_tokens // len(documents)
+        documents = [truncate_to_tokens(document, max_tokens) for document in documents]
+    return await _summarize(documents, semaphore, partial=False)
+
+
+async def _summarize(
+    documents: list[str],
+    semaphore: asyncio.Semaphore,
+    *,
+    partial: bool,
+) -> str:
+    """Summarize documents in a single LLM call."""
+    async with semaphore:
+        summary = ""
+        async for content in await SummarizePullRequest.arun(
+            documents=documents,
+            partial=partial,
+        ):
+            summary += content
+
+    metrics.increment("pull_request_summary.llm_calls")
+    metrics.increment(
+        "pull_request_summary.input_tokens",
+        sum(estimate_tokens(document) for document in documents),
+    )
+    metrics.increment("pull_request_summary.output_tokens", estimate_tokens(summary))
+    return summary
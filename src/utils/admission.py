@@ -0,0 +1,206 @@
+"""Admission control of review jobs.
+
+When the backlog spikes, taking every message slows all reviews down together.
+Instead, each job's cost is estimated before it is taken, and the job is:
+
+- accepted, if the worker has room for it,
+- deferred, if the worker is under pressure and the job is large, to be retried
+  after a delay,
+- degraded, if the worker is under pressure and the job is of normal size, or
+  has already been deferred `max_defers` times: it is reviewed with a cheaper
+  model, and only its source files are reviewed.
+
+The worker is under pressure when the estimated tokens of the jobs admitted and
+not yet done exceed a budget, or when the recent latency of normal sized jobs
+exceeds the latency SLA. A job is always accepted by an idle worker, so large
+jobs cannot starve.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from enum import StrEnum, auto
+from typing import TYPE_CHECKING, Callable, Iterator, Self
+
+from src.config import config
+from src.utils import metrics
+from src.utils.latency import LatencyTracker
+
+if TYPE_CHECKING:
+    from box import Box
+
+logger = logging.getLogger(__name__)
+
+_degraded: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "degraded",
+    default=False,
+)
+
+
+class Decision(StrEnum):
+    """Admission decision for a job."""
+
+    accept = auto()
+    defer = auto()
+    degrade = auto()
+
+
+@dataclass(frozen=True)
+class Admission:
+    """Admission of a job.
+
+    Attributes
+    ----------
+        - decision: Whether the job is accepted, deferred or degraded.
+        - cost: Estimated number of tokens of the job.
+    """
+
+    decision: Decision
+    cost: int
+
+
+class AdmissionController(ABC):
+    """AdmissionController is an abstract class for admission controllers."""
+
+    @abstractmethod
+    def admit(self: Self, body: bytes, defers: int = 0) -> Admission:
+        """Decide whether to accept, defer or degrade the job of a message.
+
+        :param body: The body of the message.
+        :param defers: Number of times the message has been deferred already.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def track(self: Self, admission: Admission) -> AbstractContextManager[None]:
+        """Account for an admitted job while it runs."""
+        raise NotImplementedError
+
+
+class NullAdmissionController(AdmissionController):
+    """Admission controller accepting every job."""
+
+    def admit(
+        self: Self,
+        body: bytes,  # noqa: ARG002
+        defers: int = 0,  # noqa: ARG002
+    ) -> Admission:
+        """Accept the job."""
+        return Admission(decision=Decision.accept, cost=0)
+
+    def track(
+        self: Self,
+        admission: Admission,  # noqa: ARG002
+    ) -> AbstractContextManager[None]:
+        """Do not account for the job."""
+        return nullcontext()
+
+
+class LoadAdmissionController(AdmissionController):
+    """Decide which jobs a worker takes, from its load and recent latency."""
+
+    def __init__(
+        self: Self,
+        admission_config: Box,
+        estimate_cost: Callable[[bytes], int],
+    ) -> None:
+        """Initialize the controller.
+
+        :param admission_config: The `admission_control` configuration.
+        :param estimate_cost: Estimates the number of tokens of a job from the body
+            of its message.
+        """
+        self.config = admission_config
+        self.estimate_cost = estimate_cost
+        self.in_flight_tokens = 0
+        self.latency_tracker = LatencyTracker()
+
+    @property
+    def latency_exceeded(self: Self) -> bool:
+        """Whether the recent latency of normal sized jobs exceeds the SLA."""
+        if len(self.latency_tracker) < self.config.min_latency_samples:
+            return False
+        latency = self.latency_tracker.percentile(self.config.latency_percentile)
+        return latency > self.config.latency_sla_seconds
+
+    def admit(self: Self, body: bytes, defers: int = 0) -> Admission:
+        """Decide whether to accept, defer or degrade the job of a message.
+
+        :param body: The body of the message.
+        :param defers: Number of times the message has been deferred already.
+        :return: The admission of the job.
+        """
+        cost = self.estimate_cost(body)
+        under_pressure = self.in_flight_tokens > 0 and (
+            self.in_flight_tokens + cost > self.config.max_in_flight_tokens
+            or self.latency_exceeded
+        )
+        if not under_pressure:
+            decision = Decision.accept
+        elif cost > self.config.large_job_tokens and defers < self.config.max_defers:
+            decision = Decision.defer
+        else:
+            decision = Decision.degrade
+
+        metrics.increment(f"admission.{decision}")
+        if decision is not Decision.accept:
+            logger.info(
+                "%s job of about %s tokens, %s tokens in flight",
+                decision.capitalize(),
+                cost,
+                self.in_flight_tokens,
+            )
+        return Admission(decision=decision, cost=cost)
+
+    @contextmanager
+    def track(self: Self, admission: Admission) -> Iterator[None]:
+        """Account for an admitted job while it runs.
+
+        Within the context, `is_degraded` tells whether the job is degraded.
+
+        :param admission: The admission of the job.
+        """
+        self.in_flight_tokens += admission.cost
+        metrics.set_gauge("admission.in_flight_tokens", self.in_flight_tokens)
+        token = _degraded.set(admission.decision is Decision.degrade)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            _degraded.reset(token)
+            self.in_flight_tokens -= admission.cost
+            metrics.set_gauge("admission.in_flight_tokens", self.in_flight_tokens)
+            if admission.cost <= self.config.large_job_tokens:
+                self.latency_tracker.observe(time.monotonic() - started_at)
+
+
+def get_admission_controller(
+    estimate_cost: Callable[[bytes], int],
+) -> AdmissionController:
+    """Get the admission controller selected in the configuration.
+
+    :param estimate_cost: Estimates the number of tokens of a job from the body of
+        its message.
+    :return: The admission controller.
+    """
+    if config.admission_control.enabled:
+        return LoadAdmissionController(config.admission_control, estimate_cost)
+    return NullAdmissionController()
+
+
+def is_degraded() -> bool:
+    """Whether the current job was degraded by admission control."""
+    return _degraded.get()
+
+
+def set_degraded(degraded: bool) -> None:  # noqa: FBT001
+    """Mark the current context as running a degraded job.
+
+    Used by worker processes, which do not inherit the context of the consumer.
+    """
+    _degraded.set(degraded)
@@ -1,30 +1,106 @@
 """AMQP client for RabbitMQ."""
 
 import asyncio
-import json
 import logging
 import multiprocessing
-from multiprocessing.synchronize import Semaphore
-from typing import Any, Callable, Coroutine, Self
+from typing import Self
 
 import aio_pika
+from aio_pika.abc import (
+    AbstractIncomingMessage,
+    AbstractQueue,
+    AbstractRobustChannel,
+    AbstractRobustConnection,
+)
 
 from src.config import config
+from src.utils.admission import (
+    AdmissionController,
+    NullAdmissionController,
+    is_degraded,
+    set_degraded,
+)
+from src.utils.message_queue import Delivery, MessageCallback, MessageQueueSubscriber
 
 logger = logging.getLogger(__name__)
 
-DictCoroutineType = Callable[[dict], Coroutine[Any, Any, None]]
-MessageCoroutineType = Callable[[aio_pika.IncomingMessage], Coroutine[Any, Any, None]]
+DEFERS_HEADER = "x-defers"
 
 
-class AsyncRabbitMQClient:
-    """Asynchronous RabbitMQ client."""
+class RabbitMQDelivery(Delivery):
+    """A message delivered by RabbitMQ."""
 
-    def __init__(self: Self) -> None:
-        """Initialize the RabbitMQ client."""
+    def __init__(
+        self: Self,
+        client: "AsyncRabbitMQClient",
+        message: AbstractIncomingMessage,
+    ) -> None:
+        """Initialize the delivery."""
+        self.client = client
+        self.message = message
+        self.body = take_message_body(message)
+        defers = (message.headers or {}).get(DEFERS_HEADER, 0)
+        self.defers = defers if isinstance(defers, int) else 0
+
+    async def ack(self: Self) -> None:
+        """Acknowledge the message."""
+        await self.message.ack()
+
+    async def nack(self: Self) -> None:
+        """Requeue the message."""
+        await self.message.nack(requeue=True)
+
+    async def fail(self: Self) -> None:
+        """Reject the message, dead-lettering it if the queue has a dead-letter."""
+        await self.message.reject(requeue=False)
+
+    async def defer(self: Self) -> None:
+        """Move the message to the overflow queue, counting the deferral."""
+        await self.client.publish_to_overflow_queue(
+            self.message,
+            self.body,
+            self.defers + 1,
+        )
+        await self.message.ack()
+
+
+class AsyncRabbitMQClient(MessageQueueSubscriber):
+    """Asynchronous RabbitMQ client.
+
+    The broker delivers at most `max_concurrency` unacknowledged messages at once.
+    Jobs deferred by admission control are moved to an overflow queue, from which
+    they are dead-lettered back to their queue after the deferral delay. They are
+    republished persistent, with their properties and headers, and the number of
+    deferrals in the `x-defers` header.
+    """
+
+    def __init__(
+        self: Self,
+        queue_name: str,
+        callback: MessageCallback,
+        *,
+        run_in_process: bool = False,
+        admission_controller: AdmissionController | None = None,
+    ) -> None:
+        """Initialize the RabbitMQ client.
+
+        The broker delivers up to `modules.common.max_concurrent_messages` at once.
+
+        :param queue_name: The name of the queue to consume.
+        :param callback: The asynchronous callback function to process messages.
+        :param run_in_process: Whether to run the callback in a separate process,
+            if it is CPU-bound.
+        :param admission_controller: Decides which messages are taken.
+        """
+        super().__init__(callback, admission_controller=admission_controller)
+        self.queue_name = queue_name
+        self.overflow_queue_name = f"{queue_name}.overflow"
+        self.run_in_process = run_in_process
         self._amqp_url = config.amqp_url
-        self._connection: aio_pika.RobustConnection | None = None
-        self._channel: aio_pika.RobustChannel | None = None
+        self._connection: AbstractRobustConnection | None = None
+        self._channel: AbstractRobustChannel | None = None
+        self._queue: AbstractQueue | None = None
+        self._consumer_tag: str | None = None
 
     async def connect(self: Self) -> None:
         """Establish an asynchronous connection to RabbitMQ."""
@@ -33,6 +109,7 @@ class AsyncRabbitMQClient:
 
     async def close(self: Self) -> None:
         """Close the RabbitMQ connection."""
+        self.running = False
         if self._channel is not None:
             await self._channel.close()
 
@@ -45,110 +122,143 @@ class AsyncRabbitMQClient:
         :param queue_name: The name of the queue.
         :param message: The message to be published.
         """
-        if self._channel is None:
-            message = (
-                "RabbitMQ connection has not been established. Run `connect` first."
-            )
-            raise ValueError(message)
-
-        queue = await self._channel.declare_queue(queue_name, durable=True)
-        await self._channel.default_exchange.publish(
+        channel = self._get_channel()
+        queue = await channel.declare_queue(queue_name, durable=True)
+        await channel.default_exchange.publish(
             aio_pika.Message(body=message.encode()),
             routing_key=queue.name,
         )
 
-    async def consume_messages(
+    async def publish_to_overflow_queue(
         self: Self,
-        queue_name: str,
-        callback: DictCoroutineType,
-        *,
-        run_in_process: bool = False,
-        **kwargs: Any,
+        message: AbstractIncomingMessage,
+        body: bytes,
+        defers: int,
     ) -> None:
-        """Consume messages from queue with callback function.
+        """Publish a message deferred by admission control to the overflow queue.
 
-        :param queue_name: The name of the queue.
-        :param callback: The asynchronous callback function to process messages.
-            Should be wrapped in in `process_callback` if the callback is CPU-bound.
+        The expiration of the message is not copied, the overflow queue sets its
+        own.
+
+        :param message: The deferred message, whose properties are copied.
+        :param body: The body of the message, detached from it.
+        :param defers: Number of times the message has been deferred, this time
+            included.
         """
+        await self._get_channel().default_exchange.publish(
+            aio_pika.Message(
+                body=body,
+                headers={**(message.headers or {}), DEFERS_HEADER: defers},
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                priority=message.priority,
+                correlation_id=message.correlation_id,
+                reply_to=message.reply_to,
+                message_id=message.message_id,
+                timestamp=message.timestamp,
+                type=message.type,
+                app_id=message.app_id,
+            ),
+            routing_key=self.overflow_queue_name,
+        )
+
+    async def start(self: Self) -> None:
+        """Connect if needed, and start consuming the queue."""
         if self._channel is None:
-            msg = "RabbitMQ connection has not been established. Run `connect` first."
-            raise ValueError(
-                msg,
+            await self.connect()
+
+        channel = self._get_channel()
+        await channel.set_qos(prefetch_count=self.max_concurrency)
+        self._queue = await channel.declare_queue(self.queue_name, durable=True)
+        if not isinstance(self.admission_controller, NullAdmissionController):
+            await channel.declare_queue(
+                self.overflow_queue_name,
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(config.admission_control.defer_delay * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                },
             )
 
-        queue = await self._channel.declare_queue(queue_name, durable=True)
+        self.running = True
+        self._consumer_tag = await self._queue.consume(self._on_message)
 
-        target: MessageCoroutineType = (
-            self.wrap_message_handler_for_process(
-                callback,
-                kwargs.get("semaphore"),
-            )
-            if run_in_process
-            else self.wrap_message_handler(callback)
-        )
+    async def _on_message(self: Self, message: AbstractIncomingMessage) -> None:
+        """Handle a message in the task aio-pika runs the consumer callback in."""
+        task = asyncio.current_task()
+        if task is not None:
+            self.track(task)
+        await self.handle(RabbitMQDelivery(self, message))
+
+    def _get_channel(self: Self) -> AbstractRobustChannel:
+        """Return the channel.
 
-        await queue.consume(target)
-
-    @staticmethod
-    def wrap_message_handler(
-        callback: DictCoroutineType,
-    ) -> MessageCoroutineType:
-        """Wrap the callback function to process the incoming message."""
-
-        async def process_message(message: aio_pika.IncomingMessage) -> None:
-            try:
-                async with message.process():
-                    message_json = json.loads(message.body)
-                    await callback(message_json)
-            except Exception:
-                logger.exception("Error processing message")
-                await message.reject(requeue=False)
-
-        return process_message
-
-    @staticmethod
-    def wrap_message_handler_for_process(
-        callback: DictCoroutineType,
-        semaphore: Semaphore | None = None,
-    ) -> MessageCoroutineType:
-        """Wrap and run the callback function in a separate process.
-
-        :param message: The incoming message.
-        :param process_target: The target function to process the message.
-        :param semaphore: The semaphore to control the number of concurrent processes.
+        :raises ValueError: If the connection has not been established.
         """
-        semaphore = semaphore or multiprocessing.Semaphore(10)
+        if self._channel is None:
+            msg = "RabbitMQ connection has not been established. Run `connect` first."
+            raise ValueError(msg)
+        return self._channel
+
+    async def stop_receiving(self: Self) -> None:
+        """Cancel the consumer."""
+        if self._queue is not None and self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        self._consumer_tag = None
+
+    async def process(self: Self, body: bytes) -> None:
+        """Process the body of a message, in a separate process if configured.
+
+        :raises RuntimeError: If the worker process fails.
+        """
+        if not self.run_in_process:
+            await self.callback(body)
+            return
+
+        process = multiprocessing.Process(
+            target=async_worker,
+            args=(self.callback, body, is_degraded()),
+        )
+        del body
+        process.start()
+        try:
+            await asyncio.to_thread(process.join)
+        except asyncio.CancelledError:
+            process.terminate()
+            raise
 
-        async def run_in_process(message: aio_pika.IncomingMessage) -> None:
-            async def process_message() -> None:
-                async with message.process():
-                    message_json = json.loads(message.body)
+        if process.exitcode != 0:
+            msg = f"Worker process exited with code {process.exitcode}."
+            raise RuntimeError(msg)
 
-                # Acquire the semaphore before starting the new process
-                semaphore.acquire()
 
-                process = multiprocessing.Process(
-                    target=async_worker,
-                    args=(callback, message_json, semaphore),
-                )
-                process.start()
+def take_message_body(message: AbstractIncomingMessage) -> bytes:
+    """Detach the body from an incoming message.
 
-            _ = asyncio.create_task(process_message())
+    The message object is kept alive until it is acked, so leaving the body on it
+    would pin the raw payload in memory for the whole review. The caller becomes
+    the sole owner of the returned bytes.
 
-        return run_in_process
+    :param message: The incoming message.
+    :return: The raw message body.
+    """
+    body = message.body
+    if isinstance(message, aio_pika.IncomingMessage):
+        message.body = b""
+    return body
 
 
 def async_worker(
-    process_target: DictCoroutineType,
-    message: dict,
-    semaphore: Semaphore,
+    process_target: MessageCallback,
+    message: bytes,
+    degraded: bool = False,  # noqa: FBT001, FBT002
 ) -> None:
     """Run the target function asynchronously in a separate process."""
     try:
+        set_degraded(degraded)
         asyncio.run(process_target(message))
     except Exception as e:
         logger.warning(e)
         raise
-    finally:
-        semaphore.release()
@@ -35,12 +35,14 @@ async def complete_review(
     review_id: int,
     review_status_id: int,
     file_reviews: list[FileReview],
+    summary: str | None = None,
 ) -> None:
     """Complete a review."""
     review = CompleteReviewRequest(
         review_id=review_id,
         review_status_id=review_status_id,
         file_reviews=file_reviews,
+        summary=summary,
     )
     url = f"{config.approved_api_url}/reviews/complete"
     logger.info("Completing review %s", review_id)
@@ -0,0 +1,178 @@
+"""Claim-check payloads referenced from queue messages.
+
+Oversized payloads are not sent inline through the message broker. Instead the
+message carries a reference to where the payload is stored, and the payload is
+streamed from there on demand. Supported references are:
+
+- a path (or ``file://`` URL) relative to ``config.claim_check_directory``,
+- an ``http://`` or ``https://`` URL, e.g. a signed object-store URL or a local
+  stand-in such as ``python -m http.server``.
+"""
+
+import asyncio
+import codecs
+import json
+import logging
+from contextlib import aclosing
+from pathlib import Path
+from typing import Any, AsyncGenerator, AsyncIterator, NoReturn, Self
+from urllib.parse import urlparse
+
+import httpx
+
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Characters a number read up to the end of the buffer may continue with.
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+async def iter_json_array(reference: str) -> AsyncIterator[Any]:
+    """Lazily parse the JSON array of objects stored at `reference`, item by item.
+
+    Only the item being parsed is kept in memory, never the whole array.
+
+    :param reference: Reference to the payload.
+    :raises ValueError: If the reference is not supported or the payload is not a
+        JSON array.
+    :return: The items of the array.
+    """
+    logger.info("Streaming claim-check payload from %s", reference)
+    async with aclosing(_iter_chunks(reference)) as chunks:
+        async for item in _parse_json_array(chunks):
+            yield item
+
+
+async def _iter_chunks(reference: str) -> AsyncGenerator[bytes, None]:
+    """Stream the raw payload at `reference`."""
+    scheme = urlparse(reference).scheme
+    if scheme in ("http", "https"):
+        timeout = httpx.Timeout(config.modules.common.request_timeout, read=None)
+        async with httpx.AsyncClient(timeout=timeout) as client, client.stream(
+            "GET",
+            reference,
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+    elif scheme in ("", "file"):
+        path = _resolve_local_path(reference.removeprefix("file://"))
+        with path.open("rb") as file_:
+            while chunk := await asyncio.to_thread(file_.read, CHUNK_SIZE):
+                yield chunk
+    else:
+        message = f"Unsupported claim-check reference: {reference}"
+        raise ValueError(message)
+
+
+def _resolve_local_path(path: str) -> Path:
+    """Resolve `path` inside the claim-check directory.
+
+    :raises ValueError: If the path points outside the claim-check directory.
+    """
+    root = Path(config.claim_check_directory or ".").resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        message = f"Claim-check path {path} is outside of {root}."
+        raise ValueError(message)
+    return resolved
+
+
+async def _parse_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Incrementally decode a JSON array from a stream of byte chunks.
+
+    :raises ValueError: If the payload is not a well-formed JSON array.
+    """
+    reader = _JsonArrayReader(chunks)
+    async for item in reader.items():
+        yield item
+
+
+class _JsonArrayReader:
+    """Reader of the items of a JSON array streamed in byte chunks.
+
+    Only the unconsumed part of the stream is buffered. An item is decoded once
+    the character following it has been read, since numbers may continue in the
+    next chunk.
+    """
+
+    def __init__(self: Self, chunks: AsyncIterator[bytes]) -> None:
+        self.chunks = chunks
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    async def items(self: Self) -> AsyncIterator[Any]:
+        """Decode the items of the array, checking its delimiters."""
+        if await self._peek() != "[":
+            message = "Claim-check payload is not a JSON array."
+            raise ValueError(message)
+        self.position += 1
+
+        if await self._peek() == "]":
+            self.position += 1
+        else:
+            while True:
+                yield await self._decode_item()
+                delimiter = await self._peek()
+                if delimiter not in (",", "]"):
+                    _raise_malformed()
+                self.position += 1
+                if delimiter == "]":
+                    break
+                if await self._peek() == "]":
+                    _raise_malformed()
+
+        if await self._peek():
+            _raise_malformed()
+
+    async def _decode_item(self: Self) -> Any:
+        """Decode the item at the current position, once it is complete."""
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as error:
+                if self.exhausted:
+                    _raise_malformed(error)
+            else:
+                following = self.buffer[end : end + 1]
+                if self.exhausted or (following and following not in NUMBER_CHARS):
+                    self.position = end
+                    return item
+            # The item or its delimiter is incomplete. Double the buffer so that
+            # re-parsing a large item costs linear rather than quadratic time.
+            await self._fill(2 * (len(self.buffer) - self.position) + CHUNK_SIZE)
+
+    async def _peek(self: Self) -> str:
+        """Skip whitespace and return the next character, or "" at the end."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position].isspace()
+            ):
+                self.position += 1
+            if self.position < len(self.buffer) or self.exhausted:
+                return self.buffer[self.position : self.position + 1]
+            await self._fill(CHUNK_SIZE)
+
+    async def _fill(self: Self, min_length: int) -> None:
+        """Read the stream until `min_length` characters are left to consume."""
+        # Drop consumed input before reading more of the stream.
+        self.buffer = self.buffer[self.position :]
+        self.position = 0
+        while not self.exhausted and len(self.buffer) < min_length:
+            chunk = await anext(self.chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                self.buffer += self.utf8_decoder.decode(b"", final=True)
+            else:
+                self.buffer += self.utf8_decoder.decode(chunk)
+
+
+def _raise_malformed(error: Exception | None = None) -> NoReturn:
+    message = "Malformed JSON array in claim-check payload."
+    raise ValueError(message) from error
@@ -0,0 +1,258 @@
+"""Adaptive concurrency of file reviews.
+
+A static limit on concurrent LLM calls is too low when the provider is fast, and
+too high when it throttles. With autotuning enabled, the file reviews of the
+worker share a limit adjusted by additive increase, multiplicative decrease
+(AIMD), as TCP adjusts its congestion window:
+
+- A call that streams without congestion raises the limit by `increase` over
+  `limit` calls, i.e. by about `increase` per round of calls at the limit. The
+  limit is only raised while it is reached, so that idle periods cannot inflate it.
+- Congestion multiplies the limit by `decrease_factor`, at most once per
+  `cooldown` seconds, so that one burst of slow calls counts once. A call is
+  congested when it streams slower than `min_tokens_per_second`, the provider
+  rate-limits it (HTTP 429), or its time to first token (TTFT) is more than
+  `ttft_factor` times the usual for its prompt size.
+
+Since TTFT grows with the prompt, it is tracked per prompt token, and the usual
+TTFT is the `ttft_percentile` of the recent ones. Rate limits are detected from
+each HTTP response, including those the client retries. Hedge requests take a
+slot of their own, and are not sent when the limit is reached.
+
+The limit stays within `min_limit` and `max_limit`, and is exported as a gauge.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Self
+
+from src.config import config
+from src.utils import metrics
+from src.utils.latency import LatencyTracker, ttft_prompt_tokens
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveLimiter:
+    """Semaphore whose number of slots follows an AIMD limit.
+
+    Like `asyncio.Semaphore`, slots are taken with `acquire` or `async with`, and
+    returned with `release`, which may be called from any task. When the limit
+    decreases below the slots in use, no slot is taken until enough are returned.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        initial_limit: float,
+        min_limit: float,
+        max_limit: float,
+        increase: float = 1.0,
+        decrease_factor: float = 0.7,
+        cooldown: float = 5.0,
+    ) -> None:
+        """Initialize the limiter.
+
+        :param initial_limit: The limit to start from.
+        :param min_limit: The lowest limit.
+        :param max_limit: The highest limit.
+        :param increase: Increase of the limit per round of calls at the limit.
+        :param decrease_factor: Factor applied to the limit on congestion.
+        :param cooldown: Minimum time between two decreases, in seconds.
+        """
+        if not 1 <= min_limit <= max_limit:
+            msg = "The limits must satisfy 1 <= min_limit <= max_limit."
+            raise ValueError(msg)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = min(max(initial_limit, min_limit), max_limit)
+        self.in_use = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._last_decrease = -math.inf
+        self._export()
+
+    @property
+    def slots(self: Self) -> int:
+        """Number of slots that may be in use at once."""
+        return int(self.limit)
+
+    def try_acquire(self: Self) -> bool:
+        """Take a slot if one is free, without waiting.
+
+        :return: Whether a slot was taken.
+        """
+        if self._waiters or self.in_use >= self.slots:
+            return False
+        self.in_use += 1
+        self._export()
+        return True
+
+    async def acquire(self: Self) -> bool:
+        """Take a slot, waiting for one to be free."""
+        if self.try_acquire():
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            else:
+                # The slot was handed over just as the wait was cancelled.
+                self.release()
+            raise
+        return True
+
+    def release(self: Self) -> None:
+        """Return a slot."""
+        self.in_use -= 1
+        self._wake()
+
+    async def __aenter__(self: Self) -> None:
+        """Take a slot."""
+        await self.acquire()
+
+    async def __aexit__(
+        self: Self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Return the slot."""
+        self.release()
+
+    def record_success(self: Self) -> None:
+        """Record a call without congestion, raising the limit if it is reached."""
+        if self.in_use + len(self._waiters) < self.slots:
+            return
+        self.limit = min(self.limit + self.increase / self.limit, self.max_limit)
+        self._wake()
+
+    def record_congestion(self: Self, reason: str) -> None:
+        """Record a congested call, decreasing the limit unless it just did.
+
+        :param reason: What the congestion was detected from, for metrics.
+        """
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        limit = max(self.limit * self.decrease_factor, self.min_limit)
+        logger.info(
+            "LLM congestion (%s), concurrency limit %.1f -> %.1f",
+            reason,
+            self.limit,
+            limit,
+        )
+        metrics.increment(f"reviews.concurrency_decreases.{reason}")
+        self.limit = limit
+        self._export()
+
+    def _wake(self: Self) -> None:
+        """Hand free slots over to the waiters, in order."""
+        while self._waiters and self.in_use < self.slots:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                # Cancelled, and not removed by its task yet.
+                continue
+            self.in_use += 1
+            waiter.set_result(None)
+        self._export()
+
+    def _export(self: Self) -> None:
+        metrics.set_gauge("reviews.concurrency_limit", self.limit)
+        metrics.set_gauge("reviews.concurrency_in_use", self.in_use)
+
+
+_limiter: AdaptiveLimiter | None = None
+_limiter_loop: asyncio.AbstractEventLoop | None = None
+_ttft_tracker: LatencyTracker | None = None
+
+
+def get_file_review_limiter() -> AdaptiveLimiter | asyncio.Semaphore:
+    """Get the limiter of the LLM calls of a review.
+
+    With autotuning, the limiter is shared by all reviews of the running event
+    loop. Otherwise every review gets a semaphore of `max_concurrent_file_reviews`.
+    """
+    global _limiter, _limiter_loop, _ttft_tracker  # noqa: PLW0603
+
+    reviews_config = config.modules.reviews
+    autotuning_config = reviews_config.concurrency_autotuning
+    if not autotuning_config.enabled:
+        return asyncio.Semaphore(reviews_config.max_concurrent_file_reviews)
+
+    loop = asyncio.get_running_loop()
+    if _limiter is None or _limiter_loop is not loop:
+        _limiter = AdaptiveLimiter(
+            initial_limit=reviews_config.max_concurrent_file_reviews,
+            min_limit=autotuning_config.min_limit,
+            max_limit=autotuning_config.max_limit,
+            increase=autotuning_config.increase,
+            decrease_factor=autotuning_config.decrease_factor,
+            cooldown=autotuning_config.cooldown,
+        )
+        _limiter_loop = loop
+        _ttft_tracker = LatencyTracker()
+    return _limiter
+
+
+def get_shared_limiter() -> AdaptiveLimiter | None:
+    """Get the limiter shared by the reviews of the running loop, if autotuning."""
+    if _limiter_loop is not asyncio.get_running_loop():
+        return None
+    return _limiter
+
+
+def record_first_token(ttft: float, prompt_tokens: int) -> None:
+    """Record the time to first token of a call, congested if unusually long.
+
+    :param ttft: The time to first token, in seconds.
+    :param prompt_tokens: The estimated number of tokens of the prompt.
+    """
+    if _limiter is None or _ttft_tracker is None:
+        return
+    autotuning_config = config.modules.reviews.concurrency_autotuning
+    ttft_per_token = ttft / ttft_prompt_tokens(prompt_tokens)
+    if len(_ttft_tracker) >= autotuning_config.min_ttft_samples:
+        usual_ttft_per_token = _ttft_tracker.percentile(
+            autotuning_config.ttft_percentile,
+        )
+        if ttft_per_token > autotuning_config.ttft_factor * usual_ttft_per_token:
+            _limiter.record_congestion("ttft")
+    _ttft_tracker.observe(ttft_per_token)
+
+
+def record_completion(tokens_per_second: float | None) -> None:
+    """Record a call that streamed to its end, congested if too slow.
+
+    :param tokens_per_second: The streaming rate, if measurable.
+    """
+    if _limiter is None:
+        return
+    min_tokens_per_second = (
+        config.modules.reviews.concurrency_autotuning.min_tokens_per_second
+    )
+    if tokens_per_second is not None and tokens_per_second < min_tokens_per_second:
+        _limiter.record_congestion("tokens_per_second")
+    else:
+        _limiter.record_success()
+
+
+def record_rate_limited() -> None:
+    """Record a response rate-limited by the provider, which is congestion."""
+    metrics.increment("llm.rate_limited")
+    if _limiter is not None:
+        _limiter.record_congestion("rate_limited")
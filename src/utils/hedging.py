@@ -0,0 +1,274 @@
+"""Hedged LLM requests to cut the latency tail.
+
+A slow stream holds up the whole review. In hedged mode, a request whose stream
+shows no first token after a threshold derived from recently observed time to
+first token (TTFT), or streams slower than a minimum rate, gets a second request
+raced against it, possibly to a fallback model. Since TTFT grows with the prompt,
+the threshold is the percentile of recent TTFTs per prompt token, times the
+tokens of the prompt. The first to finish wins and the
+other is cancelled. A budget caps the share of requests that may be hedged, and
+with concurrency autotuning, a hedge takes a slot of the shared limit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Self
+
+from src.utils import concurrency, metrics
+from src.utils.latency import LatencyTracker, ttft_prompt_tokens
+
+if TYPE_CHECKING:
+    from box import Box
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import BaseMessage
+
+    from src.utils.concurrency import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+# Time given to the streaming rate to settle after the first token, in seconds.
+RATE_SETTLING_TIME = 1.0
+
+
+class HedgeBudget:
+    """Budget capping the share of requests that are hedged.
+
+    Every request adds `max_rate` to the budget, every hedge spends one unit. The
+    budget is capped at `burst` so that an idle period cannot be saved up.
+    """
+
+    def __init__(self: Self, max_rate: float, burst: float = 5.0) -> None:
+        """Initialize the budget."""
+        self.max_rate = max_rate
+        self.burst = burst
+        self._balance = burst
+
+    def record_request(self: Self) -> None:
+        """Record a request."""
+        self._balance = min(self._balance + self.max_rate, self.burst)
+
+    def try_spend(self: Self) -> bool:
+        """Spend one unit of budget on a hedge, if available."""
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+ttft_tracker = LatencyTracker()
+
+
+def record_first_token(ttft: float, prompt_tokens: int) -> None:
+    """Record the time to first token of a streamed request.
+
+    :param ttft: The time to first token, in seconds.
+    :param prompt_tokens: The estimated number of tokens of the prompt.
+    """
+    ttft_tracker.observe(ttft / ttft_prompt_tokens(prompt_tokens))
+    metrics.observe("llm.ttft_seconds", ttft)
+    concurrency.record_first_token(ttft, prompt_tokens)
+
+
+def record_streaming_rate(tokens: int, streaming_time: float) -> None:
+    """Record the rate of a streamed request once its stream has ended."""
+    tokens_per_second = None
+    if tokens > 1 and streaming_time > 0:
+        tokens_per_second = tokens / streaming_time
+        metrics.observe("llm.tokens_per_second", tokens_per_second)
+    concurrency.record_completion(tokens_per_second)
+
+
+class StreamAttempt:
+    """A single streamed request, collecting its output in the background."""
+
+    def __init__(
+        self: Self,
+        chat_model: BaseChatModel,
+        messages: list[BaseMessage],
+        prompt_tokens: int,
+    ) -> None:
+        """Start streaming the response of `chat_model` to `messages`.
+
+        :param chat_model: The chat model.
+        :param messages: The messages to send.
+        :param prompt_tokens: The estimated number of tokens of the messages.
+        """
+        self.prompt_tokens = prompt_tokens
+        self.chunks: list[str] = []
+        self.started_at = time.monotonic()
+        self.first_token_at: float | None = None
+        self.finished_at: float | None = None
+        self.task = asyncio.create_task(self._stream(chat_model, messages))
+
+    async def _stream(
+        self: Self,
+        chat_model: BaseChatModel,
+        messages: list[BaseMessage],
+    ) -> str:
+        async for answer in chat_model.astream(input=messages):
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+                record_first_token(
+                    self.first_token_at - self.started_at,
+                    self.prompt_tokens,
+                )
+            if isinstance(answer.content, str):
+                self.chunks.append(answer.content)
+
+        self.finished_at = time.monotonic()
+        if self.first_token_at is not None:
+            record_streaming_rate(
+                len(self.chunks),
+                self.finished_at - self.first_token_at,
+            )
+        return "".join(self.chunks)
+
+    def tokens_per_second(self: Self) -> float:
+        """Streaming rate since the first token, counting a chunk as a token."""
+        if self.first_token_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.monotonic()) - self.first_token_at
+        return len(self.chunks) / elapsed if elapsed > 0 else 0.0
+
+    def is_slow(
+        self: Self,
+        ttft_threshold: float,
+        min_tokens_per_second: float,
+    ) -> bool:
+        """Whether the attempt has no first token yet or streams too slowly."""
+        now = time.monotonic()
+        if self.first_token_at is None:
+            return now - self.started_at > ttft_threshold
+        return (
+            min_tokens_per_second > 0
+            and now - self.first_token_at > RATE_SETTLING_TIME
+            and self.tokens_per_second() < min_tokens_per_second
+        )
+
+
+class HedgedRequester:
+    """Send LLM requests, hedging the ones that are slow."""
+
+    def __init__(self: Self, hedging_config: Box) -> None:
+        """Initialize the requester.
+
+        :param hedging_config: The `llm_hedging` configuration.
+        """
+        self.config = hedging_config
+        self.budget = HedgeBudget(max_rate=hedging_config.max_hedge_rate)
+
+    def ttft_threshold(self: Self, prompt_tokens: int) -> float:
+        """Time to first token after which a request is hedged.
+
+        :param prompt_tokens: The estimated number of tokens of the prompt.
+        """
+        if len(ttft_tracker) < self.config.min_samples:
+            return self.config.default_ttft_threshold
+        return ttft_tracker.percentile(self.config.percentile) * ttft_prompt_tokens(
+            prompt_tokens,
+        )
+
+    async def ask(
+        self: Self,
+        chat_model: BaseChatModel,
+        hedge_chat_model: BaseChatModel,
+        messages: list[BaseMessage],
+        prompt_tokens: int,
+    ) -> str:
+        """Get the complete response to `messages`, hedging if the request is slow.
+
+        :param chat_model: The chat model of the primary request.
+        :param hedge_chat_model: The chat model of the hedge request.
+        :param messages: The messages to send.
+        :param prompt_tokens: The estimated number of tokens of the messages.
+        :return: The response of whichever request finished first.
+        """
+        self.budget.record_request()
+        threshold = self.ttft_threshold(prompt_tokens)
+        limiter = concurrency.get_shared_limiter()
+
+        primary = StreamAttempt(chat_model, messages, prompt_tokens)
+        hedge: StreamAttempt | None = None
+        try:
+            while hedge is None:
+                done, _ = await asyncio.wait(
+                    {primary.task},
+                    timeout=self.config.check_interval,
+                )
+                if done:
+                    return primary.task.result()
+                if primary.is_slow(
+                    threshold,
+                    self.config.min_tokens_per_second,
+                ) and self._try_spend(limiter):
+                    logger.info(
+                        "Hedging slow LLM request, TTFT threshold %.2fs",
+                        threshold,
+                    )
+                    metrics.increment("llm.hedges")
+                    hedge = StreamAttempt(hedge_chat_model, messages, prompt_tokens)
+
+            return await self._race(primary, hedge)
+        finally:
+            primary.task.cancel()
+            if hedge is not None:
+                hedge.task.cancel()
+                if limiter is not None:
+                    limiter.release()
+
+    def _try_spend(self: Self, limiter: AdaptiveLimiter | None) -> bool:
+        """Take a slot of the shared limit, if any, and a unit of budget for a hedge.
+
+        :param limiter: The limiter shared by the reviews, with autotuning.
+        :return: Whether the hedge may be sent.
+        """
+        if limiter is not None and not limiter.try_acquire():
+            # At the limit, a hedge would only add to the congestion.
+            return False
+        if self.budget.try_spend():
+            return True
+        if limiter is not None:
+            limiter.release()
+        return False
+
+    @staticmethod
+    async def _race(primary: StreamAttempt, hedge: StreamAttempt) -> str:
+        """Return the response of the first attempt to succeed."""
+        pending = {primary.task, hedge.task}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                if task is hedge.task:
+                    metrics.increment("llm.hedge_wins")
+                    metrics.observe(
+                        "llm.hedge_saved_seconds",
+                        _estimate_remaining_time(primary, len(hedge.chunks), hedge),
+                    )
+                return task.result()
+
+        # Both attempts failed, surface the error of the primary request.
+        return primary.task.result()
+
+
+def _estimate_remaining_time(
+    attempt: StreamAttempt,
+    total_tokens: int,
+    reference: StreamAttempt,
+) -> float:
+    """Estimate how long `attempt` would have needed to stream `total_tokens`.
+
+    The rate of `attempt` is used if it started streaming, otherwise the rate of
+    `reference`, making the estimate a lower bound when no token was received.
+    """
+    rate = attempt.tokens_per_second() or reference.tokens_per_second()
+    if not rate:
+        return 0.0
+    return max(total_tokens - len(attempt.chunks), 0) / rate
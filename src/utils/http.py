@@ -1,5 +1,6 @@
 """HTTP utilities."""
 
+import asyncio
 import logging
 
 import httpx
@@ -8,24 +9,50 @@ from src.config import config
 
 logger = logging.getLogger(__name__)
 
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the HTTP client shared by all requests of the running event loop.
+
+    Sharing the client reuses its connection pool across requests.
+    """
+    global _client, _client_loop  # noqa: PLW0603
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient()
+        _client_loop = loop
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client, if any."""
+    global _client  # noqa: PLW0603
+
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
 
 async def send_http_post_request(content: dict, url: str) -> None:
     """Send."""
     timeout = httpx.Timeout(config.modules.common.request_timeout, read=None)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            callback = await client.post(
-                url,
-                timeout=timeout,
-                json=content,
-            )
-            callback.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            msg = "Failed to send HTTP request message."
-            raise ValueError(
-                msg,
-            ) from e
+    client = get_http_client()
+    try:
+        callback = await client.post(
+            url,
+            timeout=timeout,
+            json=content,
+        )
+        callback.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        msg = "Failed to send HTTP request message."
+        raise ValueError(
+            msg,
+        ) from e
 
     logger.info("Successfully sent HTTP request to %s", url)
 
@@ -34,18 +61,18 @@ async def send_http_put_request(content: dict, url: str) -> None:
     """Send."""
     timeout = httpx.Timeout(config.modules.common.request_timeout, read=None)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            callback = await client.put(
-                url,
-                timeout=timeout,
-                json=content,
-            )
-            callback.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            msg = "Failed to send HTTP request message."
-            raise ValueError(
-                msg,
-            ) from e
+    client = get_http_client()
+    try:
+        callback = await client.put(
+            url,
+            timeout=timeout,
+            json=content,
+        )
+        callback.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        msg = "Failed to send HTTP request message."
+        raise ValueError(
+            msg,
+        ) from e
 
     logger.info("Successfully sent HTTP request to %s", url)
@@ -0,0 +1,43 @@
+"""Latency observations shared by hedging, concurrency and admission control."""
+
+from collections import deque
+from typing import Self
+
+# Below this many prompt tokens, TTFT is mostly fixed overhead rather than prefill.
+MIN_TTFT_PROMPT_TOKENS = 1000
+
+
+class LatencyTracker:
+    """Rolling window of observed latencies."""
+
+    def __init__(self: Self, window: int = 500) -> None:
+        """Initialize the tracker.
+
+        :param window: Number of most recent observations to keep.
+        """
+        self._observations: deque[float] = deque(maxlen=window)
+
+    def __len__(self: Self) -> int:
+        """Return the number of observations in the window."""
+        return len(self._observations)
+
+    def observe(self: Self, value: float) -> None:
+        """Add an observation."""
+        self._observations.append(value)
+
+    def percentile(self: Self, percentile: float) -> float:
+        """Get the given percentile, in [0, 1], of the observations in the window."""
+        ordered = sorted(self._observations)
+        return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+
+def ttft_prompt_tokens(prompt_tokens: int) -> int:
+    """Get the number of prompt tokens to divide the time to first token by.
+
+    Since TTFT grows with the prompt, it is compared across requests per prompt
+    token, counting at least `MIN_TTFT_PROMPT_TOKENS` tokens.
+
+    :param prompt_tokens: The estimated number of tokens of the prompt.
+    :return: The number of tokens.
+    """
+    return max(prompt_tokens, MIN_TTFT_PROMPT_TOKENS)
@@ -1,59 +1,190 @@
-"""Language model utilities."""
+"""Language model utilities.
 
-from typing import AsyncIterator
+LangChain and the provider integrations are imported on first use rather than at
+import time, so that the worker starts consuming without paying for providers it
+does not use.
+"""
 
-from box import Box
-from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import (
-    BaseMessage,
-    HumanMessage,
-    SystemMessage,
-)
-from langchain_openai import ChatOpenAI
+from __future__ import annotations
+
+import asyncio
+import time
+from http import HTTPStatus
+from typing import TYPE_CHECKING, AsyncIterator
 
 from src.common.constants import LLMProvider
-from src.config import config
+from src.config import config as app_config
+from src.utils import admission, concurrency, hedging, metrics
 from src.utils.exceptions import ConfigError
 
+if TYPE_CHECKING:
+    import httpx
+    from box import Box
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import BaseMessage
+
+# Rough number of characters per token, to estimate token counts cheaply.
+CHARS_PER_TOKEN = 4
+
+_chat_models: dict[tuple[str, str], BaseChatModel] = {}
+_chat_models_loop: asyncio.AbstractEventLoop | None = None
+_hedged_requester: hedging.HedgedRequester | None = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of `text` without tokenizing it."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Truncate `text` to about `max_tokens` tokens."""
+    return text[: max_tokens * CHARS_PER_TOKEN]
+
+
+def get_default_llm_model(config: Box = app_config) -> str:
+    """Get the model configured for the selected LLM provider."""
+    return config.provider_to_llm[config.llm_provider]
+
 
 def get_chat_model(
-    llm_model: str = config.provider_to_llm[config.llm_provider],
-    llm_provider: str = config.llm_provider,
-    config: Box = config,
+    llm_model: str | None = None,
+    llm_provider: str | None = None,
+    config: Box = app_config,
 ) -> BaseChatModel:
     """Get the chat model."""
+    llm_model = llm_model or get_default_llm_model(config)
+    llm_provider = llm_provider or config.llm_provider
     llm_type: type[BaseChatModel]
 
     match llm_provider:
         case LLMProvider.OPENAI:
+            from langchain_openai import ChatOpenAI
+            from openai import DefaultAsyncHttpxClient
+
             llm_type = ChatOpenAI
+            # Responses are observed before the client retries rate-limited ones.
+            http_async_client = DefaultAsyncHttpxClient(
+                event_hooks={"response": [_observe_response]},
+            )
         case _:
             message = f"Unknown LLM model: {llm_model}"
             raise ConfigError(message)
 
-    return llm_type(model=llm_model, **(config.llm_config or {}))
+    return llm_type(
+        model=llm_model,
+        http_async_client=http_async_client,
+        **(config.llm_config or {}),
+    )
+
+
+async def _observe_response(response: httpx.Response) -> None:
+    """Report rate-limited responses to the concurrency autotuning."""
+    if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        concurrency.record_rate_limited()
+
+
+def get_shared_chat_model(llm_model: str | None = None) -> BaseChatModel:
+    """Get a chat model shared by all calls of the running event loop.
+
+    Sharing the model reuses its client's connection pool across calls.
+    """
+    global _chat_models_loop  # noqa: PLW0603
+
+    loop = asyncio.get_running_loop()
+    if _chat_models_loop is not loop:
+        _chat_models.clear()
+        _chat_models_loop = loop
+
+    key = (app_config.llm_provider, llm_model or get_default_llm_model())
+    if key not in _chat_models:
+        _chat_models[key] = get_chat_model(llm_provider=key[0], llm_model=key[1])
+    return _chat_models[key]
+
+
+async def close_chat_models() -> None:
+    """Close the clients of the shared chat models."""
+    for chat_model in _chat_models.values():
+        client = getattr(chat_model, "root_async_client", None)
+        if client is not None:
+            await client.close()
+    _chat_models.clear()
 
 
 async def ask_llm(
     system_prompt: str,
     user_prompt: str,
     memory: list[BaseMessage] | None = None,
-    llm_model: str = config.provider_to_llm[config.llm_provider],
+    llm_model: str | None = None,
 ) -> AsyncIterator[str]:
     """Ask the LLM for a response.
 
+    With `llm_hedging` enabled, slow requests are hedged and the complete response
+    of the winning request is returned as a single chunk.
+
+    Jobs degraded by admission control use the configured degraded model, unless
+    a model is given.
+
+    Rate-limited responses are reported to the concurrency autotuning, to back
+    off, including those the client retries.
+
     :param system_prompt: The system prompt.
     :param user_prompt: The user prompt.
+    :param llm_model: The model to use, defaults to the configured provider's model.
     :return: The LLM response.
     """
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    if llm_model is None and admission.is_degraded():
+        llm_model = app_config.admission_control.degraded_model
+
     memory = memory or []
     messages = [
         SystemMessage(content=system_prompt),
         *memory,
         HumanMessage(content=user_prompt),
     ]
-    chat_model = get_chat_model(llm_model=llm_model)
+    chat_model = get_shared_chat_model(llm_model=llm_model)
+    metrics.increment("llm.requests")
+    prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+
+    async for answer in _ask_chat_model(chat_model, messages, llm_model, prompt_tokens):
+        yield answer
+
+
+async def _ask_chat_model(
+    chat_model: BaseChatModel,
+    messages: list[BaseMessage],
+    llm_model: str | None,
+    prompt_tokens: int,
+) -> AsyncIterator[str]:
+    """Stream the response of `chat_model`, hedged if enabled."""
+    global _hedged_requester  # noqa: PLW0603
+
+    hedging_config = app_config.llm_hedging
+    if hedging_config.enabled:
+        _hedged_requester = _hedged_requester or hedging.HedgedRequester(hedging_config)
+        hedge_chat_model = get_shared_chat_model(
+            llm_model=hedging_config.fallback_model or llm_model,
+        )
+        yield await _hedged_requester.ask(
+            chat_model,
+            hedge_chat_model,
+            messages,
+            prompt_tokens,
+        )
+        return
+
+    started_at = time.monotonic()
+    first_token_at: float | None = None
+    tokens = 0
 
     answer_iterator = chat_model.astream(input=messages)
     async for answer in answer_iterator:
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+            hedging.record_first_token(first_token_at - started_at, prompt_tokens)
+        tokens += 1
         yield answer.content
+
+    if first_token_at is not None:
+        hedging.record_streaming_rate(tokens, time.monotonic() - first_token_at)
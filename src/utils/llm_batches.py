@@ -0,0 +1,226 @@
+"""Provider batch APIs.
+
+Batch APIs answer a set of requests asynchronously, typically within a day, at a
+fraction of the real-time price. Requests are submitted at once, the batch is
+polled until it is done, and the answers are then fetched by the ID of their
+request. Requests that failed, or were not answered before the batch expired,
+are missing from the results.
+
+The OpenAI client is imported on first use, like the chat models.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Callable, Literal, Self
+
+from src.common.constants import LLMProvider
+from src.config import config as app_config
+from src.utils.exceptions import ConfigError
+from src.utils.llm import get_default_llm_model
+
+if TYPE_CHECKING:
+    from box import Box
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchRequest:
+    """A request of a batch.
+
+    Attributes
+    ----------
+        - custom_id: ID of the request, unique within its batch.
+        - system_prompt: The system prompt.
+        - user_prompt: The user prompt.
+    """
+
+    custom_id: str
+    system_prompt: str
+    user_prompt: str
+
+
+class BatchProvider(ABC):
+    """BatchProvider is an abstract class for provider batch APIs."""
+
+    @abstractmethod
+    async def submit(self: Self, requests: list[BatchRequest]) -> str:
+        """Submit requests as a batch.
+
+        :param requests: The requests.
+        :return: The ID of the batch.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def is_done(self: Self, batch_id: str) -> bool:
+        """Whether the batch is done, successfully or not."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def results(self: Self, batch_id: str) -> dict[str, str]:
+        """Fetch the answers of a batch that is done.
+
+        :param batch_id: The ID of the batch.
+        :return: The answers by ID of their request, for requests that succeeded.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self: Self) -> None:
+        """Release the client of the provider, if any."""
+        raise NotImplementedError
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """Batch provider backed by the OpenAI Batch API."""
+
+    def __init__(
+        self: Self,
+        llm_model: str,
+        completion_window: Literal["24h"] = "24h",
+        llm_config: dict[str, Any] | None = None,
+    ) -> None:
+        """Initialize the provider.
+
+        :param llm_model: The model answering the requests.
+        :param completion_window: Time frame within which the batch is processed.
+        :param llm_config: Extra parameters of the chat completion requests.
+        """
+        from openai import AsyncOpenAI
+
+        self.llm_model = llm_model
+        self.completion_window = completion_window
+        self.llm_config = llm_config or {}
+        self._client = AsyncOpenAI()
+
+    async def submit(self: Self, requests: list[BatchRequest]) -> str:
+        """Upload the requests as a JSON Lines file and create a batch from it."""
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": request.custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.llm_model,
+                        "messages": [
+                            {"role": "system", "content": request.system_prompt},
+                            {"role": "user", "content": request.user_prompt},
+                        ],
+                        **self.llm_config,
+                    },
+                },
+            )
+            for request in requests
+        ]
+        input_file = await self._client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()),
+            purpose="batch",
+        )
+        batch = await self._client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def is_done(self: Self, batch_id: str) -> bool:
+        """Whether the batch reached a terminal status."""
+        batch = await self._client.batches.retrieve(batch_id)
+        return batch.status in {"completed", "failed", "expired", "cancelled"}
+
+    async def results(self: Self, batch_id: str) -> dict[str, str]:
+        """Read the answers from the output file of the batch."""
+        batch = await self._client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            logger.warning("Batch %s ended as %s", batch_id, batch.status)
+        if batch.output_file_id is None:
+            return {}
+
+        output_file = await self._client.files.content(batch.output_file_id)
+        answers = {}
+        for line in output_file.text.splitlines():
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            response = output.get("response") or {}
+            if output.get("error") or response.get("status_code") != HTTPStatus.OK:
+                continue
+            message = response["body"]["choices"][0]["message"]
+            answers[output["custom_id"]] = message["content"]
+        return answers
+
+    async def close(self: Self) -> None:
+        """Close the OpenAI client."""
+        await self._client.close()
+
+
+class FakeBatchProvider(BatchProvider):
+    """Local batch provider answering requests itself, for testing.
+
+    Batches are done after being polled `polls` times.
+    """
+
+    def __init__(
+        self: Self,
+        answer: Callable[[BatchRequest], str] | None = None,
+        polls: int = 1,
+    ) -> None:
+        """Initialize the provider.
+
+        :param answer: Answers a request, defaults to a fixed answer.
+        :param polls: Number of times a batch is polled before it is done.
+        """
+        self.answer = answer or (lambda _: "No issues found.")
+        self.polls = polls
+        self.batches: dict[str, list[BatchRequest]] = {}
+        self._polls: dict[str, int] = {}
+
+    async def submit(self: Self, requests: list[BatchRequest]) -> str:
+        """Keep the requests."""
+        batch_id = f"batch_{len(self.batches)}"
+        self.batches[batch_id] = requests
+        self._polls[batch_id] = 0
+        return batch_id
+
+    async def is_done(self: Self, batch_id: str) -> bool:
+        """Whether the batch has been polled enough times."""
+        self._polls[batch_id] += 1
+        return self._polls[batch_id] >= self.polls
+
+    async def results(self: Self, batch_id: str) -> dict[str, str]:
+        """Answer the requests of the batch."""
+        return {
+            request.custom_id: self.answer(request)
+            for request in self.batches[batch_id]
+        }
+
+    async def close(self: Self) -> None:
+        """Release nothing."""
+
+
+def get_batch_provider(config: Box = app_config) -> BatchProvider:
+    """Get the batch provider configured for batch reviews.
+
+    :raises ConfigError: If the configured provider is unknown.
+    :return: The batch provider.
+    """
+    batch_config = config.batch_reviews
+    match batch_config.provider:
+        case LLMProvider.OPENAI:
+            return OpenAIBatchProvider(
+                llm_model=batch_config.llm_model or get_default_llm_model(config),
+                completion_window=batch_config.completion_window,
+                llm_config=batch_config.llm_config,
+            )
+        case "fake":
+            return FakeBatchProvider()
+        case _:
+            message = f"Unknown batch provider: {batch_config.provider}"
+            raise ConfigError(message)
@@ -0,0 +1,453 @@
+"""Message queue subscribers.
+
+All transports follow the `MessageQueueSubscriber` contract:
+
+- `start` returns once messages are being received, and handles them in the
+  background, at most `max_concurrency` at a time.
+- Each message is first admitted by the admission controller. Deferred messages
+  are redelivered after the deferral delay.
+- A message is acked once its callback returns. If the callback raises, the
+  message is failed: it is handed to the broker's dead-lettering, if any, rather
+  than redelivered right away. If the callback is cancelled, e.g. by `drain`, or
+  the subscriber is draining, the message is nacked for redelivery.
+- `drain` stops receiving, waits up to a timeout for in-flight messages, and
+  cancels the rest. `close` then releases the connections.
+
+Besides RabbitMQ and Pub/Sub, messages can be received from an in-memory asyncio
+queue, or replayed from local JSON Lines spool files, to load-test the worker or
+replay traffic offline.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Self,
+    Sequence,
+)
+
+from src.config import config
+from src.utils import metrics
+from src.utils.admission import (
+    AdmissionController,
+    Decision,
+    NullAdmissionController,
+)
+from src.utils.shutdown import InFlightTasks
+
+logger = logging.getLogger(__name__)
+
+MessageCallback = Callable[[bytes], Coroutine[Any, Any, None]]
+
+
+class Delivery(ABC):
+    """A message delivered by a transport, with the transport's acknowledgements.
+
+    Attributes
+    ----------
+        - body: The raw body of the message.
+        - defers: Number of times the message has been deferred already, if the
+          transport keeps count.
+    """
+
+    body: bytes
+    defers: int = 0
+
+    def take_body(self: Self) -> bytes:
+        """Detach the body, so that only its processing keeps it alive."""
+        body, self.body = self.body, b""
+        return body
+
+    @abstractmethod
+    async def ack(self: Self) -> None:
+        """Acknowledge the message as processed."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def nack(self: Self) -> None:
+        """Return the message for redelivery."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fail(self: Self) -> None:
+        """Give up on the message, leaving it to dead-lettering if any."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def defer(self: Self) -> None:
+        """Return the message for redelivery after the deferral delay."""
+        raise NotImplementedError
+
+
+class MessageQueueSubscriber(ABC):
+    """MessageQueueSubscriber is an abstract class for message queue subscribers."""
+
+    def __init__(
+        self: Self,
+        callback: MessageCallback,
+        max_concurrency: int | None = None,
+        admission_controller: AdmissionController | None = None,
+    ) -> None:
+        """Initialize the subscriber.
+
+        :param callback: Processes the body of a message.
+        :param max_concurrency: Maximum number of messages processed at once,
+            defaults to `modules.common.max_concurrent_messages`.
+        :param admission_controller: Decides which messages are taken, defaults to
+            taking all of them.
+        """
+        self.callback = callback
+        self.max_concurrency = (
+            max_concurrency or config.modules.common.max_concurrent_messages
+        )
+        self.admission_controller = admission_controller or NullAdmissionController()
+        self.running = False
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = InFlightTasks()
+
+    @abstractmethod
+    async def start(self: Self) -> None:
+        """Start receiving messages in the background."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stop_receiving(self: Self) -> None:
+        """Stop receiving new messages."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self: Self) -> None:
+        """Close the connection to the broker."""
+        raise NotImplementedError
+
+    async def drain(self: Self, timeout: float) -> None:
+        """Stop receiving and wait up to `timeout` seconds for in-flight messages.
+
+        Messages still in flight after the timeout are nacked for redelivery.
+
+        :param timeout: Time to wait for in-flight messages, in seconds.
+        """
+        self.running = False
+        await self.stop_receiving()
+        nacked = await self._in_flight.drain(timeout)
+        logger.info("%s drained, nacked %s message(s)", type(self).__name__, nacked)
+
+    async def process(self: Self, body: bytes) -> None:
+        """Process the body of a message, by default with the callback."""
+        await self.callback(body)
+
+    def spawn(self: Self, delivery: Delivery) -> None:
+        """Handle `delivery` in a task tracked for draining."""
+        self.track(asyncio.get_running_loop().create_task(self.handle(delivery)))
+
+    def track(self: Self, task: asyncio.Task) -> None:
+        """Track a task handling a message, for draining."""
+        self._in_flight.track(task)
+
+    async def handle(self: Self, delivery: Delivery) -> None:
+        """Handle a delivered message, following the subscriber contract."""
+        try:
+            await self._handle(delivery)
+        except Exception:
+            logger.exception("Error acknowledging message")
+
+    async def _handle(self: Self, delivery: Delivery) -> None:
+        if not self.running:
+            # Draining, leave the message to another subscriber.
+            await self._settle(delivery.nack, "nacked")
+            return
+
+        admission = self.admission_controller.admit(delivery.body, delivery.defers)
+        if admission.decision is Decision.defer:
+            await self._settle(delivery.defer, "deferred")
+            return
+
+        with self.admission_controller.track(admission):
+            try:
+                async with self._semaphore:
+                    if not self.running:
+                        await self._settle(delivery.nack, "nacked")
+                        return
+
+                    try:
+                        await self.process(delivery.take_body())
+                    except Exception:
+                        logger.exception("Error processing message")
+                        await self._settle(delivery.fail, "failed")
+                        return
+            except asyncio.CancelledError:
+                # Interrupted while processing, or while waiting for a slot.
+                logger.info("Message processing interrupted, nacking...")
+                await self._settle(delivery.nack, "nacked")
+                raise
+            await self._settle(delivery.ack, "acked")
+
+    @staticmethod
+    async def _settle(settle: Callable[[], Awaitable[None]], outcome: str) -> None:
+        metrics.increment(f"messages.{outcome}")
+        await settle()
+
+
+class InMemoryDelivery(Delivery):
+    """A message delivered by an in-memory queue."""
+
+    def __init__(
+        self: Self,
+        subscriber: InMemorySubscriber,
+        body: bytes,
+        defers: int = 0,
+    ) -> None:
+        """Initialize the delivery."""
+        self.subscriber = subscriber
+        self.body = body
+        self.defers = defers
+        self._raw_body = body
+
+    async def ack(self: Self) -> None:
+        """Mark the message as done."""
+        self.subscriber.queue.task_done()
+
+    async def nack(self: Self) -> None:
+        """Put the message back on the queue."""
+        self._requeue(self.defers)
+
+    async def fail(self: Self) -> None:
+        """Keep the message aside."""
+        self.subscriber.failed.append(self._raw_body)
+        self.subscriber.queue.task_done()
+
+    async def defer(self: Self) -> None:
+        """Put the message back on the queue after the deferral delay."""
+
+        async def requeue() -> None:
+            await asyncio.sleep(config.admission_control.defer_delay)
+            self._requeue(self.defers + 1)
+
+        # Not tracked for draining: the message is not being processed.
+        deferral = asyncio.create_task(requeue())
+        self.subscriber.deferrals[deferral] = self
+        deferral.add_done_callback(
+            lambda task: self.subscriber.deferrals.pop(task, None),
+        )
+
+    def _requeue(self: Self, defers: int) -> None:
+        """Put the message back on the queue, counting its deferrals."""
+        self.subscriber.queue.put_nowait((self._raw_body, defers))
+        self.subscriber.queue.task_done()
+
+
+class InMemorySubscriber(MessageQueueSubscriber):
+    """Subscriber to an asyncio queue of message bodies in this process.
+
+    The queue holds each body along with the number of times it was deferred.
+
+    At most `prefetch` messages are taken from the queue and not settled yet, as a
+    broker would limit unacknowledged messages. Messages still deferred when the
+    subscriber stops receiving are failed, so that they are kept in `failed`.
+    """
+
+    def __init__(
+        self: Self,
+        callback: MessageCallback,
+        max_concurrency: int | None = None,
+        admission_controller: AdmissionController | None = None,
+        prefetch: int | None = None,
+    ) -> None:
+        """Initialize the subscriber.
+
+        :param prefetch: Maximum number of messages taken and not yet settled,
+            defaults to twice `max_concurrency`.
+        """
+        super().__init__(callback, max_concurrency, admission_controller)
+        self.queue: asyncio.Queue[tuple[bytes, int]] = asyncio.Queue()
+        self.failed: list[bytes] = []
+        self.deferrals: dict[asyncio.Task, InMemoryDelivery] = {}
+        self._prefetch = asyncio.Semaphore(prefetch or 2 * self.max_concurrency)
+        self._pump_task: asyncio.Task | None = None
+        self._taken = asyncio.Event()
+
+    def publish(self: Self, body: bytes) -> None:
+        """Put a message on the queue."""
+        self.queue.put_nowait((body, 0))
+
+    async def start(self: Self) -> None:
+        """Start taking messages from the queue in the background."""
+        self.running = True
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def join(self: Self) -> None:
+        """Wait until every message put on the queue has been settled."""
+        await self.queue.join()
+
+    async def _pump(self: Self) -> None:
+        while True:
+            await self._prefetch.acquire()
+            delivery = InMemoryDelivery(self, *await self.queue.get())
+            self._taken.set()
+            task = asyncio.create_task(self.handle(delivery))
+            task.add_done_callback(lambda _: self._prefetch.release())
+            self.track(task)
+
+    async def stop_receiving(self: Self) -> None:
+        """Stop taking messages from the queue."""
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+        for deferral, delivery in list(self.deferrals.items()):
+            if not deferral.done():
+                deferral.cancel()
+                await self._settle(delivery.fail, "failed")
+        self.deferrals.clear()
+
+    async def close(self: Self) -> None:
+        """Stop taking messages from the queue."""
+        self.running = False
+        await self.stop_receiving()
+
+
+class SpoolSubscriber(InMemorySubscriber):
+    """Subscriber replaying JSON Lines spool files, one message body per line.
+
+    Lines are read lazily as messages are taken, so spools of any size replay at
+    the speed of the worker. Failed messages are appended to `<spool>.failed`
+    next to the last spool, in the same format, to be replayed again. When the
+    replay is interrupted, the messages not processed yet, whether nacked, queued
+    or not read, are appended as well. Once every message of the spools has been
+    settled, `on_finished` is called.
+
+    Messages are processed at most `modules.common.max_concurrent_messages` at a
+    time.
+    """
+
+    def __init__(
+        self: Self,
+        paths: Sequence[str | Path],
+        callback: MessageCallback,
+        admission_controller: AdmissionController | None = None,
+        on_finished: Callable[[], None] | None = None,
+    ) -> None:
+        """Initialize the subscriber.
+
+        :param paths: Paths to the spool files, replayed in order.
+        :param on_finished: Called once all messages have been settled.
+        """
+        super().__init__(callback, admission_controller=admission_controller)
+        self.paths = [Path(path) for path in paths]
+        self.on_finished = on_finished
+        self._lines = iter_spool(self.paths)
+        self._reader_task: asyncio.Task | None = None
+        self._pending_read: asyncio.Future[list[bytes]] | None = None
+
+    async def start(self: Self) -> None:
+        """Start replaying the spools in the background."""
+        await super().start()
+        self._reader_task = asyncio.create_task(self._read())
+
+    async def _read(self: Self) -> None:
+        replayed = 0
+        while batch := await self._read_batch():
+            for line in batch:
+                self.publish(line)
+            replayed += len(batch)
+            # Keep the queue short, reading the next lines only when needed.
+            while self.queue.qsize() >= self.max_concurrency:
+                self._taken.clear()
+                await self._taken.wait()
+
+        await self.join()
+        logger.info(
+            "Replayed %s message(s), %s failed",
+            replayed,
+            len(self.failed),
+        )
+        await self._write_failed()
+        if self.on_finished is not None:
+            self.on_finished()
+
+    async def _read_batch(self: Self) -> list[bytes]:
+        """Read the next lines of the spools.
+
+        Reading is shielded from cancellation, so that lines read when the replay
+        is interrupted are written to the spool of failed messages, not lost.
+        """
+        lines = itertools.islice(self._lines, self.max_concurrency)
+        self._pending_read = asyncio.ensure_future(asyncio.to_thread(list, lines))
+        batch = await asyncio.shield(self._pending_read)
+        self._pending_read = None
+        return batch
+
+    async def _write_failed(self: Self) -> None:
+        """Append the messages failed so far to the spool of failed messages."""
+        failed, self.failed = self.failed, []
+        if failed:
+            failed_path = await asyncio.to_thread(
+                append_failed_to_spool,
+                self.paths,
+                failed,
+            )
+            logger.info("Wrote %s failed message(s) to %s", len(failed), failed_path)
+
+    async def _write_unprocessed(self: Self) -> None:
+        """Append the messages not processed yet to the spool of failed messages."""
+        unprocessed = []
+        while not self.queue.empty():
+            body, _ = self.queue.get_nowait()
+            unprocessed.append(body)
+        if self._pending_read is not None:
+            unprocessed += await self._pending_read
+            self._pending_read = None
+        next_line = await asyncio.to_thread(next, self._lines, None)
+        if next_line is not None:
+            unprocessed.append(next_line)
+        if not unprocessed:
+            return
+        failed_path = await asyncio.to_thread(
+            append_failed_to_spool,
+            self.paths,
+            itertools.chain(unprocessed, self._lines),
+        )
+        logger.info("Wrote the unprocessed messages to %s", failed_path)
+
+    async def stop_receiving(self: Self) -> None:
+        """Stop replaying the spools."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        await super().stop_receiving()
+
+    async def close(self: Self) -> None:
+        """Stop replaying the spools, and write the messages left to replay."""
+        await super().close()
+        await self._write_failed()
+        await self._write_unprocessed()
+
+
+def iter_spool(paths: Sequence[Path]) -> Iterator[bytes]:
+    """Iterate over the messages of spool files, in order."""
+    for path in paths:
+        with path.open("rb") as file:
+            for line in file:
+                if line.strip():
+                    yield line.rstrip(b"\r\n")
+
+
+def append_failed_to_spool(paths: Sequence[Path], bodies: Iterable[bytes]) -> Path:
+    """Append failed messages to `<spool>.failed`, next to the last spool.
+
+    :param paths: Paths to the spool files the messages were read from.
+    :param bodies: The bodies of the failed messages.
+    :return: The path of the spool of failed messages.
+    """
+    failed_path = paths[-1].with_name(f"{paths[-1].name}.failed")
+    with failed_path.open("ab") as file:
+        for body in bodies:
+            file.write(body.rstrip(b"\n") + b"\n")
+    return failed_path
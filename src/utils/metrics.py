@@ -0,0 +1,74 @@
+"""In-process metrics.
+
+A minimal registry of counters, gauges and summaries. The current values are
+exposed through `snapshot` and logged by `log_metrics`.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Self
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Summary:
+    """Summary of observed values."""
+
+    count: int = 0
+    total: float = 0.0
+    maximum: float = 0.0
+
+    def observe(self: Self, value: float) -> None:
+        """Add an observed value."""
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    @property
+    def mean(self: Self) -> float:
+        """Mean of the observed values."""
+        return self.total / self.count if self.count else 0.0
+
+
+_counters: defaultdict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+_summaries: defaultdict[str, Summary] = defaultdict(Summary)
+
+
+def increment(name: str, value: float = 1.0) -> None:
+    """Increment the counter `name` by `value`."""
+    _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set the gauge `name` to `value`."""
+    _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Add `value` to the summary `name`."""
+    _summaries[name].observe(value)
+
+
+def snapshot() -> dict[str, float]:
+    """Get the current value of all metrics.
+
+    Summaries are flattened into `<name>.count`, `<name>.mean` and `<name>.max`.
+    """
+    values = dict(_counters) | _gauges
+    for name, summary in _summaries.items():
+        values |= {
+            f"{name}.count": summary.count,
+            f"{name}.mean": summary.mean,
+            f"{name}.max": summary.maximum,
+        }
+    return dict(sorted(values.items()))
+
+
+def log_metrics() -> None:
+    """Log the current value of all metrics."""
+    logger.info("Metrics: %s", snapshot())
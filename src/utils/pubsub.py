@@ -1,29 +1,60 @@
-"""Module containing message queue subscribers."""
+"""Google Cloud Pub/Sub subscriber."""
 
 import asyncio
-import json
 import logging
-from abc import ABC, abstractmethod
-from typing import Any, Awaitable, Callable, Self
+from typing import Self
 
 from google.api_core.exceptions import GoogleAPICallError, RetryError
 from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber import futures
+
+from src.config import config
+from src.utils.admission import AdmissionController
+from src.utils.message_queue import Delivery, MessageCallback, MessageQueueSubscriber
 
 logger = logging.getLogger(__name__)
 
 
-class MessageQueueSubscriber(ABC):
-    """MessageQueueSubscriber is an abstract class for message queue subscribers."""
+class PubSubDelivery(Delivery):
+    """A message delivered by Pub/Sub.
 
-    @abstractmethod
-    async def start(self: Self) -> None:
-        """Start the subscriber."""
-        raise NotImplementedError
+    Pub/Sub only counts delivery attempts of subscriptions with a dead-letter
+    policy. There, every earlier attempt is counted as a deferral, which
+    overestimates them when the message was also nacked for other reasons.
+    """
+
+    def __init__(self: Self, message: pubsub_v1.subscriber.message.Message) -> None:
+        """Initialize the delivery."""
+        self.message = message
+        self.body = message.data
+        if message.delivery_attempt is not None:
+            self.defers = message.delivery_attempt - 1
+
+    async def ack(self: Self) -> None:
+        """Acknowledge the message."""
+        self.message.ack()
+
+    async def nack(self: Self) -> None:
+        """Nack the message for redelivery."""
+        self.message.nack()
 
-    @abstractmethod
-    async def stop(self: Self) -> None:
-        """Stop the subscriber."""
-        raise NotImplementedError
+    async def fail(self: Self) -> None:
+        """Nack the message, leaving it to the dead-letter policy if any.
+
+        The message is redelivered until the policy's maximum delivery attempts,
+        or until it expires if the subscription has no dead-letter policy.
+        """
+        self.message.nack()
+
+    async def defer(self: Self) -> None:
+        """Hold the message for the deferral delay, then nack it.
+
+        The lease of the message is extended meanwhile by the subscriber client.
+        """
+        try:
+            await asyncio.sleep(config.admission_control.defer_delay)
+        finally:
+            self.message.nack()
 
 
 class AsyncPubSubSubscriber(MessageQueueSubscriber):
@@ -33,10 +64,15 @@ class AsyncPubSubSubscriber(MessageQueueSubscriber):
         self: Self,
         project_id: str,
         subscription_id: str,
-        callback: Callable[[Any], Awaitable[None]],
-        loop: asyncio.AbstractEventLoop,
+        callback: MessageCallback,
+        admission_controller: AdmissionController | None = None,
     ) -> None:
-        """Initialize the subscriber."""
+        """Initialize the subscriber.
+
+        At most `modules.common.max_concurrent_messages` messages are leased at a
+        time, so that the ones waiting for a slot are left to other subscribers.
+        """
+        super().__init__(callback, admission_controller=admission_controller)
         self.project_id = project_id
         self.subscription_id = subscription_id
         self.subscriber = pubsub_v1.SubscriberClient()
@@ -44,53 +80,45 @@ class AsyncPubSubSubscriber(MessageQueueSubscriber):
             project_id,
             subscription_id,
         )
-        self.running = False
-        self.callback = callback
-        self.loop = loop
-        self.semaphore = asyncio.Semaphore(4)
+        self._streaming_pull_future: futures.StreamingPullFuture | None = None
 
     async def start(self: Self) -> None:
-        """Start the subscriber to pull messages asynchronously."""
+        """Start pulling messages in the background."""
         self.running = True
+        loop = asyncio.get_running_loop()
 
         def message_callback(message: pubsub_v1.subscriber.message.Message) -> None:
-            # The callback is synchronous, so we need to run the async handler
-            asyncio.run_coroutine_threadsafe(
-                self._handle_message(message),
-                self.loop,
-            )
+            # The callback runs on a subscriber thread, hand the message to the loop.
+            loop.call_soon_threadsafe(self.spawn, PubSubDelivery(message))
+
+        logger.info("Listening for messages on %s...", self.subscription_path)
+        self._streaming_pull_future = self.subscriber.subscribe(
+            self.subscription_path,
+            callback=message_callback,
+            flow_control=pubsub_v1.types.FlowControl(
+                max_messages=self.max_concurrency,
+            ),
+        )
+        self._streaming_pull_future.add_done_callback(self._on_streaming_pull_done)
 
+    @staticmethod
+    def _on_streaming_pull_done(future: futures.StreamingPullFuture) -> None:
+        """Log why the streaming pull stopped."""
+        if future.cancelled():
+            return
         try:
-            logger.info("Listening for messages on %s...", self.subscription_path)
-            self.subscriber.subscribe(self.subscription_path, callback=message_callback)
-
-            while self.running:
-                await asyncio.sleep(5)
-
+            future.result()
         except (GoogleAPICallError, RetryError) as e:
             logger.info("Error handling message: %s", e)
 
-        finally:
-            await self.stop()
+    async def stop_receiving(self: Self) -> None:
+        """Stop pulling messages."""
+        if self._streaming_pull_future is not None:
+            self._streaming_pull_future.cancel()
 
-    async def _handle_message(
-        self: Self,
-        message: pubsub_v1.subscriber.message.Message,
-    ) -> None:
-        """Process each message asynchronously."""
-        async with self.semaphore:
-            try:
-                message_data = message.data.decode("utf-8")
-                logger.info("Received message")
-                message_dict = json.loads(message_data)
-                await self.callback(message_dict)
-                message.ack()
-            except Exception:
-                logger.info("Error handling message, nacking...")
-                message.nack()
-
-    async def stop(self: Self) -> None:
+    async def close(self: Self) -> None:
         """Stop the subscriber gracefully."""
         logger.info("Stopping subscriber...")
         self.running = False
+        await self.stop_receiving()
         self.subscriber.close()
@@ -0,0 +1,127 @@
+"""Graceful shutdown of the worker.
+
+On SIGTERM (e.g. when a pod is scaled down) the worker stops taking new messages,
+gives in-flight reviews until a deadline to finish, hands the unfinished ones back
+to the broker and finally closes its long-lived clients.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+from typing import Any, Awaitable, Callable, Protocol, Self
+
+logger = logging.getLogger(__name__)
+
+
+class DrainableConsumer(Protocol):
+    """A message consumer that can be drained on shutdown."""
+
+    async def drain(self: Self, timeout: float) -> None:
+        """Stop consuming and wait up to `timeout` seconds for in-flight messages.
+
+        Messages still in flight after the timeout are cancelled and returned to
+        the broker for redelivery.
+        """
+
+    async def close(self: Self) -> None:
+        """Close the connection to the broker."""
+
+
+class InFlightTasks:
+    """Track the tasks handling messages, so that they can be drained."""
+
+    def __init__(self: Self) -> None:
+        """Initialize the tracker."""
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self: Self) -> int:
+        """Return the number of tasks in flight."""
+        return len(self._tasks)
+
+    def track(self: Self, task: asyncio.Task) -> None:
+        """Track `task` until it is done."""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self: Self, timeout: float) -> int:
+        """Wait up to `timeout` seconds for tracked tasks, then cancel the rest.
+
+        The tasks are responsible for returning their message to the broker when
+        cancelled.
+
+        :param timeout: Time to wait for the tasks to finish, in seconds.
+        :return: Number of tasks that had to be cancelled.
+        """
+        if not self._tasks:
+            return 0
+
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return len(pending)
+
+
+class ShutdownCoordinator:
+    """Coordinate the graceful shutdown of consumers and clients."""
+
+    def __init__(self: Self, timeout: float) -> None:
+        """Initialize the coordinator.
+
+        :param timeout: Time given to in-flight messages to finish, in seconds.
+        """
+        self.timeout = timeout
+        self._consumers: list[DrainableConsumer] = []
+        self._cleanups: list[Callable[[], Awaitable[Any]]] = []
+        self._stop_event = asyncio.Event()
+
+    def add_consumer(self: Self, consumer: DrainableConsumer) -> None:
+        """Drain and close `consumer` on shutdown."""
+        self._consumers.append(consumer)
+
+    def add_cleanup(self: Self, cleanup: Callable[[], Awaitable[Any]]) -> None:
+        """Run `cleanup` once all consumers are drained, e.g. to close clients."""
+        self._cleanups.append(cleanup)
+
+    def request_shutdown(self: Self) -> None:
+        """Ask the worker to shut down."""
+        logger.info("Received shutdown signal")
+        self._stop_event.set()
+
+    async def wait_for_shutdown(self: Self) -> None:
+        """Wait until SIGINT or SIGTERM is received, then shut down."""
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGINT, self.request_shutdown)
+        loop.add_signal_handler(signal.SIGTERM, self.request_shutdown)
+
+        await self._stop_event.wait()
+        await self.shutdown()
+
+    async def shutdown(self: Self) -> None:
+        """Drain all consumers, then close them and run the cleanups."""
+        logger.info(
+            "Draining %s consumer(s), waiting up to %ss for in-flight messages...",
+            len(self._consumers),
+            self.timeout,
+        )
+        await asyncio.gather(
+            *(consumer.drain(self.timeout) for consumer in self._consumers),
+        )
+
+        for consumer in self._consumers:
+            await consumer.close()
+
+        for cleanup in self._cleanups:
+            await _run_cleanup(cleanup)
+
+        logger.info("Shutdown complete")
+
+
+async def _run_cleanup(cleanup: Callable[[], Awaitable[Any]]) -> None:
+    """Run `cleanup`, logging rather than raising its errors."""
+    try:
+        await cleanup()
+    except Exception:
+        logger.exception("Error during shutdown cleanup")
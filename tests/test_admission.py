@@ -0,0 +1,120 @@
+"""Tests of the admission control of review jobs."""
+
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Self
+
+import pytest
+from box import Box
+
+from src.config import config
+from src.utils.admission import (
+    Admission,
+    Decision,
+    LoadAdmissionController,
+    NullAdmissionController,
+    is_degraded,
+)
+from src.utils.message_queue import InMemorySubscriber
+from src.utils.pubsub import PubSubDelivery
+
+ADMISSION_CONFIG = Box(
+    {
+        "max_in_flight_tokens": 1000,
+        "large_job_tokens": 500,
+        "latency_sla_seconds": 10.0,
+        "latency_percentile": 0.5,
+        "min_latency_samples": 2,
+        "max_defers": 2,
+    },
+)
+
+
+def controller() -> LoadAdmissionController:
+    """Create a controller estimating the cost of a job as its body, in tokens."""
+    return LoadAdmissionController(ADMISSION_CONFIG, lambda body: int(body))
+
+
+def test_idle_workers_accept_any_job() -> None:
+    """Jobs are accepted while the worker has room, however large when idle."""
+    admission_controller = controller()
+
+    assert admission_controller.admit(b"5000").decision is Decision.accept
+    with admission_controller.track(admission_controller.admit(b"400")):
+        assert admission_controller.admit(b"600").decision is Decision.accept
+
+
+def test_large_jobs_are_deferred_under_pressure() -> None:
+    """Under pressure, large jobs are deferred up to `max_defers` times."""
+    admission_controller = controller()
+
+    with admission_controller.track(admission_controller.admit(b"800")):
+        assert admission_controller.admit(b"600").decision is Decision.defer
+        assert admission_controller.admit(b"600", defers=1).decision is Decision.defer
+        admission = admission_controller.admit(b"600", defers=2)
+        assert admission.decision is Decision.degrade
+
+
+def test_normal_jobs_are_degraded_under_pressure() -> None:
+    """Under pressure, normal jobs are degraded, and know it while they run."""
+    admission_controller = controller()
+
+    with admission_controller.track(admission_controller.admit(b"800")):
+        admission = admission_controller.admit(b"300")
+        assert admission.decision is Decision.degrade
+        with admission_controller.track(admission):
+            assert is_degraded()
+    assert not is_degraded()
+    assert admission_controller.in_flight_tokens == 0
+
+
+def test_slow_workers_are_under_pressure() -> None:
+    """Exceeding the latency SLA puts the worker under pressure."""
+    admission_controller = controller()
+    for _ in range(2):
+        admission_controller.latency_tracker.observe(60.0)
+
+    with admission_controller.track(admission_controller.admit(b"100")):
+        assert admission_controller.admit(b"100").decision is Decision.degrade
+
+
+class RecordingAdmissionController(NullAdmissionController):
+    """Admission controller deferring jobs twice, recording their deferrals."""
+
+    def __init__(self: Self) -> None:
+        """Initialize the controller."""
+        self.defers: list[int] = []
+
+    def admit(self: Self, body: bytes, defers: int = 0) -> Admission:  # noqa: ARG002
+        """Defer the job, until it has been deferred twice."""
+        self.defers.append(defers)
+        decision = Decision.accept if defers >= 2 else Decision.defer  # noqa: PLR2004
+        return Admission(decision=decision, cost=0)
+
+
+def test_in_memory_deliveries_count_deferrals(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Deferred messages are redelivered with their number of deferrals."""
+    monkeypatch.setattr(config.admission_control, "defer_delay", 0.0)
+    admission_controller = RecordingAdmissionController()
+
+    async def run() -> None:
+        subscriber = InMemorySubscriber(
+            lambda _: asyncio.sleep(0),
+            admission_controller=admission_controller,
+        )
+        subscriber.publish(b"job")
+        await subscriber.start()
+        await asyncio.wait_for(subscriber.join(), timeout=1.0)
+        await subscriber.close()
+
+    asyncio.run(run())
+    assert admission_controller.defers == [0, 1, 2]
+
+
+def test_pub_sub_deliveries_count_earlier_attempts() -> None:
+    """Pub/Sub counts delivery attempts with a dead-letter policy only."""
+    message: Any = SimpleNamespace(data=b"job", delivery_attempt=3)
+    no_policy_message: Any = SimpleNamespace(data=b"job", delivery_attempt=None)
+
+    assert PubSubDelivery(message).defers == 2  # noqa: PLR2004
+    assert PubSubDelivery(no_policy_message).defers == 0
@@ -0,0 +1,187 @@
+"""Tests of batch reviews, with a fake batch provider."""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from src.config import config
+from src.reviews import batch_reviews
+from src.reviews.models.pull_requests import FileReview
+from src.utils import api
+from src.utils.llm_batches import BatchRequest, FakeBatchProvider
+
+FILE_DIFF = {
+    "filename": "a.py",
+    "patch": "@@ -1,1 +1,2 @@\n a\n+b",
+    "additions": 1,
+    "deletions": 0,
+    "changes": 1,
+}
+
+
+class FakeAPI:
+    """Records completed reviews, failing those of `failing_review_ids`."""
+
+    def __init__(self: Self, failing_review_ids: frozenset[int] = frozenset()) -> None:
+        """Initialize the fake API."""
+        self.failing_review_ids = failing_review_ids
+        self.completed_reviews: dict[int, list[str]] = {}
+
+    async def complete_review(
+        self: Self,
+        review_id: int,
+        file_reviews: list[FileReview],
+        **kwargs: object,  # noqa: ARG002
+    ) -> None:
+        """Record the review, or fail."""
+        if review_id in self.failing_review_ids:
+            msg = "Failed to send HTTP request message."
+            raise ValueError(msg)
+        self.completed_reviews[review_id] = [
+            file_review.content for file_review in file_reviews
+        ]
+
+    async def update_progress(self: Self, *args: object) -> None:  # noqa: ARG002
+        """Fail, progress reports are best effort."""
+        msg = "Failed to send HTTP request message."
+        raise ValueError(msg)
+
+
+@pytest.fixture()
+def fake_api(monkeypatch: pytest.MonkeyPatch) -> FakeAPI:
+    """Replace the API with a fake failing the review 2."""
+    fake_api = FakeAPI(failing_review_ids=frozenset({2}))
+    monkeypatch.setattr(api, "complete_review", fake_api.complete_review)
+    monkeypatch.setattr(api, "update_progress", fake_api.update_progress)
+    monkeypatch.setattr(config.batch_reviews, "poll_interval", 0.0)
+    monkeypatch.setattr(config.batch_reviews, "max_requests_per_batch", 3)
+    monkeypatch.setattr(config.batch_reviews, "max_tokens", 5000000)
+    return fake_api
+
+
+def write_spool(path: Path, file_counts: list[int]) -> Path:
+    """Write a spool of jobs, the i-th job reviewing `file_counts[i]` files."""
+    path.write_text(
+        "\n".join(
+            json.dumps(
+                {
+                    "review_id": review_id,
+                    "review_status_id": review_id,
+                    "file_diffs": [FILE_DIFF] * file_count,
+                },
+            )
+            for review_id, file_count in enumerate(file_counts, start=1)
+        ),
+    )
+    return path
+
+
+def answer(request: BatchRequest) -> str:
+    """Answer a request with its ID."""
+    return f"Review of {request.custom_id}"
+
+
+def failed_review_ids(spool_path: Path) -> list[int]:
+    """Get the IDs of the reviews written to the failed spool, if any."""
+    failed_path = spool_path.with_name(f"{spool_path.name}.failed")
+    if not failed_path.exists():
+        return []
+    lines = failed_path.read_text().splitlines()
+    return [json.loads(line)["review_id"] for line in lines]
+
+
+def test_jobs_are_packed_whole_into_batches(tmp_path: Path, fake_api: FakeAPI) -> None:
+    """Jobs are packed whole, and a job larger than a batch gets its own."""
+    spool_path = write_spool(tmp_path / "jobs.jsonl", [1, 1, 1, 2, 4])
+    provider = FakeBatchProvider(answer=answer, polls=2)
+
+    asyncio.run(batch_reviews.run_batch_reviews([spool_path], provider))
+
+    assert [
+        [request.custom_id for request in requests]
+        for requests in provider.batches.values()
+    ] == [["0-0", "1-0", "2-0"], ["3-0", "3-1"], ["4-0", "4-1", "4-2", "4-3"]]
+    assert fake_api.completed_reviews[4] == ["Review of 3-0", "Review of 3-1"]
+
+
+def test_failed_job_fails_alone(tmp_path: Path, fake_api: FakeAPI) -> None:
+    """A job whose review fails is written to the failed spool, alone."""
+    spool_path = write_spool(tmp_path / "jobs.jsonl", [1, 1, 1])
+
+    asyncio.run(
+        batch_reviews.run_batch_reviews([spool_path], FakeBatchProvider(answer)),
+    )
+
+    assert sorted(fake_api.completed_reviews) == [1, 3]
+    assert failed_review_ids(spool_path) == [2]
+
+
+def test_missing_answers_fail_their_job(tmp_path: Path, fake_api: FakeAPI) -> None:
+    """A job with an unanswered request fails, the others complete."""
+    spool_path = write_spool(tmp_path / "jobs.jsonl", [1, 2])
+
+    class PartialBatchProvider(FakeBatchProvider):
+        async def results(self: Self, batch_id: str) -> dict[str, str]:
+            answers = await super().results(batch_id)
+            del answers["1-1"]
+            return answers
+
+    asyncio.run(
+        batch_reviews.run_batch_reviews([spool_path], PartialBatchProvider(answer)),
+    )
+
+    assert list(fake_api.completed_reviews) == [1]
+    assert failed_review_ids(spool_path) == [2]
+
+
+def test_token_budget_leaves_jobs_for_later(
+    tmp_path: Path,
+    fake_api: FakeAPI,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Jobs beyond the token budget are left to the failed spool."""
+    spool_path = write_spool(tmp_path / "jobs.jsonl", [1, 4, 1])
+    first_line = spool_path.read_bytes().splitlines()[0]
+    job = asyncio.run(batch_reviews._load_job(0, first_line))  # noqa: SLF001
+    monkeypatch.setattr(config.batch_reviews, "max_tokens", 3 * job.tokens)
+
+    asyncio.run(
+        batch_reviews.run_batch_reviews([spool_path], FakeBatchProvider(answer)),
+    )
+
+    assert sorted(fake_api.completed_reviews) == [1, 3]
+    assert failed_review_ids(spool_path) == [2]
+
+
+def test_interrupted_runs_resume_their_batches(
+    tmp_path: Path,
+    fake_api: FakeAPI,
+) -> None:
+    """Batches in flight when a run is interrupted are polled again, not resubmitted."""
+    spool_path = write_spool(tmp_path / "jobs.jsonl", [1, 1, 1, 1])
+    provider = FakeBatchProvider(answer, polls=1_000_000)
+
+    async def interrupted_run() -> None:
+        await asyncio.wait_for(
+            batch_reviews.run_batch_reviews([spool_path], provider),
+            timeout=0.05,
+        )
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(interrupted_run())
+    batches_path = tmp_path / "jobs.jsonl.batches"
+    assert sorted(path.name for path in batches_path.iterdir()) == [
+        "batch_0.json",
+        "batch_1.json",
+    ]
+
+    provider.polls = 1
+    asyncio.run(batch_reviews.run_batch_reviews([spool_path], provider))
+
+    assert list(provider.batches) == ["batch_0", "batch_1"]
+    assert sorted(fake_api.completed_reviews) == [1, 3, 4]
+    assert failed_review_ids(spool_path) == [2]
+    assert list(batches_path.iterdir()) == []
@@ -0,0 +1,60 @@
+"""Tests of the checkpoints of completed file reviews."""
+
+import asyncio
+from pathlib import Path
+
+from src.reviews.checkpoints import SQLiteCheckpointStore
+from src.reviews.models.pull_requests import FileReview
+
+
+def file_review(filename: str, content: str = "Looks good.") -> FileReview:
+    """Create a file review of `filename`."""
+    return FileReview(filename=filename, content=content, patch="@@ -1 +1 @@\n+a")
+
+
+def test_file_reviews_are_restored_per_review(tmp_path: Path) -> None:
+    """Saved file reviews are loaded back for their review only, latest first."""
+
+    async def run() -> tuple[list[FileReview], list[FileReview]]:
+        store = SQLiteCheckpointStore(tmp_path / "checkpoints" / "reviews.sqlite3")
+        await store.save(1, file_review("a.py", "First."))
+        await store.save(1, file_review("a.py", "Second."))
+        await store.save(1, file_review("b.py"))
+        await store.save(2, file_review("c.py"))
+        return await store.load(1), await store.load(3)
+
+    restored, missing = asyncio.run(run())
+
+    assert sorted((review.filename, review.content) for review in restored) == [
+        ("a.py", "Second."),
+        ("b.py", "Looks good."),
+    ]
+    assert missing == []
+
+
+def test_stale_checkpoints_are_pruned(tmp_path: Path) -> None:
+    """Pruning removes the checkpoints older than the maximum age only."""
+
+    async def run(max_age: float) -> list[FileReview]:
+        store = SQLiteCheckpointStore(tmp_path / "reviews.sqlite3")
+        await store.save(1, file_review("a.py"))
+        await store.prune(max_age)
+        return await store.load(1)
+
+    assert len(asyncio.run(run(max_age=60.0))) == 1
+    assert asyncio.run(run(max_age=-1.0)) == []
+
+
+def test_checkpoints_keep_the_fields_left_out_of_the_api(tmp_path: Path) -> None:
+    """Passes and carried over reviews are restored for follow-up reviews."""
+    saved = file_review("a.py").model_copy(
+        update={"passes": {"security_review": "Safe."}, "carried_over": "Earlier."},
+    )
+
+    async def run() -> list[FileReview]:
+        store = SQLiteCheckpointStore(tmp_path / "reviews.sqlite3")
+        await store.save(1, saved)
+        return await store.load(1)
+
+    assert "passes" not in saved.model_dump()
+    assert asyncio.run(run()) == [saved]
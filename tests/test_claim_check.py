@@ -0,0 +1,80 @@
+"""Tests of the claim-check payloads."""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Callable
+
+import pytest
+
+from src.config import config
+from src.utils import claim_check
+
+
+@pytest.fixture()
+def parse(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> Callable[[bytes, int], list[Any]]:
+    """Parse a payload stored in the claim-check directory, read in chunks."""
+    monkeypatch.setattr(config, "claim_check_directory", str(tmp_path))
+
+    def parse(payload: bytes, chunk_size: int) -> list[Any]:
+        monkeypatch.setattr(claim_check, "CHUNK_SIZE", chunk_size)
+        (tmp_path / "diffs.json").write_bytes(payload)
+        return asyncio.run(collect("diffs.json"))
+
+    return parse
+
+
+async def collect(reference: str) -> list[Any]:
+    """Collect the items of the JSON array stored at `reference`."""
+    return [item async for item in claim_check.iter_json_array(reference)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"[]",
+        b" [ ] ",
+        b"[1, 23456789]",
+        b'[{"a": [1, 2]}, "x,]", true, null, -1.5e3]',
+        '[{"filename": "café.py"}, {"patch": "☃"}]'.encode(),
+    ],
+)
+def test_arrays_are_parsed_across_chunks(
+    parse: Callable[[bytes, int], list[Any]],
+    payload: bytes,
+    chunk_size: int,
+) -> None:
+    """Items are decoded whole, wherever the chunk boundaries fall."""
+    assert parse(payload, chunk_size) == json.loads(payload)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+@pytest.mark.parametrize(
+    "payload",
+    [b"", b"{}", b"[", b"[1", b"[1,]", b"[,1]", b"[1 2]", b"[1] 2", b"[1]]", b"[tru]"],
+)
+def test_malformed_arrays_are_rejected(
+    parse: Callable[[bytes, int], list[Any]],
+    payload: bytes,
+    chunk_size: int,
+) -> None:
+    """Payloads other than a well-formed JSON array are rejected."""
+    with pytest.raises(ValueError, match="JSON array"):
+        parse(payload, chunk_size)
+
+
+def test_local_references_stay_in_the_claim_check_directory(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    """Local payloads are read from the claim-check directory only."""
+    monkeypatch.setattr(config, "claim_check_directory", str(tmp_path))
+    (tmp_path / "diffs.json").write_text('[{"filename": "a.py"}]')
+
+    assert asyncio.run(collect("file://diffs.json")) == [{"filename": "a.py"}]
+    with pytest.raises(ValueError, match="outside"):
+        asyncio.run(collect("../diffs.json"))
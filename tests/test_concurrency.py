@@ -0,0 +1,122 @@
+"""Tests of the adaptive concurrency of file reviews."""
+
+import asyncio
+
+import pytest
+
+from src.utils.concurrency import AdaptiveLimiter
+
+
+def test_limit_is_clamped() -> None:
+    """The initial limit is clamped within the bounds, which must be valid."""
+    assert [
+        AdaptiveLimiter(initial_limit=initial_limit, min_limit=1, max_limit=8).limit
+        for initial_limit in (50, 0)
+    ] == [8, 1]
+    with pytest.raises(ValueError, match="min_limit"):
+        AdaptiveLimiter(initial_limit=4, min_limit=8, max_limit=2)
+
+
+def test_try_acquire_respects_slots() -> None:
+    """Slots are taken until the limit is reached, and returned by `release`."""
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=8)
+
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+def test_success_raises_limit_only_when_reached() -> None:
+    """Successful calls raise the limit only while it is reached."""
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=3)
+
+    limiter.record_success()
+    assert limiter.limit == 2  # noqa: PLR2004
+
+    limiter.try_acquire()
+    limiter.try_acquire()
+    for _ in range(10):
+        limiter.record_success()
+    assert limiter.limit == 3  # noqa: PLR2004
+
+
+def test_congestion_decreases_limit_once_per_cooldown() -> None:
+    """Congestion multiplies the limit, at most once per cooldown, down to the min."""
+    limiter = AdaptiveLimiter(
+        initial_limit=10,
+        min_limit=4,
+        max_limit=16,
+        decrease_factor=0.5,
+        cooldown=60.0,
+    )
+
+    limiter.record_congestion("test")
+    limiter.record_congestion("test")
+    assert limiter.limit == 5  # noqa: PLR2004
+
+    limiter.cooldown = 0.0
+    limiter.record_congestion("test")
+    assert limiter.limit == 4  # noqa: PLR2004
+
+
+def test_waiters_are_woken_in_order() -> None:
+    """Released slots are handed over to the waiters, first come first served."""
+
+    async def run() -> list[int]:
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=4)
+        await limiter.acquire()
+        order: list[int] = []
+
+        async def wait(index: int) -> None:
+            await limiter.acquire()
+            order.append(index)
+
+        tasks = [asyncio.create_task(wait(index)) for index in range(3)]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == [0, 1, 2]
+
+
+def test_cancelled_waiter_does_not_leak_slot() -> None:
+    """A waiter cancelled while waiting neither takes nor loses a slot."""
+
+    async def run() -> AdaptiveLimiter:
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=4)
+        await limiter.acquire()
+        task = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        limiter.release()
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.in_use == 0
+    assert limiter.try_acquire()
+
+
+def test_decrease_below_slots_in_use_blocks_new_slots() -> None:
+    """After a decrease, no slot is taken until enough are returned."""
+    limiter = AdaptiveLimiter(
+        initial_limit=4,
+        min_limit=1,
+        max_limit=4,
+        decrease_factor=0.5,
+    )
+    for _ in range(4):
+        limiter.try_acquire()
+
+    limiter.record_congestion("test")
+    limiter.release()
+    limiter.release()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
@@ -0,0 +1,137 @@
+"""Tests of hedged LLM requests."""
+
+import asyncio
+from types import SimpleNamespace
+from typing import AsyncIterator, Self
+
+import pytest
+from box import Box
+
+from src.utils import hedging
+from src.utils.hedging import HedgeBudget, HedgedRequester, StreamAttempt
+from src.utils.latency import LatencyTracker
+
+HEDGING_CONFIG = Box(
+    {
+        "percentile": 0.5,
+        "min_samples": 2,
+        "default_ttft_threshold": 10.0,
+        "min_tokens_per_second": 0.0,
+        "max_hedge_rate": 1.0,
+        "check_interval": 0.01,
+    },
+)
+
+
+class ChatModel:
+    """Chat model streaming `answer` after `delay` seconds, or failing."""
+
+    def __init__(self: Self, answer: str, delay: float = 0.0) -> None:
+        """Initialize the chat model."""
+        self.answer = answer
+        self.delay = delay
+
+    async def astream(
+        self: Self,
+        input: list,  # noqa: A002, ARG002
+    ) -> AsyncIterator[SimpleNamespace]:
+        """Stream the answer character by character."""
+        await asyncio.sleep(self.delay)
+        if self.answer == "error":
+            msg = "Request failed."
+            raise RuntimeError(msg)
+        for character in self.answer:
+            yield SimpleNamespace(content=character)
+
+
+def attempt(chat_model: ChatModel) -> StreamAttempt:
+    """Start streaming from `chat_model`."""
+    return StreamAttempt(chat_model, [], prompt_tokens=100)  # type: ignore[arg-type]
+
+
+@pytest.fixture(autouse=True)
+def ttft_tracker(monkeypatch: pytest.MonkeyPatch) -> LatencyTracker:
+    """Start every test without TTFT observations."""
+    tracker = LatencyTracker()
+    monkeypatch.setattr(hedging, "ttft_tracker", tracker)
+    return tracker
+
+
+def test_budget_caps_the_share_of_hedges() -> None:
+    """Each request adds `max_rate` to the budget, up to `burst`."""
+    budget = HedgeBudget(max_rate=0.5, burst=1.0)
+
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert not budget.try_spend()
+    for _ in range(10):
+        budget.record_request()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_ttft_threshold_scales_with_the_prompt(ttft_tracker: LatencyTracker) -> None:
+    """The threshold is the usual TTFT per prompt token times the prompt tokens."""
+    requester = HedgedRequester(HEDGING_CONFIG)
+    assert requester.ttft_threshold(prompt_tokens=5000) == 10.0  # noqa: PLR2004
+
+    hedging.record_first_token(ttft=2.0, prompt_tokens=4000)
+    hedging.record_first_token(ttft=2.0, prompt_tokens=4000)
+
+    assert len(ttft_tracker) == 2  # noqa: PLR2004
+    assert requester.ttft_threshold(prompt_tokens=8000) == 4.0  # noqa: PLR2004
+    # Short prompts count as the minimum number of prompt tokens.
+    assert requester.ttft_threshold(prompt_tokens=10) == 0.5  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    ("primary", "hedge", "expected"),
+    [
+        (ChatModel("primary", delay=0.1), ChatModel("hedge"), "hedge"),
+        (ChatModel("primary"), ChatModel("hedge", delay=0.1), "primary"),
+        (ChatModel("error"), ChatModel("hedge", delay=0.05), "hedge"),
+    ],
+)
+def test_race_returns_the_first_success(
+    primary: ChatModel,
+    hedge: ChatModel,
+    expected: str,
+) -> None:
+    """The first attempt to succeed wins, even if the other one fails first."""
+
+    async def run() -> str:
+        return await HedgedRequester._race(  # noqa: SLF001
+            attempt(primary),
+            attempt(hedge),
+        )
+
+    assert asyncio.run(run()) == expected
+
+
+def test_race_surfaces_the_primary_error() -> None:
+    """When both attempts fail, the error of the primary request is raised."""
+
+    async def run() -> str:
+        return await HedgedRequester._race(  # noqa: SLF001
+            attempt(ChatModel("error")),
+            attempt(ChatModel("error")),
+        )
+
+    with pytest.raises(RuntimeError, match="Request failed"):
+        asyncio.run(run())
+
+
+def test_requests_without_first_token_are_hedged() -> None:
+    """A request past the TTFT threshold is hedged, and the faster answer used."""
+    requester = HedgedRequester(HEDGING_CONFIG | {"default_ttft_threshold": 0.02})
+
+    async def run() -> str:
+        return await requester.ask(
+            ChatModel("slow answer", delay=10.0),  # type: ignore[arg-type]
+            ChatModel("fast answer"),  # type: ignore[arg-type]
+            [],
+            prompt_tokens=100,
+        )
+
+    assert asyncio.run(run()) == "fast answer"
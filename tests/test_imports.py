@@ -0,0 +1,24 @@
+"""Tests that transports and LLM providers are imported lazily."""
+
+import subprocess
+import sys
+
+import pytest
+
+LAZY_MODULES = ("aio_pika", "google.cloud.pubsub_v1", "langchain_openai", "openai")
+
+
+@pytest.mark.parametrize("module", ["src.main", "src.utils.llm"])
+def test_transports_and_providers_are_not_imported(module: str) -> None:
+    """Importing the worker loads neither a transport nor an LLM provider."""
+    statement = (
+        f"import sys, {module}; "
+        f"print(*[name for name in {LAZY_MODULES!r} if name in sys.modules])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", statement],  # noqa: S603
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert output.stdout.split() == []
@@ -0,0 +1,156 @@
+"""Tests of the in-memory and spool message queue subscribers."""
+
+import asyncio
+import gc
+import inspect
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from src.config import config
+from src.utils.admission import Admission, Decision, NullAdmissionController
+from src.utils.message_queue import InMemorySubscriber, SpoolSubscriber
+
+
+class DeferringAdmissionController(NullAdmissionController):
+    """Admission controller deferring every job."""
+
+    def admit(self: Self, body: bytes, defers: int = 0) -> Admission:  # noqa: ARG002
+        """Defer the job."""
+        return Admission(decision=Decision.defer, cost=0)
+
+
+async def process(body: bytes) -> None:
+    """Fail the messages whose body is `fail`."""
+    if body == b"fail":
+        msg = "Invalid message."
+        raise ValueError(msg)
+
+
+def test_messages_are_acked_or_failed() -> None:
+    """Processed messages are settled, failed ones are kept aside."""
+
+    async def run() -> list[bytes]:
+        subscriber = InMemorySubscriber(process)
+        for body in (b"ok", b"fail", b"ok"):
+            subscriber.publish(body)
+        await subscriber.start()
+        await asyncio.wait_for(subscriber.join(), timeout=1.0)
+        await subscriber.close()
+        return subscriber.failed
+
+    assert asyncio.run(run()) == [b"fail"]
+
+
+def test_deferred_messages_are_failed_on_drain(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Messages still deferred on drain are kept in `failed`, and settled."""
+    monkeypatch.setattr(config.admission_control, "defer_delay", 60.0)
+
+    async def run() -> list[bytes]:
+        subscriber = InMemorySubscriber(
+            process,
+            admission_controller=DeferringAdmissionController(),
+        )
+        for body in (b"a", b"b"):
+            subscriber.publish(body)
+        await subscriber.start()
+        await asyncio.sleep(0.01)
+        await subscriber.drain(timeout=1.0)
+        await asyncio.wait_for(subscriber.join(), timeout=1.0)
+        return subscriber.failed
+
+    assert asyncio.run(run()) == [b"a", b"b"]
+
+
+def test_interrupted_replay_writes_failed_messages(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Messages deferred when a replay is interrupted go to the failed spool."""
+    monkeypatch.setattr(config.admission_control, "defer_delay", 60.0)
+    spool_path = tmp_path / "messages.jsonl"
+    spool_path.write_text("a\nb\n")
+
+    async def run() -> None:
+        subscriber = SpoolSubscriber(
+            [spool_path],
+            process,
+            admission_controller=DeferringAdmissionController(),
+        )
+        await subscriber.start()
+        await asyncio.sleep(0.01)
+        await subscriber.drain(timeout=1.0)
+        await subscriber.close()
+
+    asyncio.run(run())
+    assert (tmp_path / "messages.jsonl.failed").read_text() == "a\nb\n"
+
+
+def test_bodies_are_held_by_their_processing_only() -> None:
+    """Once handed over, the body is not kept alive by the handling of the message."""
+    bodies = []
+    processed = asyncio.Event()
+
+    async def hold(body: bytes) -> None:
+        bodies.append(body)
+        await processed.wait()
+
+    async def run() -> set[str]:
+        subscriber = InMemorySubscriber(hold)
+        subscriber.publish(b"job")
+        await subscriber.start()
+        while not bodies:
+            await asyncio.sleep(0)
+        holders = {
+            referrer.__qualname__
+            for referrer in gc.get_referrers(bodies.pop())
+            if inspect.iscoroutine(referrer)
+        }
+        processed.set()
+        await asyncio.wait_for(subscriber.join(), timeout=1.0)
+        await subscriber.close()
+        return holders
+
+    assert asyncio.run(run()) == {
+        "MessageQueueSubscriber.process",
+        "test_bodies_are_held_by_their_processing_only.<locals>.hold",
+    }
+
+
+def test_interrupted_replay_writes_unprocessed_messages(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Messages in flight, queued or not read when a replay is interrupted are kept."""
+    monkeypatch.setattr(config.modules.common, "max_concurrent_messages", 1)
+    spool_path = tmp_path / "messages.jsonl"
+    spool_path.write_text("a\nb\nc\nd\ne\n")
+
+    async def run() -> None:
+        subscriber = SpoolSubscriber([spool_path], lambda _: asyncio.sleep(60.0))
+        await subscriber.start()
+        await asyncio.sleep(0.01)
+        await subscriber.drain(timeout=0.01)
+        await subscriber.close()
+
+    asyncio.run(run())
+    failed_path = tmp_path / "messages.jsonl.failed"
+    assert sorted(failed_path.read_text().splitlines()) == ["a", "b", "c", "d", "e"]
+
+
+def test_finished_replays_write_no_unprocessed_messages(tmp_path: Path) -> None:
+    """A replay of which every message was processed leaves no failed spool."""
+    spool_path = tmp_path / "messages.jsonl"
+    spool_path.write_text("a\nb\n")
+
+    async def run() -> None:
+        finished = asyncio.Event()
+        subscriber = SpoolSubscriber([spool_path], process, on_finished=finished.set)
+        await subscriber.start()
+        await asyncio.wait_for(finished.wait(), timeout=1.0)
+        await subscriber.drain(timeout=1.0)
+        await subscriber.close()
+
+    asyncio.run(run())
+    assert not (tmp_path / "messages.jsonl.failed").exists()
@@ -0,0 +1,159 @@
+"""Tests of the patch utilities."""
+
+import json
+import pickle
+
+from src.reviews.models.pull_requests import PullRequestFileChanges
+from src.reviews.patches import (
+    PatchIndex,
+    find_changed_hunks,
+    keeps_hunks,
+    number_lines,
+    split_hunks,
+)
+
+PATCH = (
+    "@@ -1,3 +1,4 @@\n"
+    " import os\n"
+    "-import sys\n"
+    "+import re\n"
+    "+import sys\n"
+    " \n"
+    "@@ -10,2 +11,3 @@ def main():\n"
+    "     run()\n"
+    "+    stop()\n"
+    "     return 0"
+)
+
+
+def test_split_hunks() -> None:
+    """Hunks are split at their headers, with their starting lines."""
+    hunks = split_hunks(PATCH)
+
+    assert [(hunk.old_start, hunk.new_start, hunk.new_count) for hunk in hunks] == [
+        (1, 1, 4),
+        (10, 11, 3),
+    ]
+    assert "\n".join(str(hunk) for hunk in hunks) == PATCH
+
+
+def test_patch_index_maps_new_lines_to_positions() -> None:
+    """Lines of the new file map to their position, removed lines are skipped."""
+    patch_index = PatchIndex(PATCH)
+
+    assert [
+        patch_index.position_of_new_line(line) for line in (1, 2, 4, 12, 5)
+    ] == [1, 3, 5, 8, None]
+
+
+def test_patch_index_maps_positions_to_lines() -> None:
+    """Positions map to the lines of the old and new files shown at them."""
+    patch_index = PatchIndex(PATCH)
+    positions = range(11)
+
+    assert [patch_index.new_line_at(position) for position in positions] == [
+        None,
+        1,
+        None,
+        2,
+        3,
+        4,
+        None,
+        11,
+        12,
+        13,
+        None,
+    ]
+    assert [patch_index.old_line_at(position) for position in positions] == [
+        None,
+        1,
+        2,
+        None,
+        None,
+        3,
+        None,
+        10,
+        None,
+        11,
+        None,
+    ]
+
+
+def test_patch_index_closest_new_line() -> None:
+    """Lines outside the patch snap to the closest line shown in it."""
+    patch_index = PatchIndex(PATCH)
+
+    assert [patch_index.closest_new_line(line) for line in (3, 6, 10, 100)] == [
+        3,
+        4,
+        11,
+        13,
+    ]
+    assert PatchIndex("").closest_new_line(1) is None
+
+
+def test_patch_index_hunk_of_new_line() -> None:
+    """Lines map to the index of the hunk showing them."""
+    patch_index = PatchIndex(PATCH)
+
+    assert [patch_index.hunk_of_new_line(line) for line in (1, 4, 5, 13, 14)] == [
+        0,
+        0,
+        None,
+        1,
+        None,
+    ]
+
+
+def test_number_lines() -> None:
+    """Lines of the new file are numbered, headers and removed lines are not."""
+    numbered_lines = number_lines(PATCH, PatchIndex(PATCH)).splitlines()
+
+    assert numbered_lines[0] == "   @@ -1,3 +1,4 @@"
+    assert numbered_lines[1] == " 1  import os"
+    assert numbered_lines[2] == "   -import sys"
+    assert numbered_lines[3] == " 2 +import re"
+    assert numbered_lines[8] == "12 +    stop()"
+
+
+def test_find_changed_hunks_ignores_shifted_hunks() -> None:
+    """Hunks moved by changes elsewhere count as unchanged."""
+    previous_patch = "@@ -1,1 +1,2 @@\n a\n+b\n@@ -10,1 +11,2 @@\n c\n+d"
+    patch = "@@ -1,1 +1,3 @@\n a\n+b\n+e\n@@ -10,1 +12,2 @@\n c\n+d"
+
+    changed_hunks, unchanged_hunks = find_changed_hunks(previous_patch, patch)
+
+    assert [hunk.body for hunk in changed_hunks] == [" a\n+b\n+e"]
+    assert unchanged_hunks == 1
+
+
+def test_keeps_hunks() -> None:
+    """Previous hunks are kept only if unchanged and at the same lines."""
+    previous_patch = "@@ -1,1 +1,2 @@\n a\n+b"
+    added_hunk = previous_patch + "\n@@ -10,1 +11,2 @@\n c\n+d"
+    shifted_hunk = "@@ -1,1 +3,2 @@\n a\n+b"
+    modified_hunk = "@@ -1,1 +1,2 @@\n a\n+x"
+
+    assert keeps_hunks(previous_patch, added_hunk)
+    assert not keeps_hunks(previous_patch, shifted_hunk)
+    assert not keeps_hunks(previous_patch, modified_hunk)
+
+
+def test_file_changes_are_indexed_when_parsed() -> None:
+    """The patch index is built along with the file changes, and pickled with them."""
+    file_diff = PullRequestFileChanges.model_validate_json(
+        json.dumps(
+            {
+                "filename": "main.py",
+                "patch": PATCH,
+                "additions": 3,
+                "deletions": 1,
+                "changes": 4,
+            },
+        ),
+    )
+
+    assert file_diff.__pydantic_private__ is not None
+    assert isinstance(file_diff.__pydantic_private__["_patch_index"], PatchIndex)
+    restored = pickle.loads(pickle.dumps(file_diff))  # noqa: S301
+    assert restored.patch_index.new_lines == file_diff.patch_index.new_lines
@@ -0,0 +1,89 @@
+"""Tests of the additional review passes and the tools they run."""
+
+import inspect
+
+import pytest
+
+from src.common.constants import Tools
+from src.common.tools.prompt_tool import PromptTool
+from src.common.tools.review_pull_request import ReviewPullRequest
+from src.common.tools.security_review import SecurityReview
+from src.config import config
+from src.reviews import pipeline
+from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+from src.utils import metrics
+from src.utils.exceptions import ConfigError
+
+
+def file_diff(filename: str, changes: int) -> PullRequestFileChanges:
+    """Create the changes of `filename`, all additions."""
+    return PullRequestFileChanges(
+        filename=filename,
+        patch="@@ -0,0 +1 @@\n+a",
+        additions=changes,
+        deletions=0,
+        changes=changes,
+    )
+
+
+@pytest.fixture()
+def _all_passes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Enable all the additional passes."""
+    monkeypatch.setattr(
+        config.modules.reviews,
+        "additional_passes",
+        [Tools.SECURITY_REVIEW, Tools.SUMMARIZE_FILE],
+    )
+
+
+@pytest.mark.usefixtures("_all_passes")
+def test_passes_are_selected_by_the_files_they_apply_to() -> None:
+    """Passes are skipped before any LLM call when they don't apply to a file."""
+    skipped = metrics.snapshot().get("reviews.skipped_passes", 0)
+
+    assert pipeline.select_passes(file_diff("app.py", changes=100)) == [
+        Tools.SECURITY_REVIEW,
+        Tools.SUMMARIZE_FILE,
+    ]
+    assert pipeline.select_passes(file_diff("app.py", changes=1)) == [
+        Tools.SECURITY_REVIEW,
+    ]
+    assert pipeline.select_passes(file_diff("README.md", changes=1)) == []
+    assert metrics.snapshot()["reviews.skipped_passes"] == skipped + 3
+
+
+def test_unknown_passes_are_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A misspelled pass in the configuration fails loudly."""
+    monkeypatch.setattr(config.modules.reviews, "additional_passes", ["lint"])
+
+    with pytest.raises(ConfigError, match="Unknown review pass: lint"):
+        pipeline.get_additional_passes()
+
+
+def test_passes_are_merged_and_stripped() -> None:
+    """The outputs of passes are appended to a review, and can be removed again."""
+    file_review = FileReview(filename="app.py", content="Looks good.", patch="")
+
+    merged = pipeline.merge_passes(file_review, {"security_review": "Safe."})
+
+    assert merged.content == "Looks good.\n\n---\n\n### Security review\n\nSafe."
+    assert merged.passes == {"security_review": "Safe."}
+    assert pipeline.strip_passes(merged) == "Looks good."
+
+
+def test_file_tools_prompt_with_the_numbered_patch() -> None:
+    """The patch is numbered once by the caller and shared by the tools."""
+    request = file_diff("app.py", changes=1)
+
+    assert SecurityReview.get_prompt_context(
+        request=request,
+        numbered_patch="1 +a",
+    ) == {"filename": "app.py", "patch": "1 +a"}
+    with pytest.raises(ValueError, match="numbered_patch"):
+        SecurityReview.get_prompt_context(request=request)
+
+
+def test_tools_provide_their_prompt_context() -> None:
+    """Prompt tools must implement their prompt context, and apply to files."""
+    assert inspect.isabstract(PromptTool)
+    assert ReviewPullRequest.applies_to(request=file_diff("README.md", changes=1))
@@ -0,0 +1,78 @@
+"""Tests of the Pub/Sub subscriber, with a fake subscriber client."""
+
+import asyncio
+from concurrent.futures import Future
+from typing import Any, Self
+
+import pytest
+from google.cloud import pubsub_v1
+
+from src.config import config
+from src.utils.pubsub import AsyncPubSubSubscriber, PubSubDelivery
+
+
+class Message:
+    """Fake Pub/Sub message, recording how it is settled."""
+
+    def __init__(self: Self, delivery_attempt: int | None = None) -> None:
+        """Initialize the message."""
+        self.data = b"job"
+        self.delivery_attempt = delivery_attempt
+        self.settled: list[str] = []
+
+    def ack(self: Self) -> None:
+        """Record the ack."""
+        self.settled.append("ack")
+
+    def nack(self: Self) -> None:
+        """Record the nack."""
+        self.settled.append("nack")
+
+
+async def process(body: bytes) -> None:  # noqa: ARG001
+    """Process nothing."""
+
+
+class SubscriberClient:
+    """Fake subscriber client, recording the arguments of `subscribe`."""
+
+    def __init__(self: Self) -> None:
+        """Initialize the client."""
+        self.subscribe_kwargs: dict[str, Any] = {}
+
+    def subscription_path(self: Self, project_id: str, subscription_id: str) -> str:
+        """Get the path of a subscription."""
+        return f"projects/{project_id}/subscriptions/{subscription_id}"
+
+    def subscribe(self: Self, path: str, **kwargs: Any) -> Any:  # noqa: ARG002
+        """Record the arguments, and return a pending future."""
+        self.subscribe_kwargs = kwargs
+        return Future()
+
+    def close(self: Self) -> None:
+        """Close the client."""
+
+
+@pytest.mark.parametrize("delivery_attempt", [None, 2])
+def test_failed_messages_are_nacked(delivery_attempt: int | None) -> None:
+    """Failed messages are never dropped, with or without a dead-letter policy."""
+    message: Any = Message(delivery_attempt)
+
+    asyncio.run(PubSubDelivery(message).fail())
+
+    assert message.settled == ["nack"]
+
+
+def test_leased_messages_are_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    """At most `max_concurrent_messages` messages are leased at a time."""
+    monkeypatch.setattr(pubsub_v1, "SubscriberClient", SubscriberClient)
+    monkeypatch.setattr(config.modules.common, "max_concurrent_messages", 3)
+
+    async def run() -> dict[str, Any]:
+        subscriber = AsyncPubSubSubscriber("project", "reviews", process)
+        await subscriber.start()
+        client: Any = subscriber.subscriber
+        return client.subscribe_kwargs
+
+    subscribe_kwargs = asyncio.run(run())
+    assert subscribe_kwargs["flow_control"].max_messages == 3  # noqa: PLR2004
@@ -0,0 +1,52 @@
+"""Tests of the pull requests controller."""
+
+import asyncio
+import json
+from typing import Any
+
+import pytest
+from pydantic import ValidationError
+
+from src.reviews.controllers import pull_requests_controller
+from src.reviews.services import pull_requests_service
+
+FILE_DIFF = {
+    "filename": "app.py",
+    "patch": "@@ -1 +1 @@\n-a = 1\n+a = 2",
+    "additions": 1,
+    "deletions": 1,
+    "changes": 2,
+}
+
+
+def test_review_is_created_from_raw_bytes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The request is validated straight from the raw message body."""
+    calls = []
+
+    async def create_review_from_file_diffs(**kwargs: Any) -> None:
+        calls.append(kwargs)
+
+    monkeypatch.setattr(
+        pull_requests_service,
+        "create_review_from_file_diffs",
+        create_review_from_file_diffs,
+    )
+    message = json.dumps(
+        {"review_id": 1, "review_status_id": 2, "file_diffs": [FILE_DIFF]},
+    ).encode()
+
+    asyncio.run(pull_requests_controller.create_review_from_file_diffs(message))
+
+    [call] = calls
+    assert call["review_id"] == 1
+    assert call["total_files"] == 1
+    [file_diff] = call["file_diffs"]
+    assert file_diff.filename == "app.py"
+
+
+def test_invalid_messages_are_rejected() -> None:
+    """Malformed bodies fail validation before any review is created."""
+    with pytest.raises(ValidationError):
+        asyncio.run(
+            pull_requests_controller.create_review_from_file_diffs(b'{"review_id":'),
+        )
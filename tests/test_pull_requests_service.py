@@ -0,0 +1,231 @@
+"""Tests of the pull request review service, with a fake LLM."""
+
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncIterator, Self
+
+import pytest
+
+from src.common.constants import Tools
+from src.common.tools.review_pull_request import ReviewPullRequest
+from src.common.tools.security_review import SecurityReview
+from src.config import config
+from src.reviews.checkpoints import SQLiteCheckpointStore
+from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+from src.reviews.services import pull_requests_service
+from src.reviews.services.pull_requests_service import (
+    CARRIED_OVER_HEADER,
+    create_review_from_file_diffs,
+)
+from src.utils import api, concurrency, metrics
+
+FIRST_HUNK = "@@ -1,2 +1,2 @@\n a\n-b\n+B"
+SECOND_HUNK = "@@ -20,2 +20,2 @@\n x\n-y\n+Y"
+BOTH_HUNKS = f"{FIRST_HUNK}\n{SECOND_HUNK}"
+
+
+def refactor_patch(name: str, new_start: int = 1) -> str:
+    """Make the patch of a refactor using identifiers derived from `name`."""
+    body = "\n".join(
+        f"+    {name}_total = compute_{name}(items, {index})" for index in range(30)
+    )
+    return f"@@ -0,0 +{new_start},30 @@\n{body}"
+
+
+def file_diff(patch: str, filename: str = "app.py") -> PullRequestFileChanges:
+    """Create the changes of `filename`."""
+    return PullRequestFileChanges(
+        filename=filename,
+        patch=patch,
+        additions=1,
+        deletions=1,
+        changes=2,
+    )
+
+
+class FakeReviews:
+    """Fake LLM reviewing a patch as `Review of <hunk headers>`, and fake API."""
+
+    def __init__(self: Self) -> None:
+        """Initialize the fake."""
+        self.reviewed_patches: list[str] = []
+        self.numbered_patches: list[str] = []
+        self.completed_reviews: dict[int, list[FileReview]] = {}
+
+    async def arun(self: Self, **kwargs: Any) -> AsyncIterator[str]:
+        """Review the patch of `request`."""
+        if kwargs["request"].filename == "fail.py":
+            msg = "Request failed."
+            raise RuntimeError(msg)
+        patch = kwargs["request"].patch
+        self.reviewed_patches.append(patch)
+        self.numbered_patches.append(kwargs["numbered_patch"])
+        headers = [line for line in patch.splitlines() if line.startswith("@@")]
+        return _stream(f"Review of {' '.join(headers)}")
+
+    async def complete_review(
+        self: Self,
+        review_id: int,
+        file_reviews: list[FileReview],
+        **kwargs: Any,  # noqa: ARG002
+    ) -> None:
+        """Record the completed review."""
+        self.completed_reviews[review_id] = file_reviews
+
+    async def update_progress(self: Self, *args: Any) -> None:
+        """Ignore progress."""
+
+
+async def _stream(answer: str) -> AsyncIterator[str]:
+    yield answer
+
+
+@pytest.fixture()
+def fake_reviews(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> FakeReviews:
+    """Review with a fake LLM and API, and checkpoints in a temporary directory."""
+    fake_reviews = FakeReviews()
+    store = SQLiteCheckpointStore(tmp_path / "reviews.sqlite3")
+    monkeypatch.setattr(pull_requests_service, "get_checkpoint_store", lambda: store)
+    monkeypatch.setattr(
+        ReviewPullRequest,
+        "arun",
+        lambda **kwargs: fake_reviews.arun(**kwargs),
+    )
+    monkeypatch.setattr(api, "complete_review", fake_reviews.complete_review)
+    monkeypatch.setattr(api, "update_progress", fake_reviews.update_progress)
+    return fake_reviews
+
+
+def review(
+    file_diffs: list[PullRequestFileChanges],
+    review_id: int,
+    previous_review_id: int | None = None,
+) -> None:
+    """Review `file_diffs`."""
+    asyncio.run(
+        create_review_from_file_diffs(
+            file_diffs=file_diffs,
+            review_id=review_id,
+            review_status_id=review_id,
+            total_files=len(file_diffs),
+            previous_review_id=previous_review_id,
+        ),
+    )
+
+
+def test_follow_up_reviews_review_new_hunks_only(fake_reviews: FakeReviews) -> None:
+    """The previous free-form review is carried over for the unchanged hunks."""
+    review([file_diff(FIRST_HUNK)], review_id=1)
+    review([file_diff(BOTH_HUNKS)], review_id=2, previous_review_id=1)
+
+    assert fake_reviews.reviewed_patches == [FIRST_HUNK, SECOND_HUNK]
+    [file_review] = fake_reviews.completed_reviews[2]
+    previous_content = "Review of @@ -1,2 +1,2 @@"
+    assert file_review.carried_over == previous_content
+    assert file_review.content == (
+        "Review of @@ -20,2 +20,2 @@" + CARRIED_OVER_HEADER + previous_content
+    )
+    # The carried over review is part of the content sent to the API only once.
+    assert "carried_over" not in file_review.model_dump()
+
+
+def test_missing_previous_reviews_are_reviewed_in_full(
+    fake_reviews: FakeReviews,
+) -> None:
+    """Without the previous review, e.g. made by another pod, all hunks are reviewed."""
+    missing = metrics.snapshot().get("reviews.previous_review_missing", 0)
+
+    review([file_diff(BOTH_HUNKS)], review_id=2, previous_review_id=1)
+
+    assert fake_reviews.reviewed_patches == [BOTH_HUNKS]
+    assert metrics.snapshot()["reviews.previous_review_missing"] == missing + 1
+
+
+def test_passes_run_alongside_the_review(
+    fake_reviews: FakeReviews,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Passes get the patch numbered for the review, and are merged into it."""
+    numbered_patches = []
+
+    async def security_review(**kwargs: Any) -> AsyncIterator[str]:
+        numbered_patches.append(kwargs["numbered_patch"])
+        return _stream("Safe.")
+
+    monkeypatch.setattr(
+        config.modules.reviews,
+        "additional_passes",
+        [Tools.SECURITY_REVIEW],
+    )
+    monkeypatch.setattr(SecurityReview, "arun", security_review)
+
+    review([file_diff(FIRST_HUNK)], review_id=1)
+
+    [file_review] = fake_reviews.completed_reviews[1]
+    assert numbered_patches == fake_reviews.numbered_patches
+    assert file_review.passes == {"security_review": "Safe."}
+    assert file_review.content == (
+        "Review of @@ -1,2 +1,2 @@\n\n---\n\n### Security review\n\nSafe."
+    )
+
+
+def test_near_duplicate_files_reuse_reviews_at_the_same_lines(
+    fake_reviews: FakeReviews,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Free-form reviews are adapted to near-duplicates whose hunks line up only."""
+    monkeypatch.setattr(config.modules.reviews.semantic_cache, "enabled", True)
+    unadapted = metrics.snapshot().get("semantic_cache.unadapted_reviews", 0)
+
+    review(
+        [
+            file_diff(refactor_patch("user"), "user.py"),
+            file_diff(refactor_patch("order"), "order.py"),
+            file_diff(refactor_patch("item", new_start=10), "item.py"),
+        ],
+        review_id=1,
+    )
+
+    assert fake_reviews.reviewed_patches == [
+        refactor_patch("user"),
+        refactor_patch("item", new_start=10),
+    ]
+    reviews = {
+        file_review.filename: file_review.content
+        for file_review in fake_reviews.completed_reviews[1]
+    }
+    assert reviews["order.py"].endswith("Review of @@ -0,0 +1,30 @@")
+    assert reviews["item.py"] == "Review of @@ -0,0 +10,30 @@"
+    assert metrics.snapshot()["semantic_cache.unadapted_reviews"] == unadapted + 1
+
+
+@pytest.mark.usefixtures("fake_reviews")
+def test_failed_reviews_return_their_slots(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Calls cancelled by a failed review, even before they start, return slots."""
+    monkeypatch.setattr(
+        config.modules.reviews.concurrency_autotuning,
+        "enabled",
+        True,
+    )
+    monkeypatch.setattr(
+        config.modules.reviews,
+        "additional_passes",
+        [Tools.SECURITY_REVIEW],
+    )
+
+    async def run() -> int:
+        with pytest.raises(ExceptionGroup):
+            await create_review_from_file_diffs(
+                file_diffs=[
+                    file_diff(FIRST_HUNK, "fail.py"),
+                    file_diff(FIRST_HUNK, "a.py"),
+                    file_diff(FIRST_HUNK, "b.py"),
+                ],
+                review_id=1,
+                review_status_id=1,
+            )
+        limiter = concurrency.get_shared_limiter()
+        assert limiter is not None
+        return limiter.in_use
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,160 @@
+"""Tests of the semantic cache of file reviews."""
+
+import asyncio
+from array import array
+
+from box import Box
+
+from src.reviews.models.pull_requests import FileReview, PullRequestFileChanges
+from src.reviews.semantic_cache import (
+    MinHashEmbedder,
+    SemanticCache,
+    _similarity,
+    adapt_review,
+    map_identifiers,
+    normalize_patch,
+)
+
+OTHER_PATCH = "@@ -0,0 +1,20 @@\n" + "\n".join(
+    f"+if x > {index}: return [x] * y" for index in range(20)
+)
+
+
+def make_patch(name: str, lines: int = 30) -> str:
+    """Make a patch of `lines` added lines, using identifiers derived from `name`."""
+    body = "\n".join(
+        f"+    {name}_total = compute_{name}(items, {index})" for index in range(lines)
+    )
+    return f"@@ -0,0 +1,{lines} @@\n{body}"
+
+
+def make_file_diff(filename: str, patch: str) -> PullRequestFileChanges:
+    """Make the file diff of an added file."""
+    additions = patch.count("\n+")
+    return PullRequestFileChanges(
+        filename=filename,
+        patch=patch,
+        additions=additions,
+        deletions=0,
+        changes=additions,
+    )
+
+
+def make_cache() -> SemanticCache:
+    """Make a cache with MinHash signatures."""
+    return SemanticCache(
+        MinHashEmbedder(signature_size=128),
+        Box({"bands": 32, "threshold": 0.9, "max_entries": 2, "min_tokens": 50}),
+    )
+
+
+async def signature(cache: SemanticCache, filename: str, patch: str) -> array:
+    """Get the signature of the file diff of an added file."""
+    file_signature = await cache.signature(make_file_diff(filename, patch))
+    assert file_signature is not None
+    return file_signature
+
+
+def test_normalize_patch_renames_identifiers() -> None:
+    """Patches differing only in names are normalized alike."""
+    assert normalize_patch(make_patch("user")) == normalize_patch(make_patch("order"))
+    assert normalize_patch("+a = b\n c\n-b") == ["+", "v0", "=", "v1", "-", "v1"]
+
+
+def test_signatures_of_near_duplicates_are_similar() -> None:
+    """Renamed patches have equal signatures, different patches do not."""
+
+    async def run() -> tuple[float, float]:
+        cache = make_cache()
+        user = await signature(cache, "user.py", make_patch("user"))
+        order = await signature(cache, "order.py", make_patch("order"))
+        other = await signature(cache, "other.py", OTHER_PATCH)
+        return _similarity(user, order), _similarity(user, other)
+
+    near_duplicate_similarity, other_similarity = asyncio.run(run())
+    assert near_duplicate_similarity == 1.0  # noqa: PLR2004
+    assert other_similarity < 0.5  # noqa: PLR2004
+
+
+def test_small_patches_have_no_signature() -> None:
+    """Patches below `min_tokens` are not cached."""
+    cache = make_cache()
+    file_diff = make_file_diff("small.py", "@@ -0,0 +1,1 @@\n+x = 1")
+
+    assert asyncio.run(cache.signature(file_diff)) is None
+
+
+def test_find_and_evict() -> None:
+    """Near-duplicates are found, and the least recently used entry is evicted."""
+
+    async def run() -> None:
+        cache = make_cache()
+        signatures = [
+            await signature(cache, f"{name}.py", make_patch(name))
+            for name in ("user", "order")
+        ]
+        assert cache.find(signatures[0]) is None
+
+        entry = cache.add("user.py", signatures[0])
+        found = cache.find(signatures[1])
+        assert found is not None
+        assert found[0] is entry
+
+        other_signature = await signature(cache, "a.py", OTHER_PATCH)
+        cache.add("a.py", other_signature)
+        cache.add("b.py", other_signature)
+        assert cache.find(signatures[1]) is None
+
+    asyncio.run(run())
+
+
+def test_map_identifiers() -> None:
+    """Identifiers are mapped one to one, or not at all."""
+    assert map_identifiers(make_patch("user"), make_patch("order")) == {
+        "user_total": "order_total",
+        "compute_user": "compute_order",
+    }
+    assert map_identifiers("+x = f(x)\n+y = g(x)", "+x = f(x)\n+x = g(x)") is None
+
+
+def test_adapt_review_renames_file_and_identifiers() -> None:
+    """Adapted reviews mention the file and identifiers of the near-duplicate."""
+    file_review = FileReview(
+        filename="src/user.py",
+        content="`compute_user` in src/user.py overwrites `user_total`.",
+        patch=make_patch("user"),
+    )
+    file_diff = make_file_diff("src/order.py", make_patch("order"))
+
+    adapted_review = adapt_review(file_review, file_diff, 1.0)
+
+    assert adapted_review is not None
+    assert adapted_review.filename == "src/order.py"
+    assert adapted_review.patch == file_diff.patch
+    assert adapted_review.content.endswith(
+        "`compute_order` in src/order.py overwrites `order_total`.",
+    )
+
+
+def test_adapt_review_refuses_unmapped_identifiers() -> None:
+    """Reviews are not adapted when identifiers cannot be mapped one to one."""
+    file_review = FileReview(
+        filename="a.py",
+        content="Looks good.",
+        patch="@@ -0,0 +1,2 @@\n+x = f(x)\n+y = g(x)",
+    )
+    file_diff = make_file_diff("b.py", "@@ -0,0 +1,2 @@\n+x = f(x)\n+x = g(x)")
+
+    assert adapt_review(file_review, file_diff, 0.9) is None
+
+
+def test_adapt_review_refuses_free_form_reviews_of_moved_hunks() -> None:
+    """Free-form reviews refer to lines, so they are reused at the same lines only."""
+    file_review = FileReview(
+        filename="src/user.py",
+        content="Line 3 of src/user.py overwrites `user_total`.",
+        patch=make_patch("user"),
+    )
+    moved_patch = make_patch("order").replace("@@ -0,0 +1,30 @@", "@@ -9,0 +10,30 @@")
+
+    assert adapt_review(file_review, make_file_diff("a.py", moved_patch), 1.0) is None
@@ -0,0 +1,65 @@
+"""Tests of the graceful shutdown of the worker."""
+
+import asyncio
+from typing import Self
+
+from src.utils.shutdown import InFlightTasks, ShutdownCoordinator
+
+
+class Consumer:
+    """Consumer recording the shutdown steps."""
+
+    def __init__(self: Self, steps: list[str]) -> None:
+        """Initialize the consumer."""
+        self.steps = steps
+
+    async def drain(self: Self, timeout: float) -> None:
+        """Record the drain."""
+        self.steps.append(f"drain {timeout}")
+
+    async def close(self: Self) -> None:
+        """Record the close."""
+        self.steps.append("close")
+
+
+def test_unfinished_tasks_are_cancelled_on_drain() -> None:
+    """Tasks finishing before the timeout complete, the others are cancelled."""
+
+    async def run() -> tuple[int, list[bool]]:
+        in_flight = InFlightTasks()
+        tasks = [
+            asyncio.create_task(asyncio.sleep(0)),
+            asyncio.create_task(asyncio.sleep(60)),
+        ]
+        for task in tasks:
+            in_flight.track(task)
+        cancelled = await in_flight.drain(timeout=0.1)
+        assert len(in_flight) == 0
+        return cancelled, [task.cancelled() for task in tasks]
+
+    assert asyncio.run(run()) == (1, [False, True])
+
+
+def test_consumers_are_drained_before_the_cleanups() -> None:
+    """Consumers are drained and closed, then every cleanup runs, even if one fails."""
+    steps: list[str] = []
+
+    async def failing_cleanup() -> None:
+        steps.append("failing cleanup")
+        msg = "Cleanup failed."
+        raise RuntimeError(msg)
+
+    async def cleanup() -> None:
+        steps.append("cleanup")
+
+    async def run() -> None:
+        coordinator = ShutdownCoordinator(timeout=5.0)
+        coordinator.add_consumer(Consumer(steps))
+        coordinator.add_cleanup(failing_cleanup)
+        coordinator.add_cleanup(cleanup)
+        coordinator.request_shutdown()
+        await coordinator.wait_for_shutdown()
+
+    asyncio.run(run())
+
+    assert steps == ["drain 5.0", "close", "failing cleanup", "cleanup"]
@@ -0,0 +1,115 @@
+"""Tests of the structured review output."""
+
+import asyncio
+import json
+from typing import AsyncIterator
+
+from src.reviews.constants import ReviewCommentSeverity
+from src.reviews.models.pull_requests import ReviewComment
+from src.reviews.patches import PatchIndex
+from src.reviews.structured_reviews import (
+    JsonLinesParser,
+    carry_over_comments,
+    parse_structured_review,
+    validate_comments,
+)
+
+PATCH = """@@ -1,2 +1,3 @@
+ import os
++import re
+ import sys
+@@ -10,2 +11,3 @@ def main():
+     run()
++    stop()
+     return 0"""
+# The same hunks, after two lines were added at the top of the file and the
+# second hunk changed.
+NEW_PATCH = """@@ -0,0 +1,2 @@
++# Copyright
++
+@@ -1,2 +3,3 @@
+ import os
++import re
+ import sys
+@@ -10,2 +13,3 @@ def main():
+     run()
++    stop(now=True)
+     return 0"""
+
+
+def comment(start_line: int, end_line: int, body: str = "Fix it.") -> dict:
+    """Create a raw comment."""
+    return {
+        "start_line": start_line,
+        "end_line": end_line,
+        "severity": "minor",
+        "body": body,
+    }
+
+
+def test_json_lines_are_parsed_across_chunks() -> None:
+    """Objects are parsed once their line is complete, other lines are skipped."""
+    parser = JsonLinesParser()
+
+    objects = parser.feed('```jsonl\n{"a": 1}\n{"b"')
+    objects += parser.feed(': 2}\n[3]\n{"c": \n')
+    objects += parser.feed('{"d": 4}')
+    objects += parser.flush()
+
+    assert objects == [{"a": 1}, {"b": 2}, {"d": 4}]
+    assert parser.invalid_lines == 1
+
+
+def test_comments_are_validated_and_anchored() -> None:
+    """Invalid comments are dropped, the others moved onto lines of the patch."""
+    comments, invalid_comments = validate_comments(
+        [
+            comment(3, 2),
+            comment(5, 9),
+            {"start_line": 1, "body": "No end line."},
+            comment(1, 1) | {"severity": "blocker"},
+        ],
+        PatchIndex(PATCH),
+    )
+
+    assert invalid_comments == 2  # noqa: PLR2004
+    assert [
+        (comment.start_line, comment.end_line, comment.position)
+        for comment in comments
+    ] == [(2, 3, 3), (3, 11, 5)]
+    assert comments[0].severity is ReviewCommentSeverity.minor
+
+
+def test_comments_on_unchanged_hunks_are_carried_over() -> None:
+    """Comments follow their hunk when it moves, and are dropped when it changed."""
+    comments = [
+        ReviewComment.model_validate(comment(2, 2, "Unused import.")),
+        ReviewComment.model_validate(comment(12, 12, "Stop gracefully.")),
+    ]
+
+    carried_over = carry_over_comments(
+        comments,
+        PATCH,
+        NEW_PATCH,
+        PatchIndex(NEW_PATCH),
+    )
+
+    assert [
+        (comment.start_line, comment.position, comment.body)
+        for comment in carried_over
+    ] == [(4, 5, "Unused import.")]
+
+
+def test_structured_reviews_are_parsed_while_streaming() -> None:
+    """Streamed comments are validated in the executor and sorted by line."""
+    lines = [json.dumps(comment(line, line)) for line in (12, 2, 11)]
+
+    async def stream() -> AsyncIterator[str]:
+        text = "\n".join(lines)
+        for start in range(0, len(text), 7):
+            yield text[start : start + 7]
+
+    async def run() -> list[ReviewComment]:
+        return await parse_structured_review(stream(), PatchIndex(PATCH))
+
+    assert [comment.start_line for comment in asyncio.run(run())] == [2, 11, 12]
@@ -0,0 +1,98 @@
+"""Tests of the summary of whole pull requests."""
+
+import asyncio
+from typing import Any, AsyncIterator, Self
+
+import pytest
+from box import Box
+
+from src.common.tools.summarize_pull_request import SummarizePullRequest
+from src.config import config
+from src.reviews.models.pull_requests import FileReview
+from src.reviews.summaries import summarize_pull_request
+from src.utils import metrics
+
+SUMMARY_CONFIG = {
+    "enabled": True,
+    "max_group_tokens": 100,
+    "max_calls": 20,
+    "max_concurrency": 2,
+    "timeout": 10.0,
+}
+
+
+class FakeSummaries:
+    """Fake LLM summarizing documents after `delay` seconds."""
+
+    def __init__(self: Self, delay: float = 0.0) -> None:
+        """Initialize the fake."""
+        self.delay = delay
+        self.calls: list[tuple[int, bool]] = []
+
+    async def arun(self: Self, **kwargs: Any) -> AsyncIterator[str]:
+        """Record the number of documents and whether the summary is partial."""
+        self.calls.append((len(kwargs["documents"]), kwargs["partial"]))
+        await asyncio.sleep(self.delay)
+        return _stream("Partial summary." if kwargs["partial"] else "Summary.")
+
+
+async def _stream(answer: str) -> AsyncIterator[str]:
+    yield answer
+
+
+def summarize(
+    monkeypatch: pytest.MonkeyPatch,
+    fake_summaries: FakeSummaries,
+    **summary_config: Any,
+) -> str | None:
+    """Summarize four file reviews, each filling a group on its own."""
+    monkeypatch.setattr(
+        config.modules.reviews,
+        "pull_request_summary",
+        Box(SUMMARY_CONFIG | summary_config),
+    )
+    monkeypatch.setattr(
+        SummarizePullRequest,
+        "arun",
+        lambda **kwargs: fake_summaries.arun(**kwargs),
+    )
+    file_reviews = [
+        FileReview(filename=f"{name}.py", content="x" * 240, patch="")
+        for name in "abcd"
+    ]
+    return asyncio.run(summarize_pull_request(file_reviews))
+
+
+def test_groups_are_summarized_then_reduced(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Each group is summarized, and the partial summaries summarized once more."""
+    fake_summaries = FakeSummaries()
+
+    summary = summarize(monkeypatch, fake_summaries, max_calls=5)
+
+    assert summary == "Summary."
+    assert fake_summaries.calls == [(1, True)] * 4 + [(4, False)]
+
+
+def test_summaries_stay_within_the_call_budget(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Without calls left to reduce, the final call gets what fits of the reviews."""
+    fake_summaries = FakeSummaries()
+    omitted = metrics.snapshot().get("pull_request_summary.omitted_documents", 0)
+
+    summary = summarize(monkeypatch, fake_summaries, max_calls=4)
+
+    assert summary == "Summary."
+    # Only one review fits, at `MIN_DOCUMENT_TOKENS` tokens, in a single call.
+    assert fake_summaries.calls == [(1, False)]
+    assert metrics.snapshot()["pull_request_summary.omitted_documents"] == omitted + 3
+
+
+def test_slow_summaries_are_left_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Summarizing past the timeout leaves the summary out of the review."""
+    timeouts = metrics.snapshot().get("pull_request_summary.timeouts", 0)
+
+    summary = summarize(monkeypatch, FakeSummaries(delay=10.0), timeout=0.01)
+
+    assert summary is None
+    assert metrics.snapshot()["pull_request_summary.timeouts"] == timeouts + 1